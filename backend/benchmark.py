@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+"""
+Load-test / benchmark harness for the MediLens API.
+
+  python benchmark.py run --fake                 # start an offline server (fake Gemini) and benchmark it
+  python benchmark.py run --url http://localhost:8000 -c 32 -n 500
+  python benchmark.py serve --port 8100          # just the offline server
+  python benchmark.py compare old.json new.json  # flag p95/p99/throughput regressions
+  python benchmark.py startup                    # import time and time-to-first-request of a new worker
+  python benchmark.py monitor --fake --streams 2000  # many concurrent bedside monitor WebSocket streams
+
+Each endpoint is driven in turn by `concurrency` workers until `requests`
+calls have completed. Results (p50/p95/p99 latency, throughput, error rate,
+status codes, and time to first byte for streaming endpoints) are written as
+JSON so runs from different versions can be compared.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+
+def sample_patient(rng):
+    return {
+        "name": f"Patient {rng.randint(1, 10 ** 6)}",
+        "age": str(rng.randint(25, 85)),
+        "gender": rng.choice(["Male", "Female"])
+    }
+
+
+# Share of sampled patients with all-normal vitals (--healthy-share), like outpatient traffic
+healthy_share = 0.0
+
+
+def sample_healthy_vitals(rng):
+    height = rng.randint(155, 190)
+    return {
+        "systolic": rng.randint(105, 125),
+        "diastolic": rng.randint(65, 80),
+        "heartRate": rng.randint(62, 90),
+        "temperature": round(rng.uniform(36.3, 37.2), 1),
+        "respiratoryRate": rng.randint(12, 18),
+        "oxygenSaturation": rng.randint(96, 100),
+        "weight": round(rng.uniform(19.5, 24.5) * (height / 100) ** 2),
+        "height": height,
+        "overallScore": rng.randint(90, 100)
+    }
+
+
+def sample_vitals(rng):
+    if healthy_share and rng.random() < healthy_share:
+        return sample_healthy_vitals(rng)
+    return {
+        "systolic": rng.randint(100, 175),
+        "diastolic": rng.randint(60, 110),
+        "heartRate": rng.randint(55, 115),
+        "temperature": round(rng.uniform(36.1, 38.4), 1),
+        "respiratoryRate": rng.randint(12, 24),
+        "oxygenSaturation": rng.randint(90, 100),
+        "weight": rng.randint(50, 110),
+        "height": rng.randint(150, 195),
+        "overallScore": rng.randint(40, 95),
+        "diabetes": rng.random() < 0.2,
+        "hypertension": rng.random() < 0.3
+    }
+
+
+def sample_lab_lines(rng):
+    return [
+        f"Total Cholesterol {rng.randint(150, 260)} mg/dL",
+        f"LDL Cholesterol {rng.randint(70, 190)} mg/dL",
+        f"HDL Cholesterol {rng.randint(30, 80)} mg/dL",
+        f"Triglycerides {rng.randint(80, 300)} mg/dL",
+        f"Fasting Glucose {rng.randint(70, 160)} mg/dL",
+        f"Hemoglobin {round(rng.uniform(10, 17), 1)} g/dL",
+        f"Blood Pressure {rng.randint(100, 170)}/{rng.randint(60, 105)} mmHg"
+    ]
+
+
+def sample_pdf(lines):
+    """Minimal one-page PDF with the given text lines (readable by PyPDF2)"""
+    text = "\n".join(
+        f"BT /F1 11 Tf 50 {760 - i * 16} Td ({line}) Tj ET" for i, line in enumerate(lines)
+    ).encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length " + str(len(text)).encode() + b" >>\nstream\n" + text + b"\nendstream"
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def sample_image(rng):
+    """Small PNG standing in for a lab-report photo"""
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (800, 600), "white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(sample_lab_lines(rng)):
+        draw.text((40, 40 + i * 30), line, fill="black")
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def suggestion_body(rng):
+    return {"patient": sample_patient(rng), "vitals": sample_vitals(rng), "labReports": []}
+
+
+def vitals_body(rng):
+    return {"patient": sample_patient(rng), "vitals": sample_vitals(rng)}
+
+
+def batch_body(rng):
+    return {"records": [sample_vitals(rng) for _ in range(500)]}
+
+
+def report_form(file_name, content_type, content):
+    def build(rng):
+        patient = sample_patient(rng)
+        return {
+            "files": {"file": (file_name, content(rng), content_type)},
+            "data": {"name": patient["name"], "age": patient["age"], "gender": patient["gender"]}
+        }
+    return build
+
+
+def multi_report_form(rng):
+    patient = sample_patient(rng)
+    return {
+        "files": [
+            ("files", ("lipids.pdf", sample_pdf(sample_lab_lines(rng)), "application/pdf")),
+            ("files", ("cbc.png", sample_image(rng), "image/png")),
+            ("files", ("ecg.pdf", sample_pdf(["Heart Rate 72 bpm", "QT interval 410 ms", "Sinus rhythm"]), "application/pdf"))
+        ],
+        "data": {"name": patient["name"], "age": patient["age"], "gender": patient["gender"]}
+    }
+
+
+# name -> (path, body builder, "json" | "sse" | "multipart")
+SCENARIOS = {
+    "analyze-vitals": ("/api/analyze-vitals", vitals_body, "json"),
+    "analyze-vitals-stream": ("/api/analyze-vitals/stream", vitals_body, "sse"),
+    "analyze-vitals-batch": ("/api/analyze-vitals/batch", batch_body, "json"),
+    "suggest-prescription": ("/api/suggest-prescription", suggestion_body, "json"),
+    "suggest-prescription-stream": ("/api/suggest-prescription/stream", suggestion_body, "sse"),
+    "suggest-lab-tests": ("/api/suggest-lab-tests", suggestion_body, "json"),
+    "suggest-lab-tests-stream": ("/api/suggest-lab-tests/stream", suggestion_body, "sse"),
+    "generate-followup": ("/api/generate-followup", suggestion_body, "json"),
+    "generate-followup-stream": ("/api/generate-followup/stream", suggestion_body, "sse"),
+    "consult": ("/api/consult", suggestion_body, "json"),
+    "analyze-pdf": ("/api/analyze", report_form(
+        "report.pdf", "application/pdf", lambda rng: sample_pdf(sample_lab_lines(rng))
+    ), "multipart"),
+    "analyze-image": ("/api/analyze", report_form("report.png", "image/png", sample_image), "multipart"),
+    "analyze-multi": ("/api/analyze/multi", multi_report_form, "multipart")
+}
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(samples, elapsed):
+    """Latency / throughput / error summary for one endpoint run"""
+    latencies = sorted(s["latency"] for s in samples)
+    first_bytes = sorted(s["firstByte"] for s in samples if s.get("firstByte") is not None)
+    errors = [s for s in samples if s["error"]]
+    statuses = {}
+    for s in samples:
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    summary = {
+        "requests": len(samples),
+        "errors": len(errors),
+        "errorRate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "throughputRps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "elapsedSeconds": round(elapsed, 3),
+        "latencyMs": {
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1]) if latencies else None
+        },
+        "statusCodes": statuses
+    }
+    if first_bytes:
+        summary["firstByteMs"] = {
+            "p50": ms(percentile(first_bytes, 50)),
+            "p95": ms(percentile(first_bytes, 95)),
+            "p99": ms(percentile(first_bytes, 99))
+        }
+    return summary
+
+
+async def send_one(client, path, body, mode):
+    """One request; returns its latency sample"""
+    started = time.perf_counter()
+    sample = {"status": None, "error": None, "firstByte": None}
+    try:
+        if mode == "multipart":
+            response = await client.post(path, files=body["files"], data=body["data"])
+            sample["status"] = response.status_code
+        elif mode == "sse":
+            async with client.stream("POST", path, json=body) as response:
+                sample["status"] = response.status_code
+                async for chunk in response.aiter_bytes():
+                    if sample["firstByte"] is None and chunk:
+                        sample["firstByte"] = time.perf_counter() - started
+        else:
+            response = await client.post(path, json=body)
+            sample["status"] = response.status_code
+        if sample["status"] >= 400:
+            sample["error"] = f"HTTP {sample['status']}"
+    except httpx.HTTPError as e:
+        sample["error"] = f"{type(e).__name__}: {e}"
+    sample["latency"] = time.perf_counter() - started
+    return sample
+
+
+async def run_scenario(client, name, requests, concurrency, rng, same_payload=False):
+    path, build, mode = SCENARIOS[name]
+    # Bodies are built up front so payload generation is not part of the timing;
+    # varied payloads measure the model path, a repeated one the cache path
+    if same_payload:
+        bodies = [build(rng)] * requests
+    else:
+        bodies = [build(rng) for _ in range(requests)]
+    queue = iter(bodies)
+    samples = []
+
+    async def worker():
+        for body in queue:
+            samples.append(await send_one(client, path, body, mode))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - started)
+
+
+async def run_benchmark(args):
+    global healthy_share
+    healthy_share = args.healthy_share
+    rng = random.Random(args.seed)
+    names = args.endpoints.split(",") if args.endpoints else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        for name in names:
+            if args.warmup:
+                await run_scenario(client, name, args.warmup, min(args.concurrency, args.warmup), rng)
+            results[name] = await run_scenario(client, name, args.requests, args.concurrency, rng, args.same_payload)
+            summary = results[name]
+            print(f"{name:30} {summary['throughputRps']:>9.1f} rps  "
+                  f"p50 {summary['latencyMs']['p50']:>9} ms  p95 {summary['latencyMs']['p95']:>9} ms  "
+                  f"p99 {summary['latencyMs']['p99']:>9} ms  errors {summary['errorRate']:.1%}")
+        try:
+            server_stats = (await client.get("/api/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+    return results, server_stats
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def fake_args(args):
+    """Command-line flags that configure the fake model, for the serve subprocess"""
+    return [
+        "--latency-dist", args.latency_dist,
+        "--latency-median", str(args.latency_median),
+        "--latency-spread", str(args.latency_spread),
+        "--failure-rate", str(args.failure_rate),
+        "--failure-errors", args.failure_errors,
+        "--malformed-rate", str(args.malformed_rate),
+        "--lite-latency-ratio", str(args.lite_latency_ratio),
+        "--seed", str(args.seed)
+    ]
+
+
+def wait_until_ready(server, url, timeout=30):
+    """Poll GET / until the server answers; returns the seconds it took"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if server.poll() is not None:
+            raise SystemExit("Server exited during startup")
+        try:
+            httpx.get(url + "/", timeout=1)
+            return time.perf_counter() - started
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    server.terminate()
+    raise SystemExit(f"Server did not start within {timeout}s")
+
+
+def start_fake_server(args):
+    """Run `benchmark.py serve` in a subprocess and wait until it answers"""
+    command = [sys.executable, os.path.abspath(__file__), "serve", "--port", str(args.port), *fake_args(args)]
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    url = f"http://127.0.0.1:{args.port}"
+    wait_until_ready(server, url)
+    return server, url
+
+
+def command_run(args):
+    server = None
+    if args.fake:
+        server, args.url = start_fake_server(args)
+    try:
+        results, server_stats = asyncio.run(run_benchmark(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "gitCommit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "requestsPerEndpoint": args.requests,
+            "samePayload": args.same_payload,
+            "healthyShare": args.healthy_share,
+            "seed": args.seed,
+            "fakeModel": {
+                "latencyDist": args.latency_dist,
+                "latencyMedian": args.latency_median,
+                "latencySpread": args.latency_spread,
+                "failureRate": args.failure_rate,
+                "failureErrors": args.failure_errors,
+                "malformedRate": args.malformed_rate
+            } if args.fake else None
+        },
+        "endpoints": results,
+        "serverStats": server_stats
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+def command_serve(args):
+    """Serve the API with the fake model instead of Gemini, fully offline"""
+    # main.py only uses the model when a key is set; the key itself is never sent anywhere
+    os.environ["GEMINI_API_KEY"] = "offline-benchmark"
+    # Quota shedding is not what an offline run measures; set GEMINI_RPM / GEMINI_TPM to test it
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+    import uvicorn
+    import main
+    from fake_gemini import FakeGeminiModel, LatencyModel
+
+    rng = random.Random(args.seed)
+    main.gemini.model = FakeGeminiModel(
+        latency=LatencyModel(args.latency_dist, args.latency_median, args.latency_spread, rng=rng),
+        failure_rate=args.failure_rate,
+        errors=args.failure_errors.split(","),
+        malformed_rate=args.malformed_rate,
+        seed=args.seed
+    )
+    if main.gemini_lite is not None:
+        # The lite tier answers the same way, only faster
+        main.gemini_lite.model = FakeGeminiModel(
+            latency=LatencyModel(args.latency_dist, args.latency_median * args.lite_latency_ratio, args.latency_spread, rng=rng),
+            failure_rate=args.failure_rate,
+            errors=args.failure_errors.split(","),
+            malformed_rate=args.malformed_rate,
+            seed=args.seed
+        )
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def command_compare(args):
+    """Print per-endpoint deltas; exit 1 if any endpoint regressed past the threshold"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)["endpoints"]
+    with open(args.candidate) as f:
+        candidate = json.load(f)["endpoints"]
+
+    regressions = []
+    for name in baseline:
+        if name not in candidate:
+            continue
+        old, new = baseline[name], candidate[name]
+        checks = [
+            ("p50", old["latencyMs"]["p50"], new["latencyMs"]["p50"], True),
+            ("p95", old["latencyMs"]["p95"], new["latencyMs"]["p95"], True),
+            ("p99", old["latencyMs"]["p99"], new["latencyMs"]["p99"], True),
+            ("rps", old["throughputRps"], new["throughputRps"], False)
+        ]
+        parts = []
+        for label, before, after, lower_is_better in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            parts.append(f"{label} {change:+.1%}")
+            if (change if lower_is_better else -change) > args.threshold:
+                regressions.append(f"{name} {label}")
+        error_change = new["errorRate"] - old["errorRate"]
+        if error_change > args.error_threshold:
+            regressions.append(f"{name} errorRate")
+        parts.append(f"errors {old['errorRate']:.1%} -> {new['errorRate']:.1%}")
+        print(f"{name:30} " + "  ".join(parts))
+
+    if regressions:
+        print(f"\nRegressions over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+def measure_import(env):
+    """Seconds to import main.py in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top=10):
+    """Modules imported directly by main.py, by cumulative import time (python -X importtime)"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    ).stderr
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == "main":
+                break
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+    children.sort(key=lambda item: item[1], reverse=True)
+    return [{"module": name, "ms": round(ms, 1)} for name, ms in children[:top]]
+
+
+def process_rss_mb(pid):
+    """Resident memory of a process (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def measure_cold_start(args, env):
+    """Start a server, then time readiness and the first / second request"""
+    if args.mode == "fake":
+        command = [sys.executable, os.path.abspath(__file__), "serve", "--port", str(args.port),
+                   "--latency-dist", "constant", "--latency-median", "0"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"]
+    url = f"http://127.0.0.1:{args.port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              stdout=subprocess.DEVNULL)
+    try:
+        wait_until_ready(server, url)
+        ready = time.perf_counter() - started
+        rss_idle = process_rss_mb(server.pid)
+        timings = []
+        for _ in range(2):
+            body = vitals_body(random.Random())
+            request_started = time.perf_counter()
+            response = httpx.post(url + "/api/analyze-vitals", json=body, timeout=120)
+            response.raise_for_status()
+            timings.append(time.perf_counter() - request_started)
+        return {
+            "readySeconds": round(ready, 3),
+            "firstRequestSeconds": round(timings[0], 3),
+            "timeToFirstResponseSeconds": round(ready + timings[0], 3),
+            "secondRequestSeconds": round(timings[1], 3),
+            "rssIdleMb": rss_idle,
+            "rssAfterRequestMb": process_rss_mb(server.pid)
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def command_startup(args):
+    """Import time and time-to-first-request of a fresh worker"""
+    env = dict(os.environ)
+    if args.mode == "mock":
+        # An empty key (rather than none) also stops load_dotenv picking one up from .env
+        env["GEMINI_API_KEY"] = ""
+    if args.warmup:
+        env["GEMINI_WARMUP"] = "true"
+
+    imports = sorted(measure_import(env) for _ in range(args.repeat))
+    cold_starts = [measure_cold_start(args, env) for _ in range(args.repeat)]
+
+    def median(key):
+        values = sorted(run[key] for run in cold_starts if run[key] is not None)
+        return values[len(values) // 2] if values else None
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "gitCommit": git_commit(),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "warmup": args.warmup,
+            "repeat": args.repeat
+        },
+        "importSeconds": {"median": round(imports[len(imports) // 2], 3), "min": round(imports[0], 3)},
+        "slowestImports": slowest_imports(env),
+        "coldStart": {key: median(key) for key in cold_starts[0]},
+        "runs": cold_starts
+    }
+    print(f"import main.py       {report['importSeconds']['median']:.3f}s (median of {args.repeat})")
+    for key, value in report["coldStart"].items():
+        print(f"{key:20} {value}")
+    print("slowest imports:     " + ", ".join(f"{item['module']} {item['ms']}ms" for item in report["slowestImports"][:5]))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+def monitor_reading(vitals, rng):
+    """Nudge one or two vitals of a monitor, like a new device sample"""
+    for field in rng.sample(["systolic", "diastolic", "heartRate", "oxygenSaturation"], rng.randint(1, 2)):
+        step = 1 if field == "oxygenSaturation" else 4
+        vitals[field] = vitals[field] + rng.randint(-step, step)
+    return {field: vitals[field] for field in ("systolic", "diastolic", "heartRate", "oxygenSaturation")}
+
+
+async def run_monitor_stream(url, rng, args, result, delay):
+    """One monitor: connect, send `readings` samples `interval` apart, time the events they cause"""
+    # Connections are ramped up; thousands of simultaneous handshakes would measure only the handshakes
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+    sent_at = {}
+    vitals = sample_vitals(rng)
+
+    async def read_events(ws):
+        async for raw in ws:
+            message = json.loads(raw)
+            for event in message.get("events", [message]):
+                result["events"][event["type"]] = result["events"].get(event["type"], 0) + 1
+            sent = sent_at.pop(message.get("seq"), None)
+            if sent is not None:
+                result["eventLatencies"].append(time.perf_counter() - sent)
+
+    try:
+        async with websockets.connect(url, open_timeout=args.timeout) as ws:
+            json.loads(await ws.recv())
+            result["connectTimes"].append(time.perf_counter() - started)
+            reader = asyncio.create_task(read_events(ws))
+            # Spread the streams' sampling phases over one interval
+            await asyncio.sleep(rng.uniform(0, args.interval))
+            for seq in range(args.readings):
+                sent_at[seq] = time.perf_counter()
+                await ws.send(json.dumps({"vitals": monitor_reading(vitals, rng), "seq": seq}))
+                result["sent"] += 1
+                await asyncio.sleep(args.interval)
+            # Let narratives for the last tier change arrive
+            await asyncio.sleep(args.drain)
+            reader.cancel()
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+
+
+async def run_monitor_benchmark(args):
+    rng = random.Random(args.seed)
+    url = args.url.replace("http", "ws", 1) + "/api/vitals/monitor"
+    result = {"sent": 0, "events": {}, "connectTimes": [], "eventLatencies": [], "errors": []}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_monitor_stream(
+            f"{url}?name=Monitor%20{i}&gender=Female", random.Random(rng.random()), args, result,
+            args.ramp * i / args.streams
+        )
+        for i in range(args.streams)
+    ))
+    elapsed = time.perf_counter() - started
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        try:
+            server_stats = (await client.get("/api/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+
+    connect_times = sorted(result["connectTimes"])
+    latencies = sorted(result["eventLatencies"])
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    summary = {
+        "streams": args.streams,
+        "connected": len(connect_times),
+        "errors": len(result["errors"]),
+        "errorSamples": result["errors"][:5],
+        "readingsSent": result["sent"],
+        "readingsPerSecond": round(result["sent"] / elapsed, 1) if elapsed else 0.0,
+        "events": result["events"],
+        "connectMs": {"p50": ms(percentile(connect_times, 50)), "p99": ms(percentile(connect_times, 99))},
+        "eventLatencyMs": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99))
+        },
+        "elapsedSeconds": round(elapsed, 3)
+    }
+    return summary, server_stats
+
+
+def command_monitor(args):
+    server = None
+    if args.fake:
+        os.environ.setdefault("VITALS_MONITOR_MAX_STREAMS", str(max(args.streams, 5000)))
+        server, args.url = start_fake_server(args)
+    try:
+        summary, server_stats = asyncio.run(run_monitor_benchmark(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print(f"streams {summary['connected']}/{summary['streams']}  {summary['readingsPerSecond']} readings/s  "
+          f"event p50 {summary['eventLatencyMs']['p50']} ms  p99 {summary['eventLatencyMs']['p99']} ms  "
+          f"errors {summary['errors']}")
+    print("events: " + ", ".join(f"{name} {count}" for name, count in sorted(summary["events"].items())))
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "gitCommit": git_commit(),
+            "python": platform.python_version(),
+            "url": args.url,
+            "readingsPerStream": args.readings,
+            "intervalSeconds": args.interval,
+            "rampSeconds": args.ramp,
+            "seed": args.seed
+        },
+        "monitor": summary,
+        "serverStats": server_stats
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+def add_fake_options(parser):
+    parser.add_argument("--latency-dist", default="lognormal", choices=["constant", "uniform", "lognormal", "exponential"])
+    parser.add_argument("--latency-median", type=float, default=0.8, help="Fake model latency in seconds")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="Lognormal sigma / uniform half-width")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake model calls that fail")
+    parser.add_argument("--failure-errors", default="unavailable", help="Comma list of: unavailable, quota, internal, bad-request")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of JSON answers that come back truncated")
+    parser.add_argument("--lite-latency-ratio", type=float, default=0.4, help="Lite model latency as a fraction of the full model's")
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MediLens API load test / benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Benchmark a server")
+    run.add_argument("--url", default="http://localhost:8000")
+    run.add_argument("--fake", action="store_true", help="Start an offline server with the fake model and benchmark it")
+    run.add_argument("--port", type=int, default=8100, help="Port for the --fake server")
+    run.add_argument("-c", "--concurrency", type=int, default=16)
+    run.add_argument("-n", "--requests", type=int, default=200, help="Requests per endpoint")
+    run.add_argument("--warmup", type=int, default=10, help="Untimed requests per endpoint first")
+    run.add_argument("--endpoints", default="", help=f"Comma list (default all): {', '.join(SCENARIOS)}")
+    run.add_argument("--same-payload", action="store_true", help="Repeat one payload to measure the cache path")
+    run.add_argument("--healthy-share", type=float, default=0.0, help="Fraction of patients with all-normal vitals")
+    run.add_argument("--timeout", type=float, default=120)
+    run.add_argument("-o", "--output", default="benchmark_results.json")
+    add_fake_options(run)
+    run.set_defaults(handler=command_run)
+
+    serve = commands.add_parser("serve", help="Run the API offline with the fake Gemini model")
+    serve.add_argument("--port", type=int, default=8100)
+    add_fake_options(serve)
+    serve.set_defaults(handler=command_serve)
+
+    compare = commands.add_parser("compare", help="Compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="Allowed relative slowdown (0.10 = 10%%)")
+    compare.add_argument("--error-threshold", type=float, default=0.01, help="Allowed error-rate increase")
+    compare.set_defaults(handler=command_compare)
+
+    startup = commands.add_parser("startup", help="Measure import time and time-to-first-request")
+    startup.add_argument("--mode", default="mock", choices=["mock", "fake", "live"],
+                         help="mock: no API key; fake: offline fake model; live: GEMINI_API_KEY from the environment")
+    startup.add_argument("--warmup", action="store_true", help="Set GEMINI_WARMUP=true for the server")
+    startup.add_argument("--port", type=int, default=8101)
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.add_argument("-o", "--output", default="startup_results.json")
+    startup.set_defaults(handler=command_startup)
+
+    monitor = commands.add_parser("monitor", help="Drive many concurrent vitals monitor WebSocket streams")
+    monitor.add_argument("--url", default="http://localhost:8000")
+    monitor.add_argument("--fake", action="store_true", help="Start an offline server with the fake model and benchmark it")
+    monitor.add_argument("--port", type=int, default=8100, help="Port for the --fake server")
+    monitor.add_argument("--streams", type=int, default=1000, help="Concurrent monitor connections")
+    monitor.add_argument("--readings", type=int, default=20, help="Readings sent per stream")
+    monitor.add_argument("--interval", type=float, default=1.0, help="Seconds between a stream's readings")
+    monitor.add_argument("--ramp", type=float, default=5.0, help="Seconds over which the streams connect")
+    monitor.add_argument("--drain", type=float, default=2.0, help="Seconds to wait for late events at the end")
+    monitor.add_argument("--timeout", type=float, default=30)
+    monitor.add_argument("-o", "--output", default="monitor_results.json")
+    add_fake_options(monitor)
+    monitor.set_defaults(handler=command_monitor)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
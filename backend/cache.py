@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import record_cache_lookup
+
+# Response cache settings
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "900"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+# Path to a SQLite file shared by all uvicorn workers (empty = memory only)
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")
+
+
+def make_cache_key(namespace, *parts):
+    """Build a content-addressed key from a canonical JSON encoding of parts"""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{namespace}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class ResponseCache:
+    """Two-tier TTL cache: in-memory LRU in front of an optional SQLite file"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, db_path=CACHE_DB_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, json string)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _remember(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """Return a fresh copy of the cached value, or None on a miss"""
+        value = self._lookup(key)
+        # Keys are "<namespace>:<hash>" (see make_cache_key)
+        record_cache_lookup(key.split(":", 1)[0], value is not None)
+        return value
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(entry[1])
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+                if row:
+                    self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        encoded = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._remember(key, expires_at, encoded)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, encoded, expires_at)
+                )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache")
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl,
+            "diskTier": bool(self._db),
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
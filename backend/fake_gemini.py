@@ -0,0 +1,152 @@
+import asyncio
+import json
+import random
+
+from google.api_core import exceptions as google_exceptions
+
+# Transient upstream errors the fake model can raise, by name
+FAKE_ERRORS = {
+    "unavailable": lambda: google_exceptions.ServiceUnavailable("fake: service unavailable"),
+    "quota": lambda: google_exceptions.TooManyRequests("fake: quota exceeded"),
+    "internal": lambda: google_exceptions.InternalServerError("fake: internal error"),
+    "bad-request": lambda: google_exceptions.InvalidArgument("fake: invalid argument")
+}
+
+# Text returned for Vision calls (lab-report photos); readable by lab_parser
+FAKE_REPORT_TEXT = """Hemoglobin 13.9 g/dL
+Total Cholesterol 212 mg/dL
+LDL Cholesterol 138 mg/dL
+HDL Cholesterol 44 mg/dL
+Triglycerides 165 mg/dL
+Fasting Glucose 104 mg/dL
+Blood Pressure 132/86 mmHg
+Heart Rate 78 bpm"""
+
+
+class LatencyModel:
+    """Per-call latency in seconds drawn from a named distribution.
+
+    constant: always `median`; uniform: median +/- spread;
+    lognormal: median with log-space sigma `spread` (a long tail, like real model calls);
+    exponential: mean `median`.
+    """
+
+    def __init__(self, dist="lognormal", median=0.8, spread=0.5, rng=None):
+        if dist not in ("constant", "uniform", "lognormal", "exponential"):
+            raise ValueError(f"Unknown latency distribution '{dist}'")
+        self.dist = dist
+        self.median = median
+        self.spread = spread
+        self.rng = rng or random.Random()
+
+    def sample(self):
+        if self.dist == "constant":
+            return self.median
+        if self.dist == "uniform":
+            return max(self.rng.uniform(self.median - self.spread, self.median + self.spread), 0)
+        if self.dist == "exponential":
+            return self.rng.expovariate(1 / self.median) if self.median > 0 else 0
+        return self.rng.lognormvariate(0, self.spread) * self.median
+
+
+class FakeUsage:
+    def __init__(self, total_token_count, prompt_token_count=None):
+        self.total_token_count = total_token_count
+        self.prompt_token_count = prompt_token_count
+
+
+class FakeResponse:
+    """The parts of a google.generativeai response the client reads"""
+
+    def __init__(self, text, tokens, prompt_tokens=None):
+        self.text = text
+        self.usage_metadata = FakeUsage(tokens, prompt_tokens)
+
+
+class FakeStream:
+    """Async iterator of response chunks, spread evenly over `duration` seconds.
+
+    Like the real API, each chunk's usage_metadata is the running total.
+    """
+
+    def __init__(self, text, duration, prompt_tokens=0, chunk_size=64):
+        self.chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        self.chunk_delay = duration / len(self.chunks)
+        self.prompt_tokens = prompt_tokens
+
+    async def __aiter__(self):
+        output_tokens = 0
+        for chunk in self.chunks:
+            await asyncio.sleep(self.chunk_delay)
+            output_tokens += len(chunk) // 4
+            yield FakeResponse(chunk, self.prompt_tokens + output_tokens, self.prompt_tokens)
+
+
+def fill_schema(schema, rng):
+    """Random value that matches a response_schema (the subset used in structured.py)"""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if kind == "object":
+        return {name: fill_schema(prop, rng) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [fill_schema(schema["items"], rng) for _ in range(rng.randint(2, 4))]
+    if kind == "integer":
+        return rng.randint(40, 95)
+    if kind == "number":
+        return round(rng.uniform(0, 100), 1)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return "Offline benchmark response text."
+
+
+class FakeGeminiModel:
+    """Drop-in for genai.GenerativeModel that answers offline.
+
+    Latency comes from a LatencyModel; `failure_rate` of calls raise one of
+    `errors` (see FAKE_ERRORS) and `malformed_rate` of JSON calls return
+    truncated JSON, which exercises the repair / retry path.
+    """
+
+    def __init__(self, latency=None, failure_rate=0.0, errors=("unavailable",), malformed_rate=0.0, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = latency or LatencyModel(rng=self.rng)
+        self.failure_rate = failure_rate
+        self.errors = [FAKE_ERRORS[name] for name in errors]
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+
+    def _answer(self, generation_config):
+        schema = (generation_config or {}).get("response_schema")
+        if schema is None:
+            return FAKE_REPORT_TEXT
+        text = json.dumps(fill_schema(schema, self.rng))
+        if self.rng.random() < self.malformed_rate:
+            return text[:len(text) // 2]
+        return text
+
+    async def generate_content_async(self, contents, stream=False, generation_config=None, **kwargs):
+        self.calls += 1
+        delay = self.latency.sample()
+        if self.rng.random() < self.failure_rate:
+            # Failures take time too (a timeout or slow 5xx)
+            await asyncio.sleep(delay)
+            raise self.rng.choice(self.errors)()
+        text = self._answer(generation_config)
+        prompt_tokens = len(str(contents)) // 4
+        if stream:
+            # Time to first chunk is a fraction of the latency, the rest is spread over the chunks
+            await asyncio.sleep(delay * 0.2)
+            return FakeStream(text, delay * 0.8, prompt_tokens)
+        await asyncio.sleep(delay)
+        return FakeResponse(text, prompt_tokens + len(text) // 4, prompt_tokens)
+
+    async def count_tokens_async(self, contents, **kwargs):
+        """Used by GeminiClient.warm_up"""
+        return FakeUsage(len(str(contents)) // 4)
+
+    def generate_content(self, contents, stream=False, generation_config=None, **kwargs):
+        """Blocking variant for GEMINI_CLIENT_MODE=thread (runs in the client's executor threads)"""
+        response = asyncio.run(self.generate_content_async(contents, generation_config=generation_config))
+        # A stream of one chunk
+        return [response] if stream else response
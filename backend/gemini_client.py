@@ -0,0 +1,325 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import timed
+from rate_limit import estimate_request_tokens, RateLimited
+from resilience import (
+    CircuitBreaker, LatencyTracker, hedged, is_retryable, backoff_delay,
+    GEMINI_DEADLINE_SECONDS, GEMINI_RETRIES, GEMINI_HEDGE, GEMINI_HEDGE_MIN_SAMPLES
+)
+
+# Concurrency / timeout settings for Gemini calls
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "20"))
+# "async" uses the SDK's native async API, "thread" runs the sync API in a bounded executor
+GEMINI_CLIENT_MODE = os.getenv("GEMINI_CLIENT_MODE", "async")
+# Build the model and open its connection at startup instead of on the first request
+GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "false").lower() in ("1", "true", "yes")
+
+
+class ClientDisconnected(Exception):
+    """Raised when the HTTP client goes away before the model call finishes"""
+
+
+def load_gemini_model(api_key, model_name):
+    """Import the Gemini SDK and build the model (the SDK import alone takes ~1s)"""
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+
+class GeminiClient:
+    """Shared async client so model calls never block the event loop.
+
+    Pass either a ready `model` or a `model_factory`; the factory runs on the
+    first call (or in warm_up), once, in a worker thread.
+    """
+
+    def __init__(self, model=None, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                 timeout=GEMINI_TIMEOUT_SECONDS, mode=GEMINI_CLIENT_MODE, limiter=None,
+                 deadline=GEMINI_DEADLINE_SECONDS, retries=GEMINI_RETRIES, hedge=GEMINI_HEDGE,
+                 model_factory=None):
+        self._model = model
+        self._model_factory = model_factory
+        self._model_lock = threading.Lock()
+        self.model_load_seconds = None
+        self.limiter = limiter
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.mode = mode
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.breaker = CircuitBreaker()
+        self.latency = {}  # kind -> LatencyTracker
+        self.in_flight = 0
+        self.retried = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._semaphore = None
+        self._executor = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    started = time.perf_counter()
+                    self._model = self._model_factory()
+                    self.model_load_seconds = time.perf_counter() - started
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    async def _get_model(self):
+        """The model, built off the event loop if this is the first use"""
+        if self._model is None:
+            await asyncio.to_thread(lambda: self.model)
+        return self._model
+
+    async def warm_up(self):
+        """Build the model and open its connection with a count_tokens call (no generation quota)"""
+        try:
+            model = await self._get_model()
+            started = time.perf_counter()
+            await model.count_tokens_async("warm-up")
+            print(f"Gemini client warmed up: model {self.model_load_seconds or 0:.2f}s, "
+                  f"connection {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            print(f"Gemini warm-up failed: {str(e)}")
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="gemini"
+            )
+        return self._executor
+
+    async def _call(self, contents, **kwargs):
+        model = await self._get_model()
+        if self.mode == "async" and hasattr(model, "generate_content_async"):
+            return await model.generate_content_async(contents, **kwargs)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(model.generate_content, contents, **kwargs)
+        return await loop.run_in_executor(self._get_executor(), call)
+
+    async def _reserve(self, contents, kind):
+        """Wait for rate-limiter quota; returns the tokens reserved"""
+        if self.limiter is None:
+            return 0
+        reserved = estimate_request_tokens(contents)
+        with timed("quota_wait"):
+            await self.limiter.acquire(reserved, kind)
+        return reserved
+
+    async def _attempt(self, contents, timeout, **kwargs):
+        async with self._get_semaphore():
+            self.in_flight += 1
+            try:
+                return await asyncio.wait_for(self._call(contents, **kwargs), timeout)
+            finally:
+                self.in_flight -= 1
+
+    def _hedge_delay(self, kind):
+        """p95 latency for this kind of call, once there are enough samples to trust it"""
+        tracker = self.latency.get(kind)
+        if not self.hedge or tracker is None or len(tracker.samples) < GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        return tracker.percentile(95)
+
+    def _record_outcome(self, error):
+        # Errors the upstream answered with (bad request, safety block) say nothing about its health
+        if error is not None and is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def generate(self, contents, timeout=None, kind=None, **kwargs):
+        """Run generate_content without blocking the event loop and return the response text.
+
+        kind names the caller (e.g. "vitals") for rate-limiter priority and
+        latency tracking. Transient errors are retried with jittered backoff
+        within the overall deadline; slow calls can be hedged after the p95
+        latency; while the circuit breaker is open this raises CircuitOpen.
+        """
+        self.breaker.before_call()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        try:
+            while True:
+                reserved = await self._reserve(contents, kind)
+                attempt_timeout = max(min(timeout or self.timeout, deadline - loop.time()), 0.001)
+                calls = []
+
+                def start_attempt():
+                    if calls:
+                        # Hedge only with quota that is free right now
+                        if self.limiter is not None and not self.limiter.try_acquire(reserved):
+                            return None
+                        self.hedges += 1
+                    calls.append(True)
+                    return self._attempt(contents, attempt_timeout, **kwargs)
+
+                started = time.perf_counter()
+                try:
+                    with timed("model"):
+                        response, _, hedge_won = await hedged(start_attempt, self._hedge_delay(kind))
+                except Exception as e:
+                    remaining = deadline - loop.time()
+                    if not is_retryable(e) or attempt >= self.retries or remaining <= 0:
+                        self._record_outcome(e)
+                        raise
+                    delay = min(backoff_delay(attempt), remaining)
+                    attempt += 1
+                    self.retried += 1
+                    print(f"Gemini call failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    continue
+
+                self._record_outcome(None)
+                self.hedge_wins += int(hedge_won)
+                self.latency.setdefault(kind, LatencyTracker()).add(time.perf_counter() - started)
+                if self.limiter is not None:
+                    self.limiter.settle(reserved, _usage_tokens(response))
+                    if len(calls) > 1:
+                        # The cancelled copy was charged about the same prompt, and little output
+                        self.limiter.settle(reserved, _prompt_tokens(response))
+                return response.text
+        except (asyncio.CancelledError, RateLimited):
+            # No outcome to report: the caller went away or there was no quota
+            self.breaker.release()
+            raise
+
+    async def stream(self, contents, timeout=None, kind=None, **kwargs):
+        """Yield response text chunks as the model produces them (generate_content with stream=True)"""
+        self.breaker.before_call()
+        try:
+            reserved = await self._reserve(contents, kind)
+        except BaseException:
+            self.breaker.release()
+            raise
+        error = None
+        # Chunks carry the running usage_metadata; the last one seen settles the quota
+        used = None
+        async with self._get_semaphore():
+            self.in_flight += 1
+            with timed("model"):
+                try:
+                    loop = asyncio.get_running_loop()
+                    model = await self._get_model()
+                    # One attempt covering the whole generation, so it gets the overall deadline
+                    deadline = loop.time() + (timeout or self.deadline)
+
+                    def remaining():
+                        return max(deadline - loop.time(), 0)
+
+                    if self.mode == "async" and hasattr(model, "generate_content_async"):
+                        response = await asyncio.wait_for(
+                            model.generate_content_async(contents, stream=True, **kwargs),
+                            remaining()
+                        )
+                        chunks = response.__aiter__()
+                        next_chunk = chunks.__anext__
+                    else:
+                        call = functools.partial(model.generate_content, contents, stream=True, **kwargs)
+                        response = await asyncio.wait_for(loop.run_in_executor(self._get_executor(), call), remaining())
+                        iterator = iter(response)
+
+                        async def next_chunk():
+                            chunk = await loop.run_in_executor(self._get_executor(), next, iterator, None)
+                            if chunk is None:
+                                raise StopAsyncIteration
+                            return chunk
+
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(next_chunk(), remaining())
+                        except StopAsyncIteration:
+                            return
+                        used = _usage_tokens(chunk) or used
+                        text = _chunk_text(chunk)
+                        if text:
+                            yield text
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    if self.limiter is not None:
+                        self.limiter.settle(reserved, used)
+                    if error is None or isinstance(error, Exception):
+                        self._record_outcome(error)
+                    else:
+                        # Cancelled or closed early
+                        self.breaker.release()
+
+    def stats(self):
+        latency = {}
+        for kind, tracker in self.latency.items():
+            latency[kind or "other"] = {
+                "p50": round(tracker.percentile(50), 4),
+                "p95": round(tracker.percentile(95), 4),
+                "samples": len(tracker.samples)
+            }
+        return {
+            "modelLoaded": self._model is not None,
+            "modelLoadSeconds": round(self.model_load_seconds, 3) if self.model_load_seconds is not None else None,
+            "inFlight": self.in_flight,
+            "breaker": self.breaker.stats(),
+            "retries": self.retried,
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "latency": latency
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) or None
+
+
+def _prompt_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", None) or None
+
+
+def _chunk_text(chunk):
+    # The final chunk of a stream can carry only a finish reason and no text part
+    try:
+        return chunk.text
+    except (ValueError, IndexError):
+        return ""
+
+
+async def cancel_on_disconnect(request, coro, poll_interval=0.5):
+    """Await coro, cancelling it if the HTTP client disconnects first"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
@@ -0,0 +1,78 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Lab-report photo preprocessing before Vision calls
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() in ("1", "true", "yes")
+IMAGE_PREP_WORKERS = int(os.getenv("IMAGE_PREP_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PREP_WORKERS, thread_name_prefix="image-prep")
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "bytesIn": 0, "bytesOut": 0, "pixelsIn": 0, "pixelsOut": 0, "seconds": 0.0}
+
+
+def preprocess_image(fp, size_in, max_dimension=IMAGE_MAX_DIMENSION,
+                     quality=IMAGE_JPEG_QUALITY, grayscale=IMAGE_GRAYSCALE):
+    """Downscale, orient, optionally grayscale and re-encode an image as compact JPEG.
+
+    Returns the JPEG bytes plus before/after sizes and timing.
+    """
+    # Deferred so workers that never see an image do not load Pillow
+    from PIL import Image, ImageOps
+    started = time.perf_counter()
+    image = Image.open(fp)
+    original_size = image.size
+    mode = "L" if grayscale else "RGB"
+    if image.format == "JPEG":
+        # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+        image.draft(mode, (max_dimension, max_dimension))
+
+    # Apply the EXIF orientation; the EXIF block itself is not written back
+    image = ImageOps.exif_transpose(image)
+    if image.mode != mode:
+        image = image.convert(mode)
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    data = out.getvalue()
+    elapsed = time.perf_counter() - started
+
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytesIn"] += size_in
+        _stats["bytesOut"] += len(data)
+        _stats["pixelsIn"] += original_size[0] * original_size[1]
+        _stats["pixelsOut"] += image.size[0] * image.size[1]
+        _stats["seconds"] += elapsed
+
+    return {
+        "data": data,
+        "mimeType": "image/jpeg",
+        "bytesIn": size_in,
+        "bytesOut": len(data),
+        "sizeIn": original_size,
+        "sizeOut": image.size,
+        "seconds": round(elapsed, 4)
+    }
+
+
+async def preprocess_upload(upload):
+    """Run preprocess_image for a SpooledUpload on the preprocessing thread pool"""
+    loop = asyncio.get_running_loop()
+    with upload.open() as fp:
+        return await loop.run_in_executor(_executor, preprocess_image, fp, upload.size)
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["seconds"] = round(result["seconds"], 4)
+    result["avgSeconds"] = round(result["seconds"] / result["images"], 4) if result["images"] else 0.0
+    result["byteReduction"] = round(1 - result["bytesOut"] / result["bytesIn"], 4) if result["bytesIn"] else 0.0
+    return result
@@ -0,0 +1,318 @@
+"""Streaming CSV / NDJSON ingestion of bulk vitals exports.
+
+Input is parsed incrementally, scored chunk by chunk with the vectorized
+rule engine, and written back as NDJSON while parsing is still going.
+
+Usage:
+    python ingest.py export.csv [--format csv|ndjson] [--llm] [--output out.ndjson]
+"""
+import argparse
+import asyncio
+import codecs
+import collections
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from vitals_batch import score_vitals_batch, records_to_columns, STATUS_NAMES, risk_flag_names
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+# Upper bound on AI narratives per ingest run, so one export cannot drain the quota
+INGEST_MAX_LLM_ROWS = int(os.getenv("INGEST_MAX_LLM_ROWS", "100"))
+READ_CHUNK_BYTES = 1024 * 1024
+# Longest CSV record a quoted field may stretch over; past it the opening quote is taken as bad data
+MAX_CSV_RECORD_BYTES = 64 * 1024
+
+PATIENT_FIELDS = ('name', 'age', 'gender')
+ID_FIELDS = ('id', 'patientId', 'patient_id')
+FLAG_FIELDS = ('heartDisease', 'diabetes', 'hypertension', 'asthma')
+TRUE_STRINGS = {'1', 'true', 'yes', 'y', 't'}
+
+
+class RecordParser:
+    """Incremental parser: feed raw bytes, get back complete records"""
+
+    def __init__(self, fmt):
+        if fmt not in ('csv', 'ndjson'):
+            raise ValueError(f"Unsupported format '{fmt}', use 'csv' or 'ndjson'")
+        self.fmt = fmt
+        self.header = None
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._pending = ''
+        # Lines of a CSV record whose quoted field spans a newline
+        self._record = []
+        self._record_bytes = 0
+        self._in_quotes = False
+
+    def feed(self, chunk):
+        text = self._pending + self._decoder.decode(chunk)
+        lines = text.split('\n')
+        self._pending = lines.pop()
+        return self._parse(lines)
+
+    def close(self):
+        text = self._pending + self._decoder.decode(b'', final=True)
+        self._pending = ''
+        records = self._parse([text])
+        while self._record:
+            # Input ended inside a quoted field: drop the row that opened it, re-read the rest
+            records.extend(self._drop_open_record())
+        return records
+
+    def _reset_record(self):
+        self._record = []
+        self._record_bytes = 0
+        self._in_quotes = False
+
+    def _drop_open_record(self):
+        rest = self._record[1:]
+        self._reset_record()
+        return [{'_error': "Unterminated quoted field"}] + self._parse(rest)
+
+    def _parse(self, lines):
+        if self.fmt == 'ndjson':
+            return [self._parse_json(line.rstrip('\r')) for line in lines if line.strip()]
+
+        # Complete record texts, with None where a record had to be dropped
+        complete = []
+        lines = collections.deque(lines)
+        while lines:
+            line = lines.popleft()
+            if not self._record and not line.strip():
+                continue
+            self._record.append(line)
+            self._record_bytes += len(line)
+            if '"' in line:
+                self._in_quotes = ends_in_quoted_field(line, self._in_quotes)
+            if not self._in_quotes:
+                complete.append('\n'.join(self._record).rstrip('\r'))
+                self._reset_record()
+            elif self._record_bytes > MAX_CSV_RECORD_BYTES:
+                # Never closed: report the opening row and re-read the lines after it
+                lines.extendleft(reversed(self._record[1:]))
+                self._reset_record()
+                complete.append(None)
+
+        rows = iter(csv.reader([text for text in complete if text is not None]))
+        records = []
+        for text in complete:
+            if text is None:
+                records.append({'_error': "Unterminated quoted field"})
+                continue
+            row = next(rows)
+            if self.header is None:
+                self.header = [name.strip() for name in row]
+            else:
+                records.append(self._csv_record(row))
+        return records
+
+    @staticmethod
+    def _parse_json(line):
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            return {'_error': f"Invalid JSON: {str(e)}"}
+        if not isinstance(record, dict):
+            return {'_error': "Each NDJSON line must be an object"}
+        return record
+
+    def _csv_record(self, row):
+        record = {}
+        for name, value in zip(self.header, row):
+            value = value.strip()
+            # Empty cells count as missing so the scoring defaults apply
+            if value == '':
+                continue
+            if name in FLAG_FIELDS:
+                value = value.lower() in TRUE_STRINGS
+            record[name] = value
+        return record
+
+
+def ends_in_quoted_field(line, in_quotes=False):
+    """Whether a CSV line ends inside a quoted field (so the record goes on).
+
+    in_quotes is the state the line starts in. As in csv.reader, only a quote
+    at the start of a field opens one; a stray quote inside an unquoted
+    value (5'10") is literal.
+    """
+    field_start = not in_quotes
+    after_close = False
+    for char in line:
+        if in_quotes:
+            if char == '"':
+                in_quotes = False
+                after_close = True
+            continue
+        # A quote right after a closing one is an escaped ""
+        if char == '"' and (field_start or after_close):
+            in_quotes = True
+        field_start = char == ','
+        after_close = False
+    return in_quotes
+
+
+def split_record(record):
+    """Split a flat or nested record into (patient, vitals)"""
+    if isinstance(record.get('vitals'), dict):
+        return record.get('patient') or {}, record['vitals']
+    patient = {k: record[k] for k in PATIENT_FIELDS + ID_FIELDS if k in record}
+    return patient, record
+
+
+def record_id(patient, record):
+    for field in ID_FIELDS:
+        if field in patient:
+            return patient[field]
+        if field in record:
+            return record[field]
+    return None
+
+
+def score_chunk(records, first_row):
+    """Score one chunk of parsed records; returns one result dict per record"""
+    results = [None] * len(records)
+    valid_rows = []
+    for i, record in enumerate(records):
+        if '_error' in record:
+            results[i] = {"row": first_row + i, "error": record['_error']}
+        else:
+            valid_rows.append(i)
+    if not valid_rows:
+        return results
+
+    vitals = [split_record(records[i])[1] for i in valid_rows]
+    scored = score_vitals_batch(records_to_columns(vitals))
+    status_codes = {
+        "bloodPressure": scored["bpStatus"],
+        "heartRate": scored["hrStatus"],
+        "oxygenLevel": scored["spo2Status"],
+        "bmi": scored["bmiStatus"]
+    }
+    tiers = STATUS_NAMES[np.maximum.reduce(list(status_codes.values()))].tolist()
+    statuses = {name: STATUS_NAMES[codes].tolist() for name, codes in status_codes.items()}
+    scores = scored["overallScore"].tolist()
+    flags = scored["riskFlags"].tolist()
+    names_by_flags = {value: risk_flag_names(value) for value in set(flags)}
+
+    for j, i in enumerate(valid_rows):
+        patient, _ = split_record(records[i])
+        results[i] = {
+            "row": first_row + i,
+            "id": record_id(patient, records[i]),
+            "overallScore": scores[j],
+            "tier": tiers[j],
+            "status": {name: values[j] for name, values in statuses.items()},
+            "riskFlags": names_by_flags[flags[j]]
+        }
+    return results
+
+
+async def _emit_chunk(records, first_row, narrate, totals):
+    results = score_chunk(records, first_row)
+
+    if narrate is not None:
+        # Only Warning / Critical rows get an AI narrative, within the run budget
+        flagged = [i for i, result in enumerate(results)
+                   if result.get("tier") in ("Warning", "Critical")]
+        flagged = flagged[:max(totals["llmBudget"], 0)]
+        totals["llmBudget"] -= len(flagged)
+        narratives = await asyncio.gather(
+            *[narrate(*split_record(records[i])) for i in flagged],
+            return_exceptions=True
+        )
+        for i, narrative in zip(flagged, narratives):
+            if isinstance(narrative, Exception):
+                results[i]["aiError"] = str(narrative)
+            else:
+                results[i]["aiAnalysis"] = narrative
+                totals["narrated"] += 1
+
+    for result in results:
+        totals["rows"] += 1
+        if "error" in result:
+            totals["errors"] += 1
+        else:
+            totals[result["tier"].lower()] += 1
+    return "".join(json.dumps(result, separators=(",", ":")) + "\n" for result in results)
+
+
+async def ingest_stream(chunks, fmt, narrate=None, chunk_rows=INGEST_CHUNK_ROWS, max_llm_rows=INGEST_MAX_LLM_ROWS):
+    """Parse an async stream of byte chunks and yield NDJSON result lines as chunks are scored.
+
+    narrate(patient, vitals) is an optional coroutine used for Warning / Critical rows.
+    The last line is a {"summary": {...}} record with the totals for the run.
+    """
+    parser = RecordParser(fmt)
+    totals = {"rows": 0, "errors": 0, "normal": 0, "warning": 0, "critical": 0,
+              "narrated": 0, "llmBudget": max_llm_rows if narrate else 0}
+    pending = []
+    async for chunk in chunks:
+        pending.extend(parser.feed(chunk))
+        while len(pending) >= chunk_rows:
+            batch, pending = pending[:chunk_rows], pending[chunk_rows:]
+            yield await _emit_chunk(batch, totals["rows"], narrate, totals)
+
+    pending.extend(parser.close())
+    while pending:
+        batch, pending = pending[:chunk_rows], pending[chunk_rows:]
+        yield await _emit_chunk(batch, totals["rows"], narrate, totals)
+
+    del totals["llmBudget"]
+    yield json.dumps({"summary": totals}) + "\n"
+
+
+def guess_format(filename_or_content_type):
+    value = (filename_or_content_type or '').lower()
+    return 'csv' if 'csv' in value else 'ndjson'
+
+
+async def _read_file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _run_cli(args):
+    narrate = None
+    if args.llm:
+        # Reuse the API's Gemini setup (GEMINI_API_KEY etc. from .env)
+        from main import analyze_vitals_data
+        narrate = analyze_vitals_data
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        stream = ingest_stream(
+            _read_file_chunks(args.input),
+            args.format or guess_format(args.input),
+            narrate=narrate,
+            chunk_rows=args.chunk_rows,
+            max_llm_rows=args.max_llm_rows
+        )
+        async for lines in stream:
+            out.write(lines)
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a bulk CSV / NDJSON vitals export")
+    parser.add_argument("input", help="Path to the CSV or NDJSON export")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Input format (default: from file extension)")
+    parser.add_argument("--llm", action="store_true", help="Add AI narratives for Warning / Critical rows")
+    parser.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS, help="Rows scored per chunk")
+    parser.add_argument("--max-llm-rows", type=int, default=INGEST_MAX_LLM_ROWS, help="Max AI narratives per run")
+    parser.add_argument("--output", "-o", help="Write NDJSON here instead of stdout")
+    asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
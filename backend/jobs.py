@@ -0,0 +1,299 @@
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Background job settings for async /api/analyze
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOBS_SPOOL_DIR = os.getenv("JOBS_SPOOL_DIR", "job_uploads")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "200"))
+# A running job's lease; the worker renews it, and a job whose lease ran out
+# (its worker died) is queued again by whichever uvicorn worker notices first
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+DEFAULT_JOB_PRIORITY = 5
+# Clients may only lower a job's priority (up to this number), never queue ahead of default jobs
+MAX_JOB_PRIORITY = 9
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds JOB_QUEUE_MAX jobs"""
+
+
+class JobStore:
+    """SQLite-backed job records, so results survive a worker restart"""
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "stage TEXT, params TEXT NOT NULL, file_path TEXT, result TEXT, error TEXT, "
+            "stage_durations TEXT NOT NULL DEFAULT '{}', "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        # Owner and lease of a running job (added after the first release, so migrate old files)
+        for column in ("worker TEXT", "lease_until REAL"):
+            try:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+
+    def create(self, params, file_path, priority):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, priority, stage, params, file_path, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, 'queued', ?, ?, ?, ?)",
+                (job_id, priority, json.dumps(params), file_path, now, now)
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        columns = {
+            "status": fields.get("status"),
+            "stage": fields.get("stage"),
+            "result": json.dumps(fields["result"]) if "result" in fields else None,
+            "error": fields.get("error"),
+            "stage_durations": json.dumps(fields["stage_durations"]) if "stage_durations" in fields else None
+        }
+        columns = {k: v for k, v in columns.items() if v is not None}
+        assignments = ", ".join(f"{k} = ?" for k in columns)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                (*columns.values(), time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, priority, stage, params, file_path, result, error, "
+                "stage_durations, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "priority": row[2],
+            "stage": row[3],
+            "params": json.loads(row[4]),
+            "filePath": row[5],
+            "result": json.loads(row[6]) if row[6] else None,
+            "error": row[7],
+            "stageDurations": json.loads(row[8]),
+            "createdAt": row[9],
+            "updatedAt": row[10]
+        }
+
+    def claim(self, job_id, worker, lease):
+        """Atomically move a queued job to running for this worker; False if another worker got it"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'running', stage = 'starting', worker = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (worker, now + lease, now, job_id)
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, job_id, worker, lease):
+        """Extend a running job's lease; False if the job is no longer this worker's"""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + lease, job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def requeue_expired(self):
+        """Queue running jobs again whose worker stopped renewing the lease"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', worker = NULL, updated_at = ? "
+                "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (now, now)
+            )
+
+    def queued(self):
+        """(id, priority) of every queued job, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, priority FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall()
+        return rows
+
+
+class JobQueue:
+    """Priority queue plus a bounded pool of worker tasks.
+
+    handler(job, on_stage) does the actual work and returns the result;
+    on_stage(name) marks the start of each pipeline stage.
+    Lower priority numbers run first.
+    """
+
+    def __init__(self, store, handler, workers=JOB_WORKERS, max_queued=JOB_QUEUE_MAX, lease=JOB_LEASE_SECONDS):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.lease = lease
+        # Several uvicorn workers share the store; a job runs in whichever claims it first
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.lost_claims = 0
+        self.stage_totals = {}  # stage -> [count, total seconds]
+        self._queue = None
+        self._queued_ids = set()
+        self._tasks = []
+        self._counter = itertools.count()
+        self._events = {}
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        # Pick up jobs left queued, or running under a worker that is gone
+        self._adopt_orphans()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, job_id, priority):
+        if job_id not in self._queued_ids:
+            self._queued_ids.add(job_id)
+            self._queue.put_nowait((priority, next(self._counter), job_id))
+
+    def _adopt_orphans(self):
+        self.store.requeue_expired()
+        for job_id, priority in self.store.queued():
+            self._enqueue(job_id, priority)
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(self.lease)
+            await asyncio.to_thread(self._adopt_orphans)
+
+    def submit(self, params, file_path, priority=DEFAULT_JOB_PRIORITY):
+        if not DEFAULT_JOB_PRIORITY <= priority <= MAX_JOB_PRIORITY:
+            raise ValueError(f"Job priority must be between {DEFAULT_JOB_PRIORITY} and {MAX_JOB_PRIORITY}")
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFull()
+        job_id = self.store.create(params, file_path, priority)
+        self._enqueue(job_id, priority)
+        self._notify(job_id)
+        return job_id
+
+    def _notify(self, job_id):
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait_for_update(self, job_id, timeout):
+        """Wait until the job changes state, or timeout seconds pass"""
+        event = self._events.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            self._queued_ids.discard(job_id)
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await asyncio.to_thread(self.store.renew, job_id, self.worker_id, self.lease)
+
+    async def _run(self, job_id):
+        job = self.store.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return
+        if not self.store.claim(job_id, self.worker_id, self.lease):
+            # Another uvicorn worker is running (or already ran) it
+            self.lost_claims += 1
+            return
+
+        durations = {}
+        current = {"stage": None, "started": None}
+
+        def finish_stage():
+            if current["stage"] is not None:
+                elapsed = time.perf_counter() - current["started"]
+                durations[current["stage"]] = round(elapsed, 4)
+                totals = self.stage_totals.setdefault(current["stage"], [0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+
+        def on_stage(stage):
+            finish_stage()
+            current["stage"], current["started"] = stage, time.perf_counter()
+            self.store.update(job_id, stage=stage, stage_durations=durations)
+            self._notify(job_id)
+
+        self.running += 1
+        self._notify(job_id)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            result = await self.handler(job, on_stage)
+            finish_stage()
+            self.store.update(job_id, status="completed", stage="done", result=result, stage_durations=durations)
+            self.completed += 1
+        except Exception as e:
+            finish_stage()
+            print(f"Job {job_id} failed: {str(e)}")
+            self.store.update(job_id, status="failed", stage="done", error=str(e), stage_durations=durations)
+            self.failed += 1
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back instead of waiting out the lease
+            self.store.update(job_id, status="queued", stage="queued")
+            raise
+        finally:
+            heartbeat.cancel()
+            self.running -= 1
+            self._notify(job_id)
+        # Only a finished job's upload is deleted; a handed-back one still needs it
+        if job["filePath"] and os.path.exists(job["filePath"]):
+            os.remove(job["filePath"])
+
+    def stats(self):
+        return {
+            "queueDepth": self._queue.qsize() if self._queue else 0,
+            "maxQueued": self.max_queued,
+            "workers": self.workers,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "lostClaims": self.lost_claims,
+            "avgStageSeconds": {
+                stage: round(total / count, 4) for stage, (count, total) in self.stage_totals.items()
+            }
+        }
+
+
+async def spool_job_upload(upload, spool_dir=JOBS_SPOOL_DIR):
+    """Move an upload into the spool dir so a queued job can be re-run after a restart"""
+    os.makedirs(spool_dir, exist_ok=True)
+    return await upload.persist(os.path.join(spool_dir, uuid.uuid4().hex))
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+
+class JsonArrayStreamer:
+    """Incremental scanner for a JSON object arriving in text chunks.
+
+    feed() returns (field, index, value) for every element of a top-level
+    array field (e.g. "medications") as soon as that element is complete,
+    so items can be sent to the client before the whole object has arrived.
+    Text before the first "{" (such as a ```json fence) is skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None
+        self.key = None
+        self.array_field = None
+        self.array_index = 0
+        self.item_start = None
+        self.started = False
+        self.done = False
+
+    def feed(self, text):
+        self.buffer += text
+        items = []
+        buffer = self.buffer
+        while self.pos < len(buffer) and not self.done:
+            ch = buffer[self.pos]
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                self.pos += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = json.loads(buffer[self.string_start:self.pos + 1])
+                    elif self.depth == 2 and self.array_field is not None and self.item_start == self.string_start:
+                        self._emit(items, self.pos + 1)
+                self.pos += 1
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                self.string_start = self.pos
+                if self.depth == 2 and self.array_field is not None and self.item_start is None:
+                    self.item_start = self.pos
+            elif ch in "{[":
+                if self.depth == 1 and ch == "[":
+                    self.array_field = self.key
+                    self.array_index = 0
+                elif self.depth == 2 and self.array_field is not None and self.item_start is None:
+                    self.item_start = self.pos
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 2 and self.array_field is not None:
+                    # Closing the array itself; flush a trailing bare scalar
+                    if self.item_start is not None:
+                        self._emit(items, self.pos)
+                    self.array_field = None
+                self.depth -= 1
+                if self.depth == 2 and self.array_field is not None and self.item_start is not None:
+                    self._emit(items, self.pos + 1)
+                elif self.depth == 0:
+                    self.done = True
+            elif ch == ":" and self.depth == 1:
+                self.key = self.last_string
+            elif ch == "," and self.depth == 2 and self.array_field is not None and self.item_start is not None:
+                self._emit(items, self.pos)
+            elif not ch.isspace() and ch != "," and self.depth == 2 and self.array_field is not None and self.item_start is None:
+                # Bare scalar element (number, true/false/null)
+                self.item_start = self.pos
+            self.pos += 1
+        return items
+
+    def _emit(self, items, end):
+        raw = self.buffer[self.item_start:end].strip()
+        self.item_start = None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        items.append((self.array_field, self.array_index, value))
+        self.array_index += 1
+
+
+async def replay_json(data, chunk_size=48):
+    """Yield a JSON document in small text chunks, the way a model stream delivers it"""
+    text = json.dumps(data, indent=2)
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
+        await asyncio.sleep(0)
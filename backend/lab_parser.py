@@ -0,0 +1,245 @@
+"""Deterministic parser for machine-readable lab reports.
+
+Lines such as "Total Cholesterol 185 mg/dL" are matched against a lexicon
+of common analytes and classified with a reference-range table, so clean
+lab-system PDFs do not need the model to pull metrics out of the text.
+Values in other supported units (SI mmol/L, umol/L, g/L, /cumm) are
+converted to the table's unit first; a line with a missing or unknown unit
+is not counted as recognised.
+"""
+import os
+import re
+
+from vitals_rules import classify_blood_pressure
+
+# "narrative": metrics parsed locally, Gemini writes only summary/recommendations
+# "local": no Gemini call at all for confidently parsed reports
+# "off": always send the report to Gemini
+LAB_PARSER_MODE = os.getenv("LAB_PARSER_MODE", "narrative").lower()
+# Minimum share of value-bearing lines that must be recognised, and minimum
+# number of distinct analytes, before the local result is trusted
+LAB_PARSER_MIN_CONFIDENCE = float(os.getenv("LAB_PARSER_MIN_CONFIDENCE", "0.6"))
+LAB_PARSER_MIN_METRICS = int(os.getenv("LAB_PARSER_MIN_METRICS", "3"))
+
+# name -> (aliases, default unit, ranges)
+# ranges are (upper bound exclusive, status) checked in order; None = no upper bound
+ANALYTES = {
+    "Total Cholesterol": (("total cholesterol", "cholesterol, total", "cholesterol total", "cholesterol", "t. chol", "tc"), "mg/dL",
+                          ((200, "Normal"), (240, "Warning"), (None, "Critical"))),
+    "LDL Cholesterol": (("ldl cholesterol", "ldl-c", "ldl", "ldl chol"), "mg/dL",
+                        ((130, "Normal"), (160, "Warning"), (None, "Critical"))),
+    "HDL Cholesterol": (("hdl cholesterol", "hdl-c", "hdl", "hdl chol"), "mg/dL",
+                        ((30, "Critical"), (40, "Warning"), (None, "Normal"))),
+    "Triglycerides": (("triglycerides", "triglyceride", "tg", "trig"), "mg/dL",
+                      ((150, "Normal"), (500, "Warning"), (None, "Critical"))),
+    "Blood Sugar": (("fasting blood sugar", "fasting glucose", "blood glucose", "blood sugar", "glucose", "fbs"), "mg/dL",
+                    ((54, "Critical"), (70, "Warning"), (100, "Normal"), (126, "Warning"), (None, "Critical"))),
+    "HbA1c": (("hba1c", "hemoglobin a1c", "haemoglobin a1c", "glycated hemoglobin", "a1c"), "%",
+              ((5.7, "Normal"), (6.5, "Warning"), (None, "Critical"))),
+    "Hemoglobin": (("hemoglobin", "haemoglobin", "hgb", "hb"), "g/dL",
+                   ((8, "Critical"), (12, "Warning"), (17.5, "Normal"), (None, "Warning"))),
+    "WBC Count": (("white blood cell count", "white blood cells", "wbc count", "wbc", "total leukocyte count", "tlc"), "x10^3/uL",
+                  ((2, "Critical"), (4, "Warning"), (11, "Normal"), (30, "Warning"), (None, "Critical"))),
+    "Platelet Count": (("platelet count", "platelets", "plt"), "x10^3/uL",
+                       ((50, "Critical"), (150, "Warning"), (450, "Normal"), (None, "Warning"))),
+    "Creatinine": (("serum creatinine", "creatinine", "creat"), "mg/dL",
+                   ((0.6, "Warning"), (1.3, "Normal"), (2.0, "Warning"), (None, "Critical"))),
+    "Urea": (("blood urea nitrogen", "bun", "urea"), "mg/dL",
+             ((7, "Warning"), (21, "Normal"), (40, "Warning"), (None, "Critical"))),
+    "Sodium": (("sodium", "na+", "na"), "mmol/L",
+               ((125, "Critical"), (135, "Warning"), (146, "Normal"), (155, "Warning"), (None, "Critical"))),
+    "Potassium": (("potassium", "k+"), "mmol/L",
+                  ((3.0, "Critical"), (3.5, "Warning"), (5.1, "Normal"), (6.0, "Warning"), (None, "Critical"))),
+    "TSH": (("thyroid stimulating hormone", "tsh"), "mIU/L",
+            ((0.1, "Critical"), (0.4, "Warning"), (4.0, "Normal"), (10, "Warning"), (None, "Critical"))),
+    "Heart Rate": (("heart rate", "pulse rate", "pulse", "hr"), "bpm",
+                   ((50, "Critical"), (60, "Warning"), (101, "Normal"), (120, "Warning"), (None, "Critical"))),
+    "BMI": (("body mass index", "bmi"), "kg/m2",
+            ((18.5, "Warning"), (25, "Normal"), (30, "Warning"), (None, "Critical"))),
+}
+
+UNITS = (
+    "mg/dl", "g/dl", "g/l", "mmol/l", "mmol/mol", "meq/l", "umol/l", "µmol/l", "miu/l", "uiu/ml", "µiu/ml", "iu/l", "u/l",
+    "x10^3/ul", "x10^3/µl", "10^3/ul", "10^3/µl", "x10^9/l", "10^9/l", "/cumm", "/ul", "/µl", "k/ul",
+    "bpm", "kg/m2", "mmhg", "%"
+)
+# Spellings of the same unit
+UNIT_ALIASES = {
+    "meq/l": "mmol/l", "uiu/ml": "miu/l", "x10^3/ul": "10^3/ul", "k/ul": "10^3/ul",
+    "x10^9/l": "10^3/ul", "10^9/l": "10^3/ul", "/ul": "/cumm"
+}
+# Other units a report may use: unit -> (scale, offset) into the analyte's table unit
+UNIT_CONVERSIONS = {
+    "Total Cholesterol": {"mmol/l": (38.67, 0)},
+    "LDL Cholesterol": {"mmol/l": (38.67, 0)},
+    "HDL Cholesterol": {"mmol/l": (38.67, 0)},
+    "Triglycerides": {"mmol/l": (88.57, 0)},
+    "Blood Sugar": {"mmol/l": (18.016, 0)},
+    "HbA1c": {"mmol/mol": (0.09148, 2.152)},
+    "Hemoglobin": {"g/l": (0.1, 0)},
+    "WBC Count": {"/cumm": (0.001, 0)},
+    "Platelet Count": {"/cumm": (0.001, 0)},
+    "Creatinine": {"umol/l": (1 / 88.42, 0)},
+}
+# Analytes whose unit reports routinely leave out
+UNITLESS_ANALYTES = ("BMI",)
+
+_ALIAS_TO_ANALYTE = {alias: name for name, (aliases, _, _) in ANALYTES.items() for alias in aliases}
+_alias_pattern = "|".join(re.escape(a) for a in sorted(_ALIAS_TO_ANALYTE, key=len, reverse=True))
+_unit_pattern = "|".join(re.escape(u) for u in sorted(UNITS, key=len, reverse=True))
+_NUMBER = r"[<>]?\s*\d+(?:,\d{3})*(?:\.\d+)?"
+
+# "<analyte> [ (method) ] [:|-] <value> [unit]" at the start of a line
+ANALYTE_RE = re.compile(
+    rf"^\s*(?P<alias>{_alias_pattern})(?![a-z])[\s:.\-]*(?:\([^)]*\)[\s:.\-]*)?(?P<value>{_NUMBER})\s*(?P<unit>{_unit_pattern})?",
+    re.IGNORECASE
+)
+BLOOD_PRESSURE_RE = re.compile(
+    r"^\s*(?:blood pressure|b\.?p\.?)(?![a-z])[^\d\n]*(?P<systolic>\d{2,3})\s*/\s*(?P<diastolic>\d{2,3})",
+    re.IGNORECASE
+)
+# A label followed by a number: the kind of line a lab result could be
+CANDIDATE_RE = re.compile(r"^\s*[A-Za-z][A-Za-z0-9 ,()./+\-]{1,48}?[\s:.\-]+[<>]?\s*\d+(?:\.\d+)?\s*(?:[A-Za-z%/^µ0-9]+)?\s*")
+
+
+def classify(name, value):
+    """Normal / Warning / Critical for an analyte value using the reference table"""
+    for upper, status in ANALYTES[name][2]:
+        if upper is None or value < upper:
+            return status
+    return "Normal"
+
+
+def _unit_key(unit):
+    unit = unit.lower().replace("µ", "u")
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def to_table_unit(name, value, unit):
+    """value converted to the analyte's table unit, or None when the unit is missing or not one it can be in"""
+    if unit is None:
+        return value if name in UNITLESS_ANALYTES else None
+    unit = _unit_key(unit)
+    if unit == _unit_key(ANALYTES[name][1]):
+        return value
+    conversion = UNIT_CONVERSIONS.get(name, {}).get(unit)
+    if conversion is None:
+        return None
+    scale, offset = conversion
+    return value * scale + offset
+
+
+def _format_value(raw):
+    return raw.replace(" ", "").replace(",", "")
+
+
+def parse_lab_report(text):
+    """Extract metrics from report text.
+
+    Returns the metrics list (first reading per analyte), the share of
+    value-bearing lines that were recognised and whether the result is
+    confident enough to skip the model for metric extraction.
+    """
+    metrics = {}
+    candidates = 0
+    matched = 0
+    for line in text.splitlines():
+        if not CANDIDATE_RE.match(line):
+            continue
+        candidates += 1
+
+        bp = BLOOD_PRESSURE_RE.match(line)
+        if bp:
+            matched += 1
+            systolic, diastolic = int(bp.group("systolic")), int(bp.group("diastolic"))
+            metrics.setdefault("Blood Pressure", {
+                "name": "Blood Pressure",
+                "value": f"{systolic}/{diastolic} mmHg",
+                "status": classify_blood_pressure(systolic, diastolic)
+            })
+            continue
+
+        m = ANALYTE_RE.match(line)
+        if not m:
+            continue
+        name = _ALIAS_TO_ANALYTE[m.group("alias").lower()]
+        raw = _format_value(m.group("value"))
+        value = to_table_unit(name, float(raw.lstrip("<>")), m.group("unit"))
+        if value is None:
+            # Missing or unexpected unit: leave the line to the model
+            continue
+        matched += 1
+        if name in metrics:
+            continue
+        unit = m.group("unit") or ANALYTES[name][1]
+        metrics[name] = {
+            "name": name,
+            "value": f"{raw} {unit}".strip() if unit != "%" else f"{raw}%",
+            "status": classify(name, value)
+        }
+
+    confidence = matched / candidates if candidates else 0.0
+    return {
+        "metrics": list(metrics.values()),
+        "confidence": round(confidence, 3),
+        "candidateLines": candidates,
+        "matchedLines": matched,
+        "confident": len(metrics) >= LAB_PARSER_MIN_METRICS and confidence >= LAB_PARSER_MIN_CONFIDENCE
+    }
+
+
+def local_narrative(metrics, name):
+    """Deterministic summary / recommendations for locally parsed metrics"""
+    flagged = [m for m in metrics if m["status"] != "Normal"]
+    critical = [m["name"] for m in flagged if m["status"] == "Critical"]
+    warning = [m["name"] for m in flagged if m["status"] == "Warning"]
+
+    summary = f"Lab report for {name} lists {len(metrics)} measured values, {len(metrics) - len(flagged)} within reference ranges."
+    if critical:
+        summary += f" Values needing prompt attention: {', '.join(critical)}."
+    if warning:
+        summary += f" Borderline values: {', '.join(warning)}."
+    if not flagged:
+        summary += " No abnormal results detected."
+
+    if critical:
+        recommendations = "Review the flagged results with a physician promptly. Repeat the abnormal tests to confirm and assess treatment options."
+    elif warning:
+        recommendations = "Discuss the borderline results at the next visit. Focus on diet, exercise and weight management, and recheck in 3 months."
+    else:
+        recommendations = "Continue maintaining a balanced diet and regular exercise routine. Repeat routine screening at the next annual checkup."
+    return {"summary": summary, "recommendations": recommendations}
+
+
+# Most severe reading wins when documents disagree
+STATUS_SEVERITY = {"Normal": 0, "Warning": 1, "Critical": 2}
+
+
+def canonical_metric_name(name):
+    """Lexicon name for a metric label ("LDL-C" -> "LDL Cholesterol"), else the label itself"""
+    label = name.strip()
+    return _ALIAS_TO_ANALYTE.get(label.lower(), label)
+
+
+def merge_metrics(metric_lists):
+    """De-duplicate metrics reported by several documents.
+
+    Metrics are matched by canonical name; when readings disagree the most
+    severe one is kept. Each merged metric lists the `sources` it came from
+    (taken from the input metrics' own `sources`, if any).
+    """
+    merged = {}
+    for metrics in metric_lists:
+        for metric in metrics:
+            name = canonical_metric_name(metric.get("name", ""))
+            key = name.lower()
+            sources = list(metric.get("sources", []))
+            current = merged.get(key)
+            if current is None:
+                merged[key] = {**metric, "name": name, "sources": sources}
+                continue
+            current_sources = current["sources"]
+            if STATUS_SEVERITY.get(metric.get("status"), 0) > STATUS_SEVERITY.get(current.get("status"), 0):
+                current = merged[key] = {**metric, "name": name}
+            current["sources"] = current_sources + [s for s in sources if s not in current_sources]
+    return list(merged.values())
@@ -1,19 +1,55 @@
-from fastapi import FastAPI, File, UploadFile, Form, Body
+from fastapi import FastAPI, File, UploadFile, Form, Body, Request, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from typing import Dict, Any
-import google.generativeai as genai
-from PIL import Image
-import PyPDF2
-import io
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from typing import Dict, Any, List
 import os
+import hashlib
+import math
+import time
+import asyncio
+import json
 from dotenv import load_dotenv
 import re
 
+# Before the local imports: they read their settings from the environment at import time
 load_dotenv()
 
+from gemini_client import GeminiClient, ClientDisconnected, cancel_on_disconnect, load_gemini_model, GEMINI_WARMUP
+from rate_limit import RateLimiter, RateLimited
+from resilience import CircuitOpen
+from cache import ResponseCache, make_cache_key
+from singleflight import SingleFlight
+from vitals_batch import score_vitals_batch, records_to_columns, batch_result_to_json
+from ingest import ingest_stream, guess_format
+from pdf_extract import extract_pdf_text, shutdown_pool as shutdown_pdf_pool
+from uploads import spool_upload, load_spooled_file, UploadLimitMiddleware, UploadTooLarge
+import image_prep
+import prompt_compact
+from json_stream import JsonArrayStreamer, replay_json
+from structured import (
+    StructuredOutputStats, json_config, schema_subset, validate_response,
+    VITALS_ANALYSIS_SCHEMA, REPORT_ANALYSIS_SCHEMA, NARRATIVE_SCHEMA,
+    PRESCRIPTION_SCHEMA, LAB_TESTS_SCHEMA, FOLLOWUP_SCHEMA, CONSULT_SCHEMA
+)
+from lab_parser import parse_lab_report, local_narrative, merge_metrics, LAB_PARSER_MODE
+from vitals_store import VitalsStore, patient_key, reading_visit, vitals_readings, lab_readings, trend_lines
+from model_router import ModelRouter, classify_case, GEMINI_LITE_MODEL
+from speculate import Speculator, SPECULATIVE_SUGGESTIONS, SPECULATION_TTL_SECONDS
+from vitals_rules import (
+    STATUS_DEDUCTIONS, HISTORY_DEDUCTIONS, MIN_SCORE, HEART_RATE_RANGE, RISK_FACTORS, score_tier,
+    classify_blood_pressure, classify_heart_rate, classify_oxygen, classify_bmi,
+    classify_temperature, classify_respiratory_rate, unscored_vitals
+)
+from vitals_monitor import MonitorSession, MonitorHub, VITALS_MONITOR_IDLE_SECONDS, VITALS_MONITOR_SETTLE_SECONDS
+from metrics import MetricsMiddleware, timed, record_fallback, record_parse_failure, render as render_metrics
+from jobs import JobStore, JobQueue, QueueFull, spool_job_upload, TERMINAL_STATUSES, DEFAULT_JOB_PRIORITY, MAX_JOB_PRIORITY
+
 app = FastAPI()
 
+# Reject oversized multipart uploads while they stream in
+# (added before CORS so the 413 still carries CORS headers)
+app.add_middleware(UploadLimitMiddleware)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -23,11 +59,232 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, per-stage timings and the Server-Timing header
+# (added last so it is outermost and times everything else)
+app.add_middleware(MetricsMiddleware)
+
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# RPM / TPM quota shared by every Gemini call
+rate_limiter = RateLimiter()
 if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    # Shared non-blocking client used by every generation path. The SDK is
+    # imported and the model built on first use, so workers start fast and
+    # mock-only workers never load it.
+    gemini = GeminiClient(
+        model_factory=lambda: load_gemini_model(GEMINI_API_KEY, GEMINI_MODEL),
+        limiter=rate_limiter
+    )
+    # Cheaper tier for clearly normal cases (see model_router); same quota
+    gemini_lite = GeminiClient(
+        model_factory=lambda: load_gemini_model(GEMINI_API_KEY, GEMINI_LITE_MODEL),
+        limiter=rate_limiter
+    ) if GEMINI_LITE_MODEL else None
+# Picks the rule engine, the lite model or the full model per generation
+router = ModelRouter()
+
+@app.on_event("startup")
+async def warm_up_gemini_client():
+    if GEMINI_API_KEY and GEMINI_WARMUP:
+        # In the background: the worker takes traffic while the model loads
+        asyncio.create_task(gemini.warm_up())
+        if gemini_lite is not None:
+            asyncio.create_task(gemini_lite.warm_up())
+
+@app.on_event("shutdown")
+def shutdown_gemini_client():
+    if GEMINI_API_KEY:
+        gemini.shutdown()
+        if gemini_lite is not None:
+            gemini_lite.shutdown()
+    shutdown_pdf_pool()
+
+# Most reports one /api/analyze/multi request may carry
+MULTI_ANALYZE_MAX_FILES = int(os.getenv("MULTI_ANALYZE_MAX_FILES", "10"))
+
+# Background jobs for /api/analyze?async=1, created on startup
+job_queue = None
+
+@app.on_event("startup")
+async def start_job_queue():
+    global job_queue
+    job_queue = JobQueue(JobStore(), run_analysis_job)
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    if job_queue is not None:
+        await job_queue.stop()
+
+# Cache for AI responses, keyed on the normalized prompt inputs
+response_cache = ResponseCache()
+# Identical concurrent model calls (same cache key) share one in-flight request
+single_flight = SingleFlight()
+structured_stats = StructuredOutputStats()
+# Per-patient vitals / lab metric history with rolling trend aggregates
+vitals_history = VitalsStore()
+# Open bedside monitor streams (/api/vitals/monitor) of this worker
+monitor_hub = MonitorHub()
+# Background suggestion generations started after a vitals analysis
+speculator = Speculator(rate_limiter)
+
+@app.on_event("shutdown")
+def stop_speculation():
+    speculator.cancel_all()
+
+VITALS_PROMPT_FIELDS = (
+    'systolic', 'diastolic', 'heartRate', 'temperature', 'respiratoryRate',
+    'oxygenSaturation', 'weight', 'height', 'otherConditions', 'allergies'
+)
+HISTORY_FLAGS = ('heartDisease', 'diabetes', 'hypertension', 'asthma')
+# The rule engine's riskFactors entry when there are none
+NO_RISK_FACTORS = "No immediate risk factors identified"
+# What the prompts ask the model to put in riskFactors when there are none
+NO_CONCERNS = "No immediate concerns"
+# The rule engine's summary of each risk tier
+SCORE_SUMMARIES = {"Normal": "within normal ranges", "Warning": "showing some concerns", "Critical": "requiring attention"}
+
+def normalize_patient(patient: dict):
+    """Reduce patient info to the fields used in prompts"""
+    return {k: str(patient.get(k) if patient.get(k) is not None else '').strip() for k in ('name', 'age', 'gender')}
+
+def normalize_vitals(vitals: dict):
+    """Reduce raw vitals to the fields used in the vitals prompt"""
+    vitals = vitals or {}
+    normalized = {k: str(vitals.get(k)).strip() for k in VITALS_PROMPT_FIELDS if vitals.get(k) not in (None, '')}
+    normalized['history'] = [k for k in HISTORY_FLAGS if vitals.get(k)]
+    return normalized
+
+def suggestion_cache_key(kind: str, patient: dict, vitals: dict, lab_reports: list, model: str = GEMINI_MODEL):
+    """Cache key for prescription / lab test / follow-up prompts"""
+    score = vitals.get('overallScore') if vitals else None
+    return make_cache_key(kind, model, normalize_patient(patient), score, len(lab_reports or []), patient_trend_lines(patient))
+
+def vitals_cache_key(patient: dict, vitals: dict, model: str = GEMINI_MODEL):
+    """Cache key for the vitals analysis prompt"""
+    return make_cache_key("vitals", model, normalize_patient(patient), normalize_vitals(vitals), patient_trend_lines(patient, vitals))
+
+def tier_client(tier: str):
+    return gemini_lite if tier == "lite" else gemini
+
+def tier_model(tier: str):
+    """Model name of a tier, for cache keys"""
+    return GEMINI_LITE_MODEL if tier == "lite" else GEMINI_MODEL
+
+def real_risk_factors(analysis: dict):
+    """An analysis' riskFactors without the "none" placeholders of the rule engine and the model"""
+    fillers = (NO_RISK_FACTORS.lower(), NO_CONCERNS.lower())
+    return [r for r in analysis.get('riskFactors') or [] if r and not str(r).strip().lower().startswith(fillers)]
+
+def vitals_complexity(rule_analysis: dict, vitals: dict):
+    """Case complexity from the rule engine's vitals analysis.
+    
+    Vitals the rules could not assess (missing, unparseable) make the case
+    borderline at least: the rules filled in defaults, so their "normal"
+    says nothing about those fields.
+    """
+    complexity = classify_case(
+        rule_analysis['overallScore'], [m['status'] for m in rule_analysis['metrics']], real_risk_factors(rule_analysis)
+    )
+    if complexity == "normal" and unscored_vitals(vitals):
+        return "borderline"
+    return complexity
+
+def route_vitals(patient: dict, vitals: dict, trends: dict):
+    """Rule engine analysis of the vitals and the tier that should answer them"""
+    if not GEMINI_API_KEY:
+        return generate_mock_vitals_analysis(patient, vitals, trends), "local"
+    started = time.perf_counter()
+    rule_analysis = generate_mock_vitals_analysis(patient, vitals, trends)
+    tier = router.route("vitals", vitals_complexity(rule_analysis, vitals), local_ok=True)
+    if tier == "local":
+        router.observe("vitals", tier, time.perf_counter() - started)
+    return rule_analysis, tier
+
+def route_suggestion(kind: str, vitals: dict, lab_reports: list):
+    """Tier for a suggestion, from the vitals analysis and lab reports it is based on"""
+    if not GEMINI_API_KEY:
+        return "local"
+    if not vitals:
+        # Nothing to judge the case by
+        return router.route(kind, "borderline")
+    statuses = [m.get('status') for m in vitals.get('metrics') or []]
+    for report in lab_reports or []:
+        statuses += [m.get('status') for m in report.get('metrics') or []]
+    return router.route(kind, classify_case(vitals.get('overallScore'), statuses, real_risk_factors(vitals)))
+
+def patient_trends(patient: dict, vitals: dict = None):
+    """Rolling aggregates of the patient's stored visits (one indexed read, however long the history).
+    
+    Given the vitals being analyzed, their own visit is left out.
+    """
+    key = patient_key(patient)
+    if key is None:
+        return {}
+    return vitals_history.trends(key, reading_visit(vitals)[0] if vitals is not None else None)
+
+def patient_trend_lines(patient: dict, vitals: dict = None):
+    return trend_lines(patient_trends(patient, vitals))
+
+def history_context(patient: dict, vitals: dict = None):
+    """Trend block for prompts, in place of resending past readings"""
+    lines = patient_trend_lines(patient, vitals)
+    if not lines:
+        return "Trends from previous visits: none recorded"
+    return "Trends from previous visits:\n" + "\n".join(lines)
+
+def record_vitals(patient: dict, vitals: dict, analysis: dict):
+    """Store this visit's readings (statuses from the analysis) for later trend analysis.
+    
+    Callers skip cached analyses: those vitals were recorded when first analyzed.
+    """
+    key = patient_key(patient)
+    if key is not None:
+        visit, ts = reading_visit(vitals)
+        vitals_history.record(key, vitals_readings(vitals, analysis), visit, ts)
+    return analysis
+
+def record_lab_metrics(patient_id: str, measured: list):
+    """Store the measured metrics of an analyzed lab report for later trend analysis.
+    
+    measured comes from the analysis functions, which leave out mock
+    (fallback) metrics: those are placeholders, not readings.
+    """
+    key = patient_key({'id': patient_id})
+    if measured and key is not None:
+        vitals_history.record(key, lab_readings(measured))
+
+def speculate_suggestions(patient: dict, analysis: dict, lab_reports: list):
+    """Start the prescription / lab test / follow-up generations a clinician usually asks for next.
+    
+    They run in the background and land in the response cache under the keys
+    the suggestion endpoints look up (or are joined in flight), so those
+    clicks are served without waiting on Gemini.
+    """
+    if not (SPECULATIVE_SUGGESTIONS and GEMINI_API_KEY and patient):
+        return analysis
+    lab_reports = lab_reports or []
+    # Without an id, group by what the suggestion cache keys see of the patient
+    group = patient_key(patient) or make_cache_key("patient", normalize_patient(patient))
+    speculator.submit(group, [
+        lambda: generate_prescription_suggestions(patient, analysis, lab_reports, SPECULATION_TTL_SECONDS),
+        lambda: generate_lab_test_suggestions(patient, analysis, lab_reports, SPECULATION_TTL_SECONDS),
+        lambda: generate_followup_plan(patient, analysis, lab_reports, SPECULATION_TTL_SECONDS)
+    ])
+    return analysis
+
+def extraction_cache_key(file_hash: str, file_type: str):
+    """Cache key for text extracted from an upload, by SHA-256 of its bytes"""
+    if file_type.startswith("image/"):
+        # Image text comes from the Vision model, so it depends on the model too
+        return f"extraction:{GEMINI_MODEL}:{file_hash}"
+    return f"extraction:{file_hash}"
+
+def analysis_cache_key(extracted_text: str, name: str, age: str, gender: str):
+    """Cache key for a lab report analysis"""
+    text_hash = hashlib.sha256(extracted_text.encode('utf-8')).hexdigest()
+    return make_cache_key("analysis", GEMINI_MODEL, text_hash, normalize_patient({'name': name, 'age': age, 'gender': gender}))
 
 def clean_markdown(text):
     """Remove markdown formatting from text"""
@@ -40,39 +297,205 @@ def clean_markdown(text):
     text = re.sub(r'`(.+?)`', r'\1', text)  # Remove inline code
     return text.strip()
 
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(events):
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def start_event_stream(events):
+    """Start an SSE response once the first event is ready, so quota errors can still be a 429/503"""
+    try:
+        first = await events.__anext__()
+    except RateLimited as e:
+        return rate_limited_response(e)
+    
+    async def replay():
+        yield first
+        async for event in events:
+            yield event
+    
+    return event_stream(replay())
+
+def rate_limited_response(error: RateLimited):
+    retry_after = max(1, math.ceil(error.retry_after))
+    return JSONResponse(
+        status_code=error.status_code,
+        headers={"Retry-After": str(retry_after)},
+        content={"error": str(error), "retryAfter": retry_after}
+    )
+
+def clean_narrative(result: dict):
+    """Strip markdown from the summary / recommendations fields"""
+    result['summary'] = clean_markdown(result.get('summary', ''))
+    result['recommendations'] = clean_markdown(result.get('recommendations', ''))
+    return result
+
+def fallback_reason(error: Exception):
+    """Metrics label for why a response came from the mock engine"""
+    return "circuit_open" if isinstance(error, CircuitOpen) else "error"
+
 @app.get("/")
 def read_root():
     return {"message": "MediLens API is running"}
 
+@app.get("/api/cache/stats")
+def cache_stats():
+    """Hit/miss counters for the AI response cache"""
+    return response_cache.stats()
+
+@app.get("/api/stats")
+def service_stats():
+    """Counters for the cache and request coalescing layers"""
+    return {
+        "cache": response_cache.stats(),
+        "singleFlight": single_flight.stats(),
+        "jobs": job_queue.stats() if job_queue else None,
+        "imagePrep": image_prep.stats(),
+        "promptCompaction": prompt_compact.stats(),
+        "structuredOutput": structured_stats.stats(),
+        "rateLimiter": rate_limiter.stats(),
+        "vitalsHistory": vitals_history.stats(),
+        "vitalsMonitor": monitor_hub.stats(),
+        "speculation": speculator.stats(),
+        "router": router.stats(),
+        "gemini": gemini.stats() if GEMINI_API_KEY else None,
+        "geminiLite": gemini_lite.stats() if GEMINI_API_KEY and gemini_lite is not None else None
+    }
+
+@app.get("/api/vitals/trends")
+def vitals_trends(patient_id: str = Query(..., alias="id", min_length=1), metric: str = None):
+    """Rolling trend aggregates for a patient, plus the raw readings of one metric if asked"""
+    key = patient_key({'id': patient_id})
+    response = {"patientKey": key, "trends": vitals_history.trends(key)}
+    if metric:
+        response["history"] = vitals_history.history(key, metric)
+    return response
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
 @app.post("/api/analyze-vitals")
-async def analyze_vitals(request: Dict[str, Any] = Body(...)):
+async def analyze_vitals(http_request: Request, request: Dict[str, Any] = Body(...)):
     """Analyze patient vitals and medical history"""
     try:
         patient = request.get('patient', {})
         vitals = request.get('vitals', {})
         
-        # Generate analysis based on vitals
-        analysis_result = await analyze_vitals_data(patient, vitals)
+        # Generate (and record) the analysis based on vitals
+        analysis_result = await cancel_on_disconnect(
+            http_request,
+            analyze_vitals_data(patient, vitals)
+        )
+        # After recording, so the suggestion cache keys include this visit's trends
+        speculate_suggestions(patient, analysis_result, request.get('labReports'))
         
         return JSONResponse(content=analysis_result)
     
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e)}
+        )
+
+@app.post("/api/analyze-vitals/batch")
+async def analyze_vitals_batch(request: Dict[str, Any] = Body(...)):
+    """Screen many patients at once with the vectorized rule engine"""
+    try:
+        if 'columns' in request:
+            columns = request['columns']
+        elif 'records' in request:
+            columns = records_to_columns([r.get('vitals', r) for r in request['records']])
+        else:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Provide vitals as 'columns' (field -> list) or 'records' (list of vitals)"}
+            )
+        
+        def score():
+            return batch_result_to_json(score_vitals_batch(columns))
+        
+        # Large cohorts take a while to score, keep it off the event loop
+        result = await asyncio.to_thread(score)
+        if request.get('ids') is not None:
+            result['ids'] = request['ids']
+        return JSONResponse(content=result)
+    
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
 
+class RequestStreamingResponse(StreamingResponse):
+    """StreamingResponse whose body generator reads the request stream itself.
+    
+    The stock response listens for disconnects with receive(), which would
+    swallow the request body messages the generator is still reading.
+    """
+    
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@app.post("/api/ingest/vitals")
+async def ingest_vitals(
+    http_request: Request,
+    fmt: str = Query(None, alias="format"),
+    llm: bool = False
+):
+    """Stream a CSV / NDJSON vitals export in and scored NDJSON rows out"""
+    fmt = fmt or guess_format(http_request.headers.get('content-type'))
+    if fmt not in ('csv', 'ndjson'):
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Unsupported format '{fmt}', use 'csv' or 'ndjson'"}
+        )
+    
+    narrate = analyze_vitals_data if llm and GEMINI_API_KEY else None
+    return RequestStreamingResponse(
+        ingest_stream(http_request.stream(), fmt, narrate=narrate),
+        media_type="application/x-ndjson"
+    )
+
 @app.post("/api/suggest-prescription")
-async def suggest_prescription(request: Dict[str, Any] = Body(...)):
+async def suggest_prescription(http_request: Request, request: Dict[str, Any] = Body(...)):
     """Generate AI-powered prescription suggestions"""
     try:
         patient = request.get('patient', {})
         vitals = request.get('vitals')
         lab_reports = request.get('labReports', [])
         
-        result = await generate_prescription_suggestions(patient, vitals, lab_reports)
+        result = await cancel_on_disconnect(
+            http_request,
+            generate_prescription_suggestions(patient, vitals, lab_reports)
+        )
         return JSONResponse(content=result)
     
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -80,16 +503,26 @@ async def suggest_prescription(request: Dict[str, Any] = Body(...)):
         )
 
 @app.post("/api/suggest-lab-tests")
-async def suggest_lab_tests(request: Dict[str, Any] = Body(...)):
+async def suggest_lab_tests(http_request: Request, request: Dict[str, Any] = Body(...)):
     """Generate AI-powered lab test recommendations"""
     try:
         patient = request.get('patient', {})
         vitals = request.get('vitals')
         lab_reports = request.get('labReports', [])
         
-        result = await generate_lab_test_suggestions(patient, vitals, lab_reports)
+        result = await cancel_on_disconnect(
+            http_request,
+            generate_lab_test_suggestions(patient, vitals, lab_reports)
+        )
         return JSONResponse(content=result)
     
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -97,16 +530,223 @@ async def suggest_lab_tests(request: Dict[str, Any] = Body(...)):
         )
 
 @app.post("/api/generate-followup")
-async def generate_followup(request: Dict[str, Any] = Body(...)):
+async def generate_followup(http_request: Request, request: Dict[str, Any] = Body(...)):
     """Generate AI-powered follow-up plan"""
     try:
         patient = request.get('patient', {})
         vitals = request.get('vitals')
         lab_reports = request.get('labReports', [])
         
-        result = await generate_followup_plan(patient, vitals, lab_reports)
+        result = await cancel_on_disconnect(
+            http_request,
+            generate_followup_plan(patient, vitals, lab_reports)
+        )
+        return JSONResponse(content=result)
+    
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e)}
+        )
+
+@app.post("/api/analyze-vitals/stream")
+async def analyze_vitals_stream(request: Dict[str, Any] = Body(...)):
+    """Stream the vitals analysis as Server-Sent Events, one metric at a time"""
+    patient = request.get('patient', {})
+    vitals = request.get('vitals', {})
+    rule_analysis, tier = route_vitals(patient, vitals, patient_trends(patient, vitals))
+    return await start_event_stream(stream_json_events(
+        "vitals",
+        vitals_analysis_prompt(patient, vitals),
+        VITALS_ANALYSIS_SCHEMA,
+        vitals_cache_key(patient, vitals, tier_model(tier)),
+        lambda: rule_analysis,
+        finalize=clean_narrative,
+        tier=tier,
+        on_result=lambda result: speculate_suggestions(
+            patient, record_vitals(patient, vitals, result), request.get('labReports')
+        )
+    ))
+
+@app.websocket("/api/vitals/monitor")
+async def vitals_monitor(websocket: WebSocket):
+    """Live vitals from a bedside monitor, scored incrementally.
+    
+    Each message is a JSON object of (partial) vitals, or {"vitals": {...},
+    "patient": {...}, "seq": n}; the patient can also be given as query
+    parameters. A reading that changes a metric status, raises an alert or
+    moves the risk tier gets one "update" message listing those events
+    (tagged with the reading's seq); other readings get no reply. A narrative
+    analysis is generated only once a changed risk tier has held for the
+    settle time.
+    """
+    if not monitor_hub.open():
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+    
+    params = websocket.query_params
+    session = MonitorSession({k: params[k] for k in ('id', 'name', 'age', 'gender') if params.get(k)})
+    send_lock = asyncio.Lock()
+    settling = None
+    narratives = set()
+    # Tier of the last narrative (a new stream starts from the all-normal score)
+    narrated = {"tier": session.tier}
+    
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+    
+    async def narrate(tier, score, vitals):
+        analysis = await monitor_narrative(session.patient, vitals)
+        monitor_hub.count([{"type": "narrative"}])
+        try:
+            await send({"type": "narrative", "tier": tier, "overallScore": score, "analysis": analysis})
+        except Exception:
+            # The monitor disconnected while the narrative was generated
+            pass
+    
+    async def settle(tier):
+        await asyncio.sleep(VITALS_MONITOR_SETTLE_SECONDS)
+        narrated["tier"] = tier
+        # Once started, a narrative is delivered even if the tier moves on
+        task = asyncio.create_task(narrate(tier, session.score, session.snapshot()))
+        narratives.add(task)
+        task.add_done_callback(narratives.discard)
+    
+    try:
+        await websocket.accept()
+        await send({"type": "ready", "tier": session.tier, "overallScore": session.score})
+        while True:
+            try:
+                text = await asyncio.wait_for(websocket.receive_text(), VITALS_MONITOR_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1001)
+                break
+            try:
+                message = json.loads(text)
+                if not isinstance(message, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                monitor_hub.invalid += 1
+                await send({"type": "error", "error": f"Invalid reading: {str(e)}"})
+                continue
+            
+            if isinstance(message.get('patient'), dict):
+                session.patient = message['patient']
+            reading = message.get('vitals', message)
+            monitor_hub.readings += 1
+            events = session.update(reading if isinstance(reading, dict) else {})
+            if not events:
+                continue
+            monitor_hub.count(events)
+            # One frame per reading, however many events it caused
+            await send({
+                "type": "update",
+                "seq": message.get('seq'),
+                "tier": session.tier,
+                "overallScore": session.score,
+                "events": events
+            })
+            if events[-1]['type'] == 'tier':
+                # Restart the settle timer; no narrative if the tier flipped back
+                if settling is not None:
+                    settling.cancel()
+                settling = asyncio.create_task(settle(session.tier)) if session.tier != narrated["tier"] else None
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in [settling, *narratives]:
+            if task is not None:
+                task.cancel()
+        monitor_hub.close()
+
+@app.post("/api/suggest-prescription/stream")
+async def suggest_prescription_stream(request: Dict[str, Any] = Body(...)):
+    """Stream prescription suggestions as Server-Sent Events, one medication at a time"""
+    patient = request.get('patient', {})
+    vitals = request.get('vitals')
+    lab_reports = request.get('labReports', [])
+    tier = route_suggestion("prescription", vitals, lab_reports)
+    return await start_event_stream(stream_json_events(
+        "prescription",
+        prescription_prompt(patient, vitals, lab_reports),
+        PRESCRIPTION_SCHEMA,
+        suggestion_cache_key("prescription", patient, vitals, lab_reports, tier_model(tier)),
+        lambda: generate_mock_prescription(patient, vitals, lab_reports),
+        tier=tier
+    ))
+
+@app.post("/api/suggest-lab-tests/stream")
+async def suggest_lab_tests_stream(request: Dict[str, Any] = Body(...)):
+    """Stream lab test recommendations as Server-Sent Events, one test at a time"""
+    patient = request.get('patient', {})
+    vitals = request.get('vitals')
+    lab_reports = request.get('labReports', [])
+    tier = route_suggestion("lab-tests", vitals, lab_reports)
+    return await start_event_stream(stream_json_events(
+        "lab-tests",
+        lab_tests_prompt(patient, vitals, lab_reports),
+        LAB_TESTS_SCHEMA,
+        suggestion_cache_key("lab-tests", patient, vitals, lab_reports, tier_model(tier)),
+        lambda: generate_mock_lab_tests(patient, vitals, lab_reports),
+        tier=tier
+    ))
+
+@app.post("/api/generate-followup/stream")
+async def generate_followup_stream(request: Dict[str, Any] = Body(...)):
+    """Stream the follow-up plan as Server-Sent Events, one schedule item at a time"""
+    patient = request.get('patient', {})
+    vitals = request.get('vitals')
+    lab_reports = request.get('labReports', [])
+    tier = route_suggestion("followup", vitals, lab_reports)
+    return await start_event_stream(stream_json_events(
+        "followup",
+        followup_prompt(patient, vitals, lab_reports),
+        FOLLOWUP_SCHEMA,
+        suggestion_cache_key("followup", patient, vitals, lab_reports, tier_model(tier)),
+        lambda: generate_mock_followup(patient, vitals, lab_reports),
+        tier=tier
+    ))
+
+@app.post("/api/consult")
+async def consult(http_request: Request, request: Dict[str, Any] = Body(...)):
+    """Generate a full consult: vitals analysis, prescription, lab tests and follow-up"""
+    try:
+        patient = request.get('patient', {})
+        vitals = request.get('vitals', {})
+        lab_reports = request.get('labReports', [])
+        mode = request.get('mode', 'combined')
+        
+        if mode == 'combined':
+            generation = generate_consult(patient, vitals, lab_reports)
+        elif mode == 'fanout':
+            generation = generate_consult_fanout(patient, vitals, lab_reports)
+        else:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Unknown consult mode '{mode}', use 'combined' or 'fanout'"}
+            )
+        
+        # The generators record the vitals analysis unless it was cached
+        result = await cancel_on_disconnect(http_request, generation)
+        result['mode'] = mode
         return JSONResponse(content=result)
     
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -115,76 +755,268 @@ async def generate_followup(request: Dict[str, Any] = Body(...)):
 
 @app.post("/api/analyze")
 async def analyze_report(
+    http_request: Request,
     file: UploadFile = File(...),
     name: str = Form(...),
     age: str = Form(...),
-    gender: str = Form(...)
+    gender: str = Form(...),
+    patient_id: str = Form("", alias="patientId"),
+    async_mode: bool = Query(False, alias="async"),
+    priority: int = Query(DEFAULT_JOB_PRIORITY, ge=DEFAULT_JOB_PRIORITY, le=MAX_JOB_PRIORITY)
 ):
+    upload = None
     try:
-        # Read file content
-        content = await file.read()
-        file_type = file.content_type
+        # Hash and size-check the file where Starlette spooled it (memory, or disk once large)
+        with timed("spool"):
+            upload = await spool_upload(file)
+        file_type = file.content_type or ""
         
-        # Extract text from file
-        extracted_text = ""
-        if file_type == "application/pdf":
-            extracted_text = extract_text_from_pdf(content)
-        elif file_type.startswith("image/"):
-            extracted_text = await analyze_image_with_gemini(content)
+        if async_mode:
+            # Job mode: queue the work and return straight away
+            params = {
+                'fileType': file_type, 'fileName': file.filename,
+                'name': name, 'age': age, 'gender': gender, 'patientId': patient_id
+            }
+            file_path = await spool_job_upload(upload)
+            try:
+                job_id = job_queue.submit(params, file_path, priority)
+            except QueueFull:
+                os.remove(file_path)
+                return JSONResponse(
+                    status_code=503,
+                    headers={"Retry-After": "30"},
+                    content={"error": "Analysis queue is full, please retry shortly"}
+                )
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "jobId": job_id,
+                    "status": "queued",
+                    "statusUrl": f"/api/jobs/{job_id}",
+                    "eventsUrl": f"/api/jobs/{job_id}/events"
+                }
+            )
         
-        # Analyze with Gemini
-        analysis_result = await analyze_health_data(extracted_text, name, age, gender)
+        analysis_result = await cancel_on_disconnect(
+            http_request,
+            analyze_document(upload, file_type, name, age, gender, patient_id=patient_id)
+        )
         
         return JSONResponse(content=analysis_result)
     
+    except UploadTooLarge:
+        return JSONResponse(
+            status_code=413,
+            content={"error": "Uploaded file is too large"}
+        )
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
+    finally:
+        if upload is not None:
+            upload.close()
 
-def extract_text_from_pdf(content):
-    """Extract text from PDF"""
-    try:
-        pdf_file = io.BytesIO(content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-        return text
-    except Exception as e:
-        return f"Error extracting PDF: {str(e)}"
-
-async def analyze_image_with_gemini(content):
-    """Analyze image using Gemini Vision API"""
+@app.post("/api/analyze/multi")
+async def analyze_reports(
+    http_request: Request,
+    files: List[UploadFile] = File(...),
+    name: str = Form(...),
+    age: str = Form(...),
+    gender: str = Form(...),
+    patient_id: str = Form("", alias="patientId")
+):
+    """Analyze several reports at once: concurrent extraction, one consolidated analysis"""
+    if len(files) > MULTI_ANALYZE_MAX_FILES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"At most {MULTI_ANALYZE_MAX_FILES} files per request"}
+        )
+    
+    uploads = []
     try:
-        if not GEMINI_API_KEY:
-            return "Mock image analysis: Lab report detected"
-        
-        image = Image.open(io.BytesIO(content))
+        for file in files:
+            with timed("spool"):
+                uploads.append((await spool_upload(file), file.content_type or "", file.filename))
         
-        prompt = """Analyze this medical lab report image and extract all visible health metrics, values, and any test results.
-        Focus on cardiovascular health indicators if present (blood pressure, cholesterol, heart rate, etc.).
-        Return the information in a structured format."""
+        analysis_result = await cancel_on_disconnect(
+            http_request,
+            analyze_documents(uploads, name, age, gender, patient_id)
+        )
         
-        response = model.generate_content([prompt, image])
-        return response.text
+        return JSONResponse(content=analysis_result)
+    
+    except UploadTooLarge:
+        return JSONResponse(
+            status_code=413,
+            content={"error": "Uploaded file is too large"}
+        )
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content={"error": "Client disconnected"}
+        )
+    except RateLimited as e:
+        return rate_limited_response(e)
     except Exception as e:
-        return f"Error analyzing image: {str(e)}"
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e)}
+        )
+    finally:
+        for upload, _, _ in uploads:
+            upload.close()
 
-async def generate_prescription_suggestions(patient: dict, vitals: dict, lab_reports: list):
-    """Generate AI-powered prescription suggestions"""
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status, per-stage durations and (when done) the result of an analysis job"""
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    job.pop('filePath', None)
+    return job
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(http_request: Request, job_id: str):
+    """Server-Sent Events stream of job progress, ending with the final result"""
+    if job_queue.store.get(job_id) is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
     
-    # Mock implementation - replace with Gemini API call if needed
-    if not GEMINI_API_KEY:
-        return generate_mock_prescription(patient, vitals, lab_reports)
+    async def events():
+        last_state = None
+        while True:
+            job = job_queue.store.get(job_id)
+            job.pop('filePath', None)
+            state = (job['status'], job['stage'])
+            if state != last_state:
+                last_state = state
+                event = job['status'] if job['status'] in TERMINAL_STATUSES else 'progress'
+                yield sse_event(event, job)
+            if job['status'] in TERMINAL_STATUSES or await http_request.is_disconnected():
+                return
+            await job_queue.wait_for_update(job_id, timeout=15)
+            # Comment line keeps proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+    
+    return event_stream(events())
+
+async def run_analysis_job(job: dict, on_stage):
+    """Worker entry point for queued /api/analyze jobs"""
+    params = job['params']
+    on_stage("read")
+    upload = await asyncio.to_thread(load_spooled_file, job['filePath'])
+    return await analyze_document(
+        upload, params['fileType'], params['name'], params['age'], params['gender'],
+        on_stage=on_stage, patient_id=params.get('patientId', '')
+    )
+
+async def extract_document(upload, file_type: str):
+    """Text of an uploaded report (PDF via the process pool, image via Vision); returns (text, cache hit)"""
+    # Extraction stage, keyed by the file content hash
+    extraction_key = extraction_cache_key(upload.sha256, file_type)
+    cached_extraction = response_cache.get(extraction_key)
+    if cached_extraction is not None:
+        return cached_extraction['text'], True
+    
+    extracted_text = ""
+    cacheable = False
+    if file_type == "application/pdf":
+        extracted_text, cacheable = await single_flight.do(
+            extraction_key,
+            lambda: extract_text_from_pdf(upload)
+        )
+    elif file_type.startswith("image/"):
+        extracted_text = await single_flight.do(
+            extraction_key,
+            lambda: analyze_image_with_gemini(upload)
+        )
+        cacheable = bool(GEMINI_API_KEY) and not extracted_text.startswith("Error analyzing image")
+    if cacheable:
+        response_cache.set(extraction_key, {'text': extracted_text})
+    return extracted_text, False
+
+async def analyze_document(upload, file_type: str, name: str, age: str, gender: str, on_stage=None, patient_id: str = ""):
+    """Extract text from an uploaded report and analyze it, reusing cached stages"""
+    on_stage = on_stage or (lambda stage: None)
+    file_hash = upload.sha256
+    
+    on_stage("extraction")
+    extracted_text, extraction_hit = await extract_document(upload, file_type)
+    
+    # Analysis stage, keyed by the extracted text plus demographics.
+    # analyze_health_data stores successful results under the same key.
+    on_stage("analysis")
+    analysis_result = None
+    if GEMINI_API_KEY:
+        analysis_result = response_cache.get(analysis_cache_key(extracted_text, name, age, gender))
+    analysis_hit = analysis_result is not None
+    if not analysis_hit:
+        # A re-uploaded report (analysis cache hit) is not a new reading
+        analysis_result, measured = await analyze_health_data(extracted_text, name, age, gender)
+        record_lab_metrics(patient_id, measured)
+    analysis_result['cache'] = {
+        'fileHash': file_hash,
+        'extraction': extraction_hit,
+        'analysis': analysis_hit,
+        'hit': extraction_hit and analysis_hit
+    }
+    return analysis_result
+
+async def analyze_documents(uploads: list, name: str, age: str, gender: str, patient_id: str = ""):
+    """Extract (upload, file type, file name) reports concurrently and analyze them together.
+    
+    Total latency is roughly the slowest extraction plus one analysis call,
+    instead of one full extraction + analysis per document.
+    """
+    extracted = await asyncio.gather(*(extract_document(upload, file_type) for upload, file_type, _ in uploads))
+    documents = [
+        {'fileName': file_name or f"document-{i + 1}", 'fileHash': upload.sha256, 'text': text, 'extractionHit': hit}
+        for i, ((upload, _, file_name), (text, hit)) in enumerate(zip(uploads, extracted))
+    ]
     
+    result, measured = await analyze_combined_reports(documents, name, age, gender)
+    if not all(d['extractionHit'] for d in documents):
+        record_lab_metrics(patient_id, measured)
+    result['documents'] = [
+        {
+            'fileName': d['fileName'],
+            'fileHash': d['fileHash'],
+            'characters': len(d['text']),
+            'parsed': d['parsed'],
+            'cache': {'extraction': d['extractionHit']}
+        }
+        for d in documents
+    ]
+    return result
+
+async def extract_text_from_pdf(upload):
+    """Extract text from an uploaded PDF in the process pool; returns (text, complete)"""
     try:
-        # Build context from available data
-        context = f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
+        with timed("pdf_extract"):
+            text, info = await extract_pdf_text(await upload.source())
+        complete = not (info['truncated'] or info['timedOut'])
+        if not complete:
+            text += f"\n[Extraction stopped after {info['pagesExtracted']} of {info['pages']} pages]"
+        return text, complete
+    except Exception as e:
+        return f"Error extracting PDF: {str(e)}", False
+
+@timed("prompt_build")
+def prescription_prompt(patient: dict, vitals: dict, lab_reports: list):
+    """Prompt for prescription suggestions"""
+    return f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
         
 Vitals: {vitals.get('overallScore') if vitals else 'Not available'}/100
 Lab Reports: {len(lab_reports)} reports analyzed
+{history_context(patient)}
 
 Based on this patient's data, suggest appropriate medications. Be CONCISE.
 
@@ -203,33 +1035,15 @@ Return EXACT JSON:
     "notes": "Brief important notes (2-3 sentences)"
 }}
 """
-        
-        response = model.generate_content(context)
-        response_text = response.text
-        
-        import json
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return result
-        else:
-            return generate_mock_prescription(patient, vitals, lab_reports)
-            
-    except Exception as e:
-        print(f"Gemini API Error: {str(e)}")
-        return generate_mock_prescription(patient, vitals, lab_reports)
 
-async def generate_lab_test_suggestions(patient: dict, vitals: dict, lab_reports: list):
-    """Generate AI-powered lab test recommendations"""
-    
-    if not GEMINI_API_KEY:
-        return generate_mock_lab_tests(patient, vitals, lab_reports)
-    
-    try:
-        context = f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
+@timed("prompt_build")
+def lab_tests_prompt(patient: dict, vitals: dict, lab_reports: list):
+    """Prompt for lab test recommendations"""
+    return f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
 
 Vitals Score: {vitals.get('overallScore') if vitals else 'Not available'}/100
 Previous Lab Reports: {len(lab_reports)}
+{history_context(patient)}
 
 Recommend additional lab tests needed. Be CONCISE.
 
@@ -245,33 +1059,15 @@ Return EXACT JSON:
     "instructions": "Brief pre-test instructions (2-3 sentences)"
 }}
 """
-        
-        response = model.generate_content(context)
-        response_text = response.text
-        
-        import json
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return result
-        else:
-            return generate_mock_lab_tests(patient, vitals, lab_reports)
-            
-    except Exception as e:
-        print(f"Gemini API Error: {str(e)}")
-        return generate_mock_lab_tests(patient, vitals, lab_reports)
 
-async def generate_followup_plan(patient: dict, vitals: dict, lab_reports: list):
-    """Generate AI-powered follow-up plan"""
-    
-    if not GEMINI_API_KEY:
-        return generate_mock_followup(patient, vitals, lab_reports)
-    
-    try:
-        context = f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
+@timed("prompt_build")
+def followup_prompt(patient: dict, vitals: dict, lab_reports: list):
+    """Prompt for the follow-up care plan"""
+    return f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
 
 Health Score: {vitals.get('overallScore') if vitals else 'Not available'}/100
 Lab Reports: {len(lab_reports)} analyzed
+{history_context(patient)}
 
 Create a follow-up care plan. Be CONCISE.
 
@@ -288,66 +1084,377 @@ Return EXACT JSON:
     "goals": "Health goals (2-3 sentences)"
 }}
 """
+
+@timed("prompt_build")
+def vitals_analysis_prompt(patient: dict, vitals: dict):
+    """Prompt for the vitals analysis"""
+    return f"""You are a medical AI assistant. Analyze these vital signs and provide CONCISE, structured response.
+
+{build_vitals_context(patient, vitals)}
+
+{history_context(patient, vitals)}
+Take sustained or worsening trends into account in the score and risk factors.
+
+IMPORTANT: Keep summary and recommendations BRIEF (2-3 sentences each). NO markdown formatting.
+
+{{
+    "overallScore": 85,
+    "metrics": [
+        {{"name": "Blood Pressure", "value": "120/80 mmHg", "status": "Normal"}},
+        {{"name": "Heart Rate", "value": "72 bpm", "status": "Normal"}},
+        {{"name": "Temperature", "value": "98.6°F", "status": "Normal"}},
+        {{"name": "Oxygen Level", "value": "98%", "status": "Normal"}},
+        {{"name": "Respiratory Rate", "value": "16/min", "status": "Normal"}},
+        {{"name": "BMI", "value": "24.5", "status": "Normal"}}
+    ],
+    "riskFactors": ["Brief risk factors if any, or 'No immediate concerns'"],
+    "summary": "Brief 2-3 sentence analysis. Plain text only.",
+    "recommendations": "Brief 2-3 sentence advice. Plain text only."
+}}
+
+Rules: Status is "Normal", "Warning", or "Critical". Score 0-100. Include BMI. NO bold/italic text.
+"""
+
+async def generate_json(kind: str, prompt: str, schema: dict, fallback, client=None):
+    """Ask Gemini (the full model unless another tier's client is given) for a
+    schema-constrained JSON response; returns (result, complete)"""
+    client = client or gemini
+    response_text = await client.generate(prompt, kind=kind, generation_config=json_config(schema))
+    return await resolve_json(kind, response_text, prompt, schema, fallback, client)
+
+async def resolve_json(kind: str, response_text: str, prompt: str, schema: dict, fallback, client=None):
+    """Validate a JSON response, re-asking once for just the fields that failed.
+    
+    Fields still invalid after the retry are taken from the mock response,
+    in which case complete is False and the result should not be cached.
+    """
+    with timed("json_parse"):
+        result, failed, repaired = validate_response(response_text, schema)
+    structured_stats.add(
+        kind, calls=1, parseFailures=int(bool(failed)), failedFields=len(failed),
+        repairedFields=repaired, wastedCalls=int(not result)
+    )
+    if not failed:
+        return result, True
+    
+    record_parse_failure(kind)
+    patch = {}
+    structured_stats.add(kind, retries=1)
+    try:
+        retry_schema = schema_subset(schema, failed)
+        retry_prompt = f"{prompt}\n\nReturn ONLY these fields as JSON: {', '.join(failed)}"
+        retry_text = await (client or gemini).generate(retry_prompt, kind=kind, generation_config=json_config(retry_schema))
+        with timed("json_parse"):
+            patch, failed, repaired = validate_response(retry_text, retry_schema)
+        structured_stats.add(kind, repairedFields=repaired)
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+    result.update(patch)
+    
+    if failed:
+        structured_stats.add(kind, retryFailures=1, partialFallbacks=1, wastedCalls=int(not patch))
+        record_fallback("partial")
+        mock = fallback()
+        for field in failed:
+            if field in mock:
+                result[field] = mock[field]
+    return result, not failed
+
+async def generate_prescription_suggestions(patient: dict, vitals: dict, lab_reports: list, cache_ttl: float = None):
+    """Generate AI-powered prescription suggestions"""
+    
+    # Mock implementation - replace with Gemini API call if needed
+    if not GEMINI_API_KEY:
+        return generate_mock_prescription(patient, vitals, lab_reports)
+    
+    tier = route_suggestion("prescription", vitals, lab_reports)
+    cache_key = suggestion_cache_key("prescription", patient, vitals, lab_reports, tier_model(tier))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        context = prescription_prompt(patient, vitals, lab_reports)
         
-        response = model.generate_content(context)
-        response_text = response.text
+        with router.timed("prescription", tier):
+            result, complete = await single_flight.do(
+                cache_key,
+                lambda: generate_json("prescription", context, PRESCRIPTION_SCHEMA, lambda: generate_mock_prescription(patient, vitals, lab_reports), tier_client(tier))
+            )
+        if complete:
+            response_cache.set(cache_key, result, cache_ttl)
+        return result
+            
+    except RateLimited:
+        raise
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
+        return generate_mock_prescription(patient, vitals, lab_reports)
+
+async def generate_lab_test_suggestions(patient: dict, vitals: dict, lab_reports: list, cache_ttl: float = None):
+    """Generate AI-powered lab test recommendations"""
+    
+    if not GEMINI_API_KEY:
+        return generate_mock_lab_tests(patient, vitals, lab_reports)
+    
+    tier = route_suggestion("lab-tests", vitals, lab_reports)
+    cache_key = suggestion_cache_key("lab-tests", patient, vitals, lab_reports, tier_model(tier))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        context = lab_tests_prompt(patient, vitals, lab_reports)
         
-        import json
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            return result
-        else:
-            return generate_mock_followup(patient, vitals, lab_reports)
+        with router.timed("lab-tests", tier):
+            result, complete = await single_flight.do(
+                cache_key,
+                lambda: generate_json("lab-tests", context, LAB_TESTS_SCHEMA, lambda: generate_mock_lab_tests(patient, vitals, lab_reports), tier_client(tier))
+            )
+        if complete:
+            response_cache.set(cache_key, result, cache_ttl)
+        return result
+            
+    except RateLimited:
+        raise
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
+        return generate_mock_lab_tests(patient, vitals, lab_reports)
+
+async def generate_followup_plan(patient: dict, vitals: dict, lab_reports: list, cache_ttl: float = None):
+    """Generate AI-powered follow-up plan"""
+    
+    if not GEMINI_API_KEY:
+        return generate_mock_followup(patient, vitals, lab_reports)
+    
+    tier = route_suggestion("followup", vitals, lab_reports)
+    cache_key = suggestion_cache_key("followup", patient, vitals, lab_reports, tier_model(tier))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        context = followup_prompt(patient, vitals, lab_reports)
+        
+        with router.timed("followup", tier):
+            result, complete = await single_flight.do(
+                cache_key,
+                lambda: generate_json("followup", context, FOLLOWUP_SCHEMA, lambda: generate_mock_followup(patient, vitals, lab_reports), tier_client(tier))
+            )
+        if complete:
+            response_cache.set(cache_key, result, cache_ttl)
+        return result
             
+    except RateLimited:
+        raise
     except Exception as e:
         print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
         return generate_mock_followup(patient, vitals, lab_reports)
 
-async def analyze_image_with_gemini(content):
+async def stream_json_events(kind: str, prompt: str, schema: dict, cache_key: str, fallback, finalize=None, on_result=None, tier="full"):
+    """SSE events for a JSON response: an `item` per completed array element, then the full `result`.
+    
+    Cached and mock responses (and the "local" tier) are replayed through the
+    same incremental parser. on_result, if given, is called with the final
+    result unless it came from the cache.
+    """
+    on_result = on_result or (lambda result: None)
+    local = tier == "local" or not GEMINI_API_KEY
+    cached = response_cache.get(cache_key) if not local else None
+    if cached is not None or local:
+        result = cached if cached is not None else fallback()
+        streamer = JsonArrayStreamer()
+        async for chunk in replay_json(result):
+            for field, index, value in streamer.feed(chunk):
+                yield sse_event("item", {"field": field, "index": index, "value": value})
+        if cached is None:
+            on_result(result)
+        yield sse_event("result", result)
+        return
+    
+    client = tier_client(tier)
+    chunks = client.stream(prompt, kind=kind, generation_config=json_config(schema))
+    streamer = JsonArrayStreamer()
+    try:
+        async for chunk in chunks:
+            for field, index, value in streamer.feed(chunk):
+                yield sse_event("item", {"field": field, "index": index, "value": value})
+    except RateLimited:
+        raise
+    except CircuitOpen:
+        # Gemini is unhealthy: answer from the mock engine without a repair call
+        record_fallback("circuit_open")
+        result = fallback()
+        on_result(result)
+        yield sse_event("result", result)
+        return
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+    finally:
+        await chunks.aclose()
+    
+    try:
+        result, complete = await resolve_json(kind, streamer.buffer, prompt, schema, fallback, client)
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
+        result, complete = fallback(), False
+    if finalize is not None:
+        result = finalize(result)
+    if complete:
+        response_cache.set(cache_key, result)
+    on_result(result)
+    yield sse_event("result", result)
+
+async def generate_consult(patient: dict, vitals: dict, lab_reports: list):
+    """Generate vitals analysis, prescription, lab tests and follow-up in one model call"""
+    
+    if not GEMINI_API_KEY:
+        result = generate_mock_consult(patient, vitals, lab_reports)
+        record_vitals(patient, vitals, result['vitalsAnalysis'])
+        return result
+    
+    # Normal cases still need the suggestions, so they go to the lite tier rather than the rule engine
+    tier = router.route("consult", vitals_complexity(generate_mock_vitals_analysis(patient, vitals, patient_trends(patient, vitals)), vitals))
+    cache_key = make_cache_key("consult", tier_model(tier), normalize_patient(patient), normalize_vitals(vitals), len(lab_reports), patient_trend_lines(patient, vitals))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        prompt = f"""You are a medical AI assistant. Review this patient and produce a complete consult in ONE response. Be CONCISE.
+
+{build_vitals_context(patient, vitals)}
+Lab Reports: {len(lab_reports)} reports analyzed
+{history_context(patient, vitals)}
+
+Base the prescription, lab tests and follow-up plan on your vitals analysis.
+Keep every summary, note and recommendation BRIEF (2-3 sentences). NO markdown formatting.
+
+Return EXACT JSON:
+{{
+    "vitalsAnalysis": {{
+        "overallScore": 85,
+        "metrics": [
+            {{"name": "Blood Pressure", "value": "120/80 mmHg", "status": "Normal"}},
+            {{"name": "Heart Rate", "value": "72 bpm", "status": "Normal"}},
+            {{"name": "Temperature", "value": "98.6°F", "status": "Normal"}},
+            {{"name": "Oxygen Level", "value": "98%", "status": "Normal"}},
+            {{"name": "Respiratory Rate", "value": "16/min", "status": "Normal"}},
+            {{"name": "BMI", "value": "24.5", "status": "Normal"}}
+        ],
+        "riskFactors": ["Brief risk factors if any, or 'No immediate concerns'"],
+        "summary": "Brief 2-3 sentence analysis. Plain text only.",
+        "recommendations": "Brief 2-3 sentence advice. Plain text only."
+    }},
+    "prescription": {{
+        "medications": [
+            {{"name": "Medication Name", "dosage": "Dosage", "frequency": "Frequency", "duration": "Duration", "priority": "High/Medium/Low", "notes": "Brief note"}}
+        ],
+        "notes": "Brief important notes (2-3 sentences)"
+    }},
+    "labTests": {{
+        "tests": [
+            {{"name": "Test Name", "reason": "Brief reason", "urgency": "Urgent/Soon/Routine"}}
+        ],
+        "instructions": "Brief pre-test instructions (2-3 sentences)"
+    }},
+    "followUp": {{
+        "schedule": [
+            {{"timeframe": "When (e.g., 'In 1 week')", "action": "What to do", "details": "Brief details"}}
+        ],
+        "monitoring": "What to monitor (2-3 sentences)",
+        "goals": "Health goals (2-3 sentences)"
+    }}
+}}
+
+Rules: Status is "Normal", "Warning", or "Critical". Score 0-100. Include BMI. NO bold/italic text.
+"""
+        
+        with router.timed("consult", tier):
+            result, complete = await single_flight.do(
+                cache_key,
+                lambda: generate_json("consult", prompt, CONSULT_SCHEMA, lambda: generate_mock_consult(patient, vitals, lab_reports), tier_client(tier))
+            )
+        clean_narrative(result['vitalsAnalysis'])
+        if complete:
+            response_cache.set(cache_key, result)
+        record_vitals(patient, vitals, result['vitalsAnalysis'])
+        return result
+            
+    except RateLimited:
+        raise
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
+        result = generate_mock_consult(patient, vitals, lab_reports)
+        record_vitals(patient, vitals, result['vitalsAnalysis'])
+        return result
+
+async def generate_consult_fanout(patient: dict, vitals: dict, lab_reports: list):
+    """Generate the four consult sections as separate prompts run concurrently"""
+    # The suggestion prompts only need the health score; take it from the
+    # rule engine so they do not have to wait for the vitals analysis
+    score = generate_mock_vitals_analysis(patient, vitals)['overallScore']
+    scored_vitals = {'overallScore': score}
+    
+    vitals_analysis, prescription, lab_tests, follow_up = await asyncio.gather(
+        analyze_vitals_data(patient, vitals),
+        generate_prescription_suggestions(patient, scored_vitals, lab_reports),
+        generate_lab_test_suggestions(patient, scored_vitals, lab_reports),
+        generate_followup_plan(patient, scored_vitals, lab_reports)
+    )
+    return {
+        "vitalsAnalysis": vitals_analysis,
+        "prescription": prescription,
+        "labTests": lab_tests,
+        "followUp": follow_up
+    }
+
+async def analyze_image_with_gemini(upload):
     """Analyze image using Gemini Vision API"""
     try:
         if not GEMINI_API_KEY:
             return "Mock image analysis: Lab report detected"
         
-        image = Image.open(io.BytesIO(content))
+        # Downscale / grayscale / re-encode before upload to cut decode time and payload
+        with timed("image_decode"):
+            prepared = await image_prep.preprocess_upload(upload)
+        print(f"Image preprocessed: {prepared['bytesIn']} -> {prepared['bytesOut']} bytes, "
+              f"{prepared['sizeIn']} -> {prepared['sizeOut']} px in {prepared['seconds']}s")
         
         prompt = """Analyze this medical lab report image and extract all visible health metrics, values, and any test results.
         Focus on cardiovascular health indicators if present (blood pressure, cholesterol, heart rate, etc.).
         Return the information in a structured format."""
         
-        response = model.generate_content([prompt, image])
-        return response.text
+        return await gemini.generate([prompt, {"mime_type": prepared["mimeType"], "data": prepared["data"]}], kind="image")
+    except RateLimited:
+        raise
     except Exception as e:
         return f"Error analyzing image: {str(e)}"
 
-async def analyze_vitals_data(patient: dict, vitals: dict):
-    """Analyze patient vitals and medical history"""
+def build_vitals_context(patient: dict, vitals: dict):
+    """Build the patient, vitals and medical history block shared by vitals prompts"""
+    # Build medical history string
+    medical_history = []
+    if vitals.get('heartDisease'):
+        medical_history.append("Heart Disease")
+    if vitals.get('diabetes'):
+        medical_history.append("Diabetes")
+    if vitals.get('hypertension'):
+        medical_history.append("Hypertension")
+    if vitals.get('asthma'):
+        medical_history.append("Asthma")
+    if vitals.get('otherConditions'):
+        medical_history.append(vitals.get('otherConditions'))
     
-    # If Gemini API is not configured, return mock data
-    if not GEMINI_API_KEY:
-        return generate_mock_vitals_analysis(patient, vitals)
+    history_str = ", ".join(medical_history) if medical_history else "None reported"
+    allergies_str = vitals.get('allergies', 'None reported')
     
-    try:
-        # Build medical history string
-        medical_history = []
-        if vitals.get('heartDisease'):
-            medical_history.append("Heart Disease")
-        if vitals.get('diabetes'):
-            medical_history.append("Diabetes")
-        if vitals.get('hypertension'):
-            medical_history.append("Hypertension")
-        if vitals.get('asthma'):
-            medical_history.append("Asthma")
-        if vitals.get('otherConditions'):
-            medical_history.append(vitals.get('otherConditions'))
-        
-        history_str = ", ".join(medical_history) if medical_history else "None reported"
-        allergies_str = vitals.get('allergies', 'None reported')
-        
-        prompt = f"""You are a medical AI assistant. Analyze these vital signs and provide CONCISE, structured response.
-
-Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
+    return f"""Patient: {patient.get('name')}, Age: {patient.get('age')}, Gender: {patient.get('gender')}
 
 Vitals:
 - BP: {vitals.get('systolic')}/{vitals.get('diastolic')} mmHg
@@ -356,61 +1463,89 @@ Vitals:
 - Weight: {vitals.get('weight')} kg | Height: {vitals.get('height')} cm
 
 Medical History: {history_str}
-Allergies: {allergies_str}
-
-IMPORTANT: Keep summary and recommendations BRIEF (2-3 sentences each). NO markdown formatting.
-
-{{
-    "overallScore": 85,
-    "metrics": [
-        {{"name": "Blood Pressure", "value": "120/80 mmHg", "status": "Normal"}},
-        {{"name": "Heart Rate", "value": "72 bpm", "status": "Normal"}},
-        {{"name": "Temperature", "value": "98.6°F", "status": "Normal"}},
-        {{"name": "Oxygen Level", "value": "98%", "status": "Normal"}},
-        {{"name": "Respiratory Rate", "value": "16/min", "status": "Normal"}},
-        {{"name": "BMI", "value": "24.5", "status": "Normal"}}
-    ],
-    "riskFactors": ["Brief risk factors if any, or 'No immediate concerns'"],
-    "summary": "Brief 2-3 sentence analysis. Plain text only.",
-    "recommendations": "Brief 2-3 sentence advice. Plain text only."
-}}
+Allergies: {allergies_str}"""
 
-Rules: Status is "Normal", "Warning", or "Critical". Score 0-100. Include BMI. NO bold/italic text.
-"""
+async def analyze_vitals_data(patient: dict, vitals: dict, record: bool = True):
+    """Analyze patient vitals and medical history.
+    
+    With record, the analysis is stored in the patient's history unless it
+    came from the cache (those vitals were recorded when first analyzed).
+    """
+    
+    trends = patient_trends(patient, vitals)
+    
+    # The rule engine scores every case first; without Gemini, or for a
+    # clearly normal case, its analysis is the answer
+    rule_analysis, tier = route_vitals(patient, vitals, trends)
+    if tier == "local":
+        return record_vitals(patient, vitals, rule_analysis) if record else rule_analysis
+    
+    cache_key = vitals_cache_key(patient, vitals, tier_model(tier))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        prompt = vitals_analysis_prompt(patient, vitals)
 
-        response = model.generate_content(prompt)
-        response_text = response.text
-        
-        # Extract JSON from response
-        import json
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            # Clean any markdown
-            result['summary'] = clean_markdown(result.get('summary', ''))
-            result['recommendations'] = clean_markdown(result.get('recommendations', ''))
-            return result
-        else:
-            return generate_mock_vitals_analysis(patient, vitals)
+        with router.timed("vitals", tier):
+            result, complete = await single_flight.do(
+                cache_key,
+                lambda: generate_json("vitals", prompt, VITALS_ANALYSIS_SCHEMA, lambda: generate_mock_vitals_analysis(patient, vitals, trends), tier_client(tier))
+            )
+        # Clean any markdown
+        clean_narrative(result)
+        if complete:
+            response_cache.set(cache_key, result)
             
+    except RateLimited:
+        raise
     except Exception as e:
         print(f"Gemini API Error: {str(e)}")
-        return generate_mock_vitals_analysis(patient, vitals)
+        record_fallback(fallback_reason(e))
+        result = generate_mock_vitals_analysis(patient, vitals, trends)
+    return record_vitals(patient, vitals, result) if record else result
+
+async def monitor_narrative(patient: dict, vitals: dict):
+    """Analysis for a monitor stream's new risk tier; the rule engine answers when quota is exhausted.
+    
+    Monitor frames are not visits, so nothing is recorded in the patient's history.
+    """
+    try:
+        return await analyze_vitals_data(patient, vitals, record=False)
+    except RateLimited:
+        record_fallback("rate_limited")
+        return generate_mock_vitals_analysis(patient, vitals, patient_trends(patient, vitals))
 
 async def analyze_health_data(extracted_text: str, name: str, age: str, gender: str):
-    """Analyze health data using Gemini AI"""
+    """Analyze health data using Gemini AI.
+    
+    Returns (analysis, measured metrics); the second is None when the metrics
+    are mock (fallback) placeholders rather than readings from the report.
+    """
+    
+    # Machine-readable reports: metrics come from the local parser
+    if LAB_PARSER_MODE != "off":
+        with timed("lab_parse"):
+            parsed = parse_lab_report(extracted_text)
+        if parsed['confident']:
+            result = await analyze_parsed_report(parsed, extracted_text, name, age, gender)
+            return result, result['metrics']
     
     # If Gemini API is not configured, return mock data
     if not GEMINI_API_KEY:
-        return generate_mock_analysis(name, age, gender)
+        return generate_mock_analysis(name, age, gender), None
     
     try:
+        # Only clinically relevant lines, within the prompt token budget
+        with timed("prompt_build"):
+            report_text = prompt_compact.compact_for_prompt(extracted_text)
         prompt = f"""You are a medical AI assistant. Analyze this lab report and provide a concise, structured response.
 
 Patient: {name}, Age: {age}, Gender: {gender}
 
 Lab Report Data:
-{extracted_text}
+{report_text}
 
 IMPORTANT: Provide a CONCISE response in EXACT JSON format. Keep summary and recommendations brief (2-3 sentences each).
 
@@ -434,27 +1569,181 @@ Rules:
 - Focus on key cardiovascular metrics
 """
 
-        response = model.generate_content(prompt)
-        response_text = response.text
+        cache_key = analysis_cache_key(extracted_text, name, age, gender)
+        result, complete = await single_flight.do(
+            cache_key,
+            lambda: generate_json("analysis", prompt, REPORT_ANALYSIS_SCHEMA, lambda: generate_mock_analysis(name, age, gender))
+        )
+        # Clean any remaining markdown
+        clean_narrative(result)
+        if complete:
+            response_cache.set(cache_key, result)
+        # Incomplete: some fields (possibly the metrics) were filled from the mock
+        return result, result['metrics'] if complete else None
+            
+    except RateLimited:
+        raise
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
+        return generate_mock_analysis(name, age, gender), None
+
+async def analyze_parsed_report(parsed: dict, extracted_text: str, name: str, age: str, gender: str):
+    """Build the analysis from locally parsed metrics; Gemini only writes the narrative"""
+    metrics = parsed['metrics']
+    result = {'metrics': metrics, **local_narrative(metrics, name)}
+    result['parser'] = {
+        'confidence': parsed['confidence'],
+        'matchedLines': parsed['matchedLines'],
+        'candidateLines': parsed['candidateLines'],
+        'narrative': 'local'
+    }
+    
+    if LAB_PARSER_MODE != "narrative" or not GEMINI_API_KEY:
+        return result
+    
+    try:
+        metric_lines = "\n".join(f"- {m['name']}: {m['value']} ({m['status']})" for m in metrics)
+        prompt = f"""You are a medical AI assistant. These lab results were already extracted and classified:
+
+Patient: {name}, Age: {age}, Gender: {gender}
+
+{metric_lines}
+
+Write a brief interpretation in EXACT JSON format:
+{{
+    "summary": "2-3 sentences, plain text, no formatting",
+    "recommendations": "2-3 sentences, plain text, no formatting"
+}}
+"""
         
-        # Extract JSON from response
-        import json
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            # Clean any remaining markdown
-            result['summary'] = clean_markdown(result.get('summary', ''))
-            result['recommendations'] = clean_markdown(result.get('recommendations', ''))
-            return result
+        cache_key = analysis_cache_key(extracted_text, name, age, gender)
+        local = {'summary': result['summary'], 'recommendations': result['recommendations']}
+        narrative, complete = await single_flight.do(
+            cache_key,
+            lambda: generate_json("narrative", prompt, NARRATIVE_SCHEMA, lambda: local)
+        )
+        if complete:
+            result.update(clean_narrative(dict(narrative)))
+            result['parser']['narrative'] = 'gemini'
+            response_cache.set(cache_key, result)
+    except Exception as e:
+        print(f"Gemini API Error: {str(e)}")
+        record_fallback(fallback_reason(e))
+    
+    return result
+
+def combined_report_prompt(documents: list, known_metrics: list, name: str, age: str, gender: str):
+    """One analysis prompt covering several reports; metrics parsed locally are listed, not re-extracted"""
+    # The compaction budget is shared between the documents sent as text
+    budget = max(prompt_compact.PROMPT_TOKEN_BUDGET // max(len(documents), 1), 200)
+    sections = []
+    for i, d in enumerate(documents, start=1):
+        with timed("prompt_build"):
+            report_text = prompt_compact.compact_for_prompt(d['text'], budget)
+        sections.append(f"Document {i} ({d['fileName']}):\n{report_text}")
+    known = "\n".join(f"- {m['name']}: {m['value']} ({m['status']})" for m in known_metrics)
+    known_section = f"""
+Already extracted from the other reports (do not repeat these in "metrics", but use them in the summary):
+{known}
+""" if known_metrics else ""
+    
+    return f"""You are a medical AI assistant. These lab reports belong to the same patient. Analyze them together and provide ONE concise, structured response.
+
+Patient: {name}, Age: {age}, Gender: {gender}
+
+{chr(10).join(sections)}
+{known_section}
+IMPORTANT: Provide a CONCISE response in EXACT JSON format. Report each metric ONCE even if several documents contain it (use the most recent or most abnormal reading).
+
+{{
+    "metrics": [
+        {{"name": "Cholesterol", "value": "190 mg/dL", "status": "Normal"}}
+    ],
+    "summary": "Brief 2-3 sentence analysis across all reports.",
+    "recommendations": "Brief 2-3 sentence advice."
+}}
+
+Rules:
+- Status: "Normal", "Warning", or "Critical"
+- Summary: Max 3 sentences, plain text, no formatting
+- Recommendations: Max 3 sentences, plain text, no formatting
+- DO NOT use markdown formatting (**bold**, *italic*, etc)
+"""
+
+async def analyze_combined_reports(documents: list, name: str, age: str, gender: str):
+    """Consolidated analysis of several extracted reports with de-duplicated metrics.
+    
+    Documents the lab parser reads confidently contribute their metrics
+    directly; the rest go to Gemini in a single prompt. Sets d['parsed'].
+    Returns (analysis, measured metrics), leaving mock (fallback) metrics
+    out of the second.
+    """
+    local_metrics = []
+    unparsed = []
+    matched = candidates = 0
+    for d in documents:
+        parsed = None
+        if LAB_PARSER_MODE != "off":
+            with timed("lab_parse"):
+                parsed = parse_lab_report(d['text'])
+        d['parsed'] = bool(parsed and parsed['confident'])
+        if d['parsed']:
+            local_metrics.append([{**m, 'sources': [d['fileName']]} for m in parsed['metrics']])
+            matched += parsed['matchedLines']
+            candidates += parsed['candidateLines']
         else:
-            return generate_mock_analysis(name, age, gender)
-            
+            unparsed.append(d)
+    metrics = merge_metrics(local_metrics)
+    combined_text = "\f".join(d['text'] for d in documents)
+    
+    # Every report machine-readable (or no model to ask): metrics are all local
+    if metrics and (not unparsed or not GEMINI_API_KEY):
+        parsed = {
+            'metrics': metrics,
+            'confidence': round(matched / candidates, 3) if candidates else 0.0,
+            'matchedLines': matched,
+            'candidateLines': candidates
+        }
+        return await analyze_parsed_report(parsed, combined_text, name, age, gender), metrics
+    
+    if not GEMINI_API_KEY:
+        return generate_mock_analysis(name, age, gender), None
+    
+    cache_key = analysis_cache_key(combined_text, name, age, gender)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        # Already recorded when it was first analyzed
+        return cached, None
+    
+    try:
+        prompt = combined_report_prompt(unparsed, metrics, name, age, gender)
+        result, complete = await single_flight.do(
+            cache_key,
+            lambda: generate_json("analysis", prompt, REPORT_ANALYSIS_SCHEMA, lambda: generate_mock_analysis(name, age, gender))
+        )
+        model_metrics = [{**m, 'sources': [d['fileName'] for d in unparsed]} for m in result.get('metrics', [])]
+        result['metrics'] = merge_metrics([metrics, model_metrics])
+        clean_narrative(result)
+        if complete:
+            response_cache.set(cache_key, result)
+        # Incomplete: the model's metrics may be mock placeholders, only the parsed ones are readings
+        return result, result['metrics'] if complete else metrics
+    
+    except RateLimited:
+        raise
     except Exception as e:
         print(f"Gemini API Error: {str(e)}")
-        return generate_mock_analysis(name, age, gender)
+        record_fallback(fallback_reason(e))
+        return generate_mock_analysis(name, age, gender), metrics
 
-def generate_mock_vitals_analysis(patient: dict, vitals: dict):
-    """Generate mock vitals analysis data for demonstration"""
+def generate_mock_vitals_analysis(patient: dict, vitals: dict, trends: dict = None):
+    """Generate mock vitals analysis data for demonstration.
+    
+    trends (from vitals_history, previous visits only) adds penalties for
+    sustained abnormal readings and a rising blood pressure.
+    """
+    trends = trends or {}
     
     # Calculate BMI if height and weight are provided
     bmi = "N/A"
@@ -465,10 +1754,7 @@ def generate_mock_vitals_analysis(patient: dict, vitals: dict):
             weight_kg = float(vitals['weight'])
             bmi_value = weight_kg / (height_m ** 2)
             bmi = f"{bmi_value:.1f}"
-            if bmi_value < 18.5:
-                bmi_status = "Warning"
-            elif bmi_value > 25:
-                bmi_status = "Warning"
+            bmi_status = classify_bmi(bmi_value)
     except:
         pass
     
@@ -485,57 +1771,68 @@ def generate_mock_vitals_analysis(patient: dict, vitals: dict):
     try:
         systolic = int(vitals.get('systolic', 120))
         diastolic = int(vitals.get('diastolic', 80))
-        if systolic > 140 or diastolic > 90:
-            bp_status = "Critical"
-            risk_factors.append("Elevated blood pressure - requires immediate attention")
-        elif systolic > 130 or diastolic > 85:
-            bp_status = "Warning"
-            risk_factors.append("Slightly elevated blood pressure - monitor closely")
+        bp_status = classify_blood_pressure(systolic, diastolic)
+        if bp_status != "Normal":
+            risk_factors.append(RISK_FACTORS["bpCritical" if bp_status == "Critical" else "bpWarning"])
     except:
         pass
     
     # Check heart rate
     try:
         hr = int(vitals.get('heartRate', 72))
-        if hr > 100 or hr < 60:
-            hr_status = "Warning"
-            if hr > 100:
-                risk_factors.append("Elevated heart rate - may indicate stress or cardiovascular strain")
+        hr_status = classify_heart_rate(hr)
+        if hr > HEART_RATE_RANGE[1]:
+            risk_factors.append(RISK_FACTORS["hrHigh"])
     except:
         pass
     
     # Check SpO2
     try:
         spo2 = int(vitals.get('oxygenSaturation', 98))
-        if spo2 < 95:
-            spo2_status = "Warning"
-            risk_factors.append("Low oxygen saturation - respiratory assessment recommended")
-        if spo2 < 90:
-            spo2_status = "Critical"
+        spo2_status = classify_oxygen(spo2)
+        if spo2_status != "Normal":
+            risk_factors.append(RISK_FACTORS["spo2Low"])
     except:
         pass
     
+    # Temperature and respiratory rate are flagged (no score deduction), only when given
+    try:
+        temp_status = classify_temperature(float(vitals['temperature']))
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        rr_status = classify_respiratory_rate(float(vitals['respiratoryRate']))
+    except (KeyError, TypeError, ValueError):
+        pass
+    for field, status in (('temperature', temp_status), ('respiratoryRate', rr_status)):
+        if status != "Normal":
+            risk_factors.append(RISK_FACTORS[field])
+    
     # Add medical history risk factors
-    if vitals.get('heartDisease'):
-        risk_factors.append("Pre-existing heart disease - requires ongoing monitoring")
-    if vitals.get('diabetes'):
-        risk_factors.append("Diabetes - blood sugar control is essential")
-    if vitals.get('hypertension'):
-        risk_factors.append("History of hypertension - blood pressure monitoring critical")
+    risk_factors += [RISK_FACTORS[flag] for flag in HISTORY_DEDUCTIONS if vitals.get(flag)]
+    
+    # Sustained or worsening readings across visits
+    trend_penalty = 0
+    for field, status, label in (('systolic', bp_status, "Blood pressure"), ('heartRate', hr_status, "Heart rate"),
+                                 ('oxygenSaturation', spo2_status, "Oxygen saturation")):
+        trend = trends.get(field)
+        if trend and status != "Normal" and trend['warningStreak'] >= 2:
+            trend_penalty += 5
+            risk_factors.append(f"{label} abnormal on {trend['warningStreak'] + 1} consecutive visits")
+    systolic_trend = trends.get('systolic')
+    if systolic_trend and systolic_trend['window'] >= 3 and (systolic_trend['slopePerDay'] or 0) > 1:
+        trend_penalty += 5
+        risk_factors.append(f"Systolic blood pressure rising {systolic_trend['slopePerDay']:+.1f} mmHg/day over recent visits")
     
     # Calculate overall score
     score = 100
-    if bp_status == "Warning": score -= 10
-    if bp_status == "Critical": score -= 20
-    if hr_status == "Warning": score -= 5
-    if spo2_status == "Warning": score -= 10
-    if spo2_status == "Critical": score -= 20
-    if bmi_status == "Warning": score -= 5
-    if vitals.get('heartDisease'): score -= 10
-    if vitals.get('diabetes'): score -= 5
-    if vitals.get('hypertension'): score -= 5
-    
-    score = max(score, 50)  # Minimum score of 50
+    for metric, status in (("Blood Pressure", bp_status), ("Heart Rate", hr_status),
+                           ("Oxygen Level", spo2_status), ("BMI", bmi_status)):
+        score -= STATUS_DEDUCTIONS[metric].get(status, 0)
+    score -= sum(points for flag, points in HISTORY_DEDUCTIONS.items() if vitals.get(flag))
+    score -= trend_penalty
+    
+    score = max(score, MIN_SCORE)
     
     return {
         "overallScore": score,
@@ -547,11 +1844,21 @@ def generate_mock_vitals_analysis(patient: dict, vitals: dict):
             {"name": "Respiratory Rate", "value": f"{vitals.get('respiratoryRate', 'N/A')}/min", "status": rr_status},
             {"name": "BMI", "value": bmi, "status": bmi_status}
         ],
-        "riskFactors": risk_factors if risk_factors else ["No immediate risk factors identified"],
-        "summary": f"Patient {patient.get('name')} presents with health score of {score}/100. Vital signs are {'within normal ranges' if score > 80 else 'showing some concerns' if score > 70 else 'requiring attention'}. {'All parameters stable' if score > 85 else 'Monitoring recommended' if score > 70 else 'Medical consultation needed'}.",
+        "riskFactors": risk_factors if risk_factors else [NO_RISK_FACTORS],
+        "summary": f"Patient {patient.get('name')} presents with health score of {score}/100. Vital signs are {SCORE_SUMMARIES[score_tier(score)]}. {'All parameters stable' if score > 85 else 'Monitoring recommended' if score > 70 else 'Medical consultation needed'}.",
         "recommendations": f"{'Continue healthy lifestyle with regular exercise and balanced diet' if score > 85 else 'Increase monitoring frequency and consider lifestyle modifications' if score > 70 else 'Seek immediate medical attention for evaluation'}. {'Schedule annual checkup' if score > 70 else 'Follow up within one week'}."
     }
 
+def generate_mock_consult(patient: dict, vitals: dict, lab_reports: list):
+    """Generate mock consult with the same shape as the combined prompt"""
+    vitals_analysis = generate_mock_vitals_analysis(patient, vitals)
+    return {
+        "vitalsAnalysis": vitals_analysis,
+        "prescription": generate_mock_prescription(patient, vitals_analysis, lab_reports),
+        "labTests": generate_mock_lab_tests(patient, vitals_analysis, lab_reports),
+        "followUp": generate_mock_followup(patient, vitals_analysis, lab_reports)
+    }
+
 def generate_mock_analysis(name: str, age: str, gender: str):
     """Generate mock analysis data for demonstration"""
     return {
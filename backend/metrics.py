@@ -0,0 +1,152 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+# Buckets from 1 ms (cache hits, rule engine) up to a minute (long model calls)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "healthai_request_seconds", "End-to-end request latency",
+    ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "healthai_stage_seconds", "Time spent in each pipeline stage",
+    ["endpoint", "stage"], buckets=LATENCY_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    "healthai_cache_lookups_total", "AI response cache lookups",
+    ["endpoint", "namespace", "result"]
+)
+FALLBACKS = Counter(
+    "healthai_fallbacks_total", "Responses answered by the mock engine instead of Gemini",
+    ["endpoint", "reason"]
+)
+PARSE_FAILURES = Counter(
+    "healthai_parse_failures_total", "Model responses that failed schema validation",
+    ["endpoint", "kind"]
+)
+ROUTING_DECISIONS = Counter(
+    "healthai_routing_decisions_total", "Model tier chosen for each generation by case complexity",
+    ["endpoint", "kind", "complexity", "tier"]
+)
+TIER_SECONDS = Histogram(
+    "healthai_tier_seconds", "Generation latency per model tier (cache hits excluded)",
+    ["endpoint", "kind", "tier"], buckets=LATENCY_BUCKETS
+)
+
+# Outside an HTTP request (queued jobs, CLI ingest) metrics are labelled "background"
+BACKGROUND = "background"
+
+
+class RequestTimings:
+    """Stage durations collected while one request is handled"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.stages = []
+
+    @property
+    def endpoint(self):
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "__name__", "unmatched")
+
+    def server_timing(self, total):
+        # Repeated stages (e.g. several model calls) are summed into one entry
+        totals = {}
+        for stage, seconds in self.stages:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def current_endpoint():
+    timings = _current.get()
+    return timings.endpoint if timings is not None else BACKGROUND
+
+
+@contextmanager
+def timed(stage):
+    """Time a block (or, as a decorator, a sync function) as a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = _current.get()
+        if timings is not None:
+            timings.stages.append((stage, elapsed))
+        STAGE_SECONDS.labels(current_endpoint(), stage).observe(elapsed)
+
+
+def record_cache_lookup(namespace, hit):
+    CACHE_LOOKUPS.labels(current_endpoint(), namespace, "hit" if hit else "miss").inc()
+
+
+def record_fallback(reason):
+    FALLBACKS.labels(current_endpoint(), reason).inc()
+
+
+def record_parse_failure(kind):
+    PARSE_FAILURES.labels(current_endpoint(), kind).inc()
+
+
+def record_route(kind, complexity, tier):
+    ROUTING_DECISIONS.labels(current_endpoint(), kind, complexity, tier).inc()
+
+
+def record_tier_latency(kind, tier, seconds):
+    TIER_SECONDS.labels(current_endpoint(), kind, tier).observe(seconds)
+
+
+def render():
+    """Prometheus text exposition of every metric in this process"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """Times every HTTP request, adds a Server-Timing header and records stage timings"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = _current.set(timings)
+        started = time.perf_counter()
+        status = {"code": 500}
+        received = {"done": False}
+
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False) and not received["done"]:
+                # Time until the whole request body has arrived
+                received["done"] = True
+                elapsed = time.perf_counter() - started
+                timings.stages.append(("receive", elapsed))
+                STAGE_SECONDS.labels(timings.endpoint, "receive").observe(elapsed)
+            return message
+
+        async def timing_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                header = timings.server_timing(time.perf_counter() - started)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive, timing_send)
+        finally:
+            _current.reset(token)
+            REQUEST_SECONDS.labels(timings.endpoint, scope["method"], str(status["code"])).observe(
+                time.perf_counter() - started
+            )
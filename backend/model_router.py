@@ -0,0 +1,102 @@
+"""Route each generation to the cheapest model tier that can handle the case.
+
+The local rule engine scores the case first. Clearly normal cases (every
+metric Normal, no risk factors, a high score) are answered by the rule
+engine or a lite model; borderline and critical cases go to the full model.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from metrics import record_route, record_tier_latency
+from resilience import LatencyTracker
+from vitals_rules import TIER_WARNING_ABOVE
+
+# Tiered routing: off sends everything to GEMINI_MODEL
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").lower() in ("1", "true", "yes")
+# Cheaper / faster model for normal cases (empty = no lite tier, normal cases use the full model)
+GEMINI_LITE_MODEL = os.getenv("GEMINI_LITE_MODEL", "gemini-2.5-flash-lite")
+# Who answers a normal vitals analysis: "local" (rule engine) or "lite"
+ROUTING_NORMAL_VITALS_TIER = os.getenv("ROUTING_NORMAL_VITALS_TIER", "local")
+# Lowest health score a case can have and still count as normal
+ROUTING_NORMAL_MIN_SCORE = float(os.getenv("ROUTING_NORMAL_MIN_SCORE", "85"))
+# At or below this score a case is critical (the rule engine's Critical risk tier)
+ROUTING_CRITICAL_MAX_SCORE = TIER_WARNING_ABOVE
+
+TIERS = ("local", "lite", "full")
+
+
+def classify_case(score, statuses, risk_factors=()):
+    """normal / borderline / critical from a health score, metric statuses and risk factors"""
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        # No usable score: never treat the case as clearly normal
+        return "borderline"
+    if "Critical" in statuses or score <= ROUTING_CRITICAL_MAX_SCORE:
+        return "critical"
+    if risk_factors or "Warning" in statuses or score < ROUTING_NORMAL_MIN_SCORE:
+        return "borderline"
+    return "normal"
+
+
+class ModelRouter:
+    """Picks a tier per generation and records the decisions and per-tier latency"""
+
+    def __init__(self, enabled=MODEL_ROUTING, lite_model=GEMINI_LITE_MODEL, normal_vitals_tier=ROUTING_NORMAL_VITALS_TIER):
+        if normal_vitals_tier not in ("local", "lite"):
+            raise ValueError(f"ROUTING_NORMAL_VITALS_TIER must be 'local' or 'lite', not '{normal_vitals_tier}'")
+        self.enabled = enabled
+        self.lite_model = lite_model
+        self.normal_vitals_tier = normal_vitals_tier
+        self.decisions = {}  # "kind/complexity/tier" -> count
+        self.latency = {tier: LatencyTracker(size=500) for tier in TIERS}
+
+    def route(self, kind, complexity, local_ok=False):
+        """Tier for one generation; local_ok when the rule engine's answer is a complete one for this kind"""
+        if not self.enabled or complexity != "normal":
+            tier = "full"
+        elif local_ok and self.normal_vitals_tier == "local":
+            tier = "local"
+        elif self.lite_model:
+            tier = "lite"
+        else:
+            tier = "full"
+        key = f"{kind}/{complexity}/{tier}"
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        record_route(kind, complexity, tier)
+        return tier
+
+    def observe(self, kind, tier, seconds):
+        self.latency[tier].add(seconds)
+        record_tier_latency(kind, tier, seconds)
+
+    @contextmanager
+    def timed(self, kind, tier):
+        """Time one generation on a tier"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, tier, time.perf_counter() - started)
+
+    def stats(self):
+        latency = {}
+        for tier, tracker in self.latency.items():
+            if tracker.samples:
+                latency[tier] = {
+                    "p50": round(tracker.percentile(50), 4),
+                    "p95": round(tracker.percentile(95), 4),
+                    "samples": len(tracker.samples)
+                }
+        by_tier = dict.fromkeys(TIERS, 0)
+        for key, count in self.decisions.items():
+            by_tier[key.rsplit("/", 1)[1]] += count
+        return {
+            "enabled": self.enabled,
+            "liteModel": self.lite_model or None,
+            "normalVitalsTier": self.normal_vitals_tier,
+            "byTier": by_tier,
+            "decisions": dict(self.decisions),
+            "latency": latency
+        }
@@ -0,0 +1,171 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+# PDF extraction engine settings
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "300"))
+PDF_TIME_BUDGET_SECONDS = float(os.getenv("PDF_TIME_BUDGET_SECONDS", "30"))
+# Larger uploads go to worker processes as a file path instead of pickled bytes
+PDF_INLINE_MAX_BYTES = 1024 * 1024
+# How long past the deadline to wait for a range to hand back the pages it finished
+RESULT_GRACE_SECONDS = 1.0
+# Pages are joined with a form feed so later stages can still split them
+PAGE_SEPARATOR = "\f"
+
+_pool = None
+
+
+class _OutOfTime(BaseException):
+    """BaseException so the PDF library's own except Exception blocks do not swallow it"""
+
+
+@contextmanager
+def _time_limit(deadline):
+    """Runs in a worker process: interrupt the block at the wall-clock deadline.
+
+    A stuck page then frees its worker at the request's deadline instead of
+    holding it for every later request. No-op where SIGALRM is missing
+    (Windows); the deadline is still checked between pages.
+    """
+    if not hasattr(signal, "setitimer"):
+        yield
+        return
+
+    def expire(signum, frame):
+        raise _OutOfTime()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, max(deadline - time.time(), 0.001))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _open_reader(source):
+    # Imported here so only the worker processes pay for it
+    import PyPDF2
+    if isinstance(source, bytes):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+    return PyPDF2.PdfReader(source)
+
+
+def _count_pages(source, deadline):
+    """Runs in a worker process: page count, or None if the deadline passed first"""
+    try:
+        with _time_limit(deadline):
+            return len(_open_reader(source).pages)
+    except _OutOfTime:
+        return None
+
+
+def _extract_range(source, start, stop, deadline):
+    """Runs in a worker process: text of pages [start, stop), cut short at the deadline"""
+    pages = []
+    if time.time() >= deadline:
+        return pages
+    try:
+        with _time_limit(deadline):
+            reader = _open_reader(source)
+            for i in range(start, stop):
+                pages.append(reader.pages[i].extract_text() or "")
+    except _OutOfTime:
+        pass
+    return pages
+
+
+def get_pool():
+    global _pool
+    # A worker that crashed leaves the pool unusable; start a new one
+    if _pool is None or getattr(_pool, "_broken", False):
+        # spawn, not fork: the API process has gRPC / executor threads running
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _result(future, deadline):
+    """Wait for a range; the worker stops itself at the deadline, this only bounds the wait"""
+    return await asyncio.wait_for(asyncio.shield(future), max(deadline - time.time(), 0) + RESULT_GRACE_SECONDS)
+
+
+async def iter_pdf_pages(source, max_pages=PDF_MAX_PAGES, time_budget=PDF_TIME_BUDGET_SECONDS, info=None):
+    """Yield (page_index, text) in page order as the parallel page ranges finish.
+
+    source is the PDF as bytes or a file path. Stops after max_pages pages or
+    time_budget seconds; info (if given) is filled with page counts and whether
+    either budget cut the extraction short. Each range stops itself at the
+    deadline, so an overrun never holds pool workers past its own budget.
+    """
+    info = info if info is not None else {}
+    loop = asyncio.get_running_loop()
+    deadline = time.time() + time_budget
+    pool = get_pool()
+
+    count = loop.run_in_executor(pool, _count_pages, source, deadline)
+    try:
+        total = await _result(count, deadline)
+    finally:
+        count.cancel()
+    if total is None:
+        raise asyncio.TimeoutError("Timed out reading the PDF page count")
+    limit = min(total, max_pages)
+    info.update({"pages": total, "pagesExtracted": 0, "truncated": total > limit, "timedOut": False})
+
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, limit)) for start in range(0, limit, PDF_PAGES_PER_TASK)]
+    futures = [loop.run_in_executor(pool, _extract_range, source, start, stop, deadline) for start, stop in ranges]
+    try:
+        for (start, stop), future in zip(ranges, futures):
+            pages = await _result(future, deadline)
+            for offset, text in enumerate(pages):
+                info["pagesExtracted"] += 1
+                yield start + offset, text
+            if len(pages) < stop - start:
+                info["timedOut"] = True
+                return
+    except asyncio.TimeoutError:
+        info["timedOut"] = True
+    finally:
+        # Drop ranges that have not started yet
+        for future in futures:
+            future.cancel()
+
+
+def _spill_to_disk(content):
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(content)
+        return f.name
+
+
+async def extract_pdf_text(source, max_pages=PDF_MAX_PAGES, time_budget=PDF_TIME_BUDGET_SECONDS):
+    """Extract a PDF's text off the event loop; returns (text, info)"""
+    spilled = None
+    if not isinstance(source, (str, os.PathLike)):
+        source = bytes(source)
+        if len(source) > PDF_INLINE_MAX_BYTES:
+            source = spilled = await asyncio.to_thread(_spill_to_disk, source)
+    try:
+        info = {}
+        pages = [text async for _, text in iter_pdf_pages(source, max_pages, time_budget, info)]
+        return PAGE_SEPARATOR.join(pages), info
+    finally:
+        if spilled:
+            os.remove(spilled)
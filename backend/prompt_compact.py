@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+from collections import Counter
+
+# Prompt compaction for extracted report text
+PROMPT_COMPACTION = os.getenv("PROMPT_COMPACTION", "true").lower() in ("1", "true", "yes")
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+# Rough characters per token for English / lab text
+CHARS_PER_TOKEN = 4
+
+# Pages are separated by a form feed (see pdf_extract.PAGE_SEPARATOR)
+PAGE_SEPARATOR = "\f"
+
+# A label with a number next to it: "Glucose 98 mg/dL", "BP: 120/80"
+NUMERIC_VALUE_RE = re.compile(r"[A-Za-z]{2,}.*?\d|\d.*?[A-Za-z]{2,}")
+CLINICAL_KEYWORD_RE = re.compile(
+    r"\b(?:high|low|abnormal|normal|elevated|decreased|increased|deficien\w*|positive|negative|"
+    r"reactive|critical|borderline|impression|diagnos\w*|finding\w*|interpretation|comment\w*|"
+    r"result\w*|reference|range|flag|risk|history|symptom\w*|medication\w*|allerg\w*)\b",
+    re.IGNORECASE
+)
+BOILERPLATE_RE = re.compile(
+    r"^(?:page\s*\d+(?:\s*(?:of|/)\s*\d+)?|printed\s+on\b.*|report\s+(?:date|generated)\b.*|"
+    r".*\b(?:disclaimer|authori[sz]ed\s+signatory|end\s+of\s+report|www\.|https?://|tel|phone|fax|email)\b.*)$",
+    re.IGNORECASE
+)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_stats_lock = threading.Lock()
+_stats = {"prompts": 0, "tokensBefore": 0, "tokensAfter": 0}
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token); no tokenizer round-trip"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _relevance(line):
+    """0 = numeric analyte line, 1 = clinical keyword line, None = drop"""
+    if BOILERPLATE_RE.match(line):
+        return None
+    if NUMERIC_VALUE_RE.search(line):
+        return 0
+    if CLINICAL_KEYWORD_RE.search(line):
+        return 1
+    return None
+
+
+def compact_report_text(text, token_budget=PROMPT_TOKEN_BUDGET):
+    """Trim extracted report text to the clinically relevant lines within a token budget.
+
+    Drops duplicate lines and text-only lines repeated across pages (headers,
+    footers, disclaimers), keeps lines with numeric values or clinical
+    keywords, then fills the budget
+    with numeric lines first. Returns (text, info).
+    """
+    pages = [
+        [_WHITESPACE_RE.sub(" ", line).strip() for line in page.splitlines()]
+        for page in text.split(PAGE_SEPARATOR)
+    ]
+    pages = [[line for line in page if line] for page in pages]
+    lines_before = sum(len(page) for page in pages)
+
+    # Lines on more than one page (and on at least half of them) are page headers / footers
+    page_counts = Counter(line for page in pages for line in set(page))
+    repeat_threshold = max(2, (len(pages) + 1) // 2)
+    repeated = {line for line, count in page_counts.items() if count >= repeat_threshold}
+
+    kept = []
+    seen = set()
+    for page in pages:
+        for line in page:
+            if line in seen:
+                continue
+            seen.add(line)
+            relevance = _relevance(line)
+            # Repeated lines survive (once) only if they carry a value
+            if relevance is None or (relevance > 0 and line in repeated):
+                continue
+            kept.append((relevance, len(kept), line))
+
+    # Fill the budget by relevance, then restore report order
+    selected = []
+    used = 0
+    for relevance, position, line in sorted(kept):
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            continue
+        selected.append((position, line))
+        used += cost
+    compacted = "\n".join(line for _, line in sorted(selected))
+
+    if not compacted:
+        # Nothing looked like lab data (e.g. a free-text letter): fall back to a plain cut
+        compacted = text[:token_budget * CHARS_PER_TOKEN]
+
+    info = {
+        "tokensBefore": estimate_tokens(text),
+        "tokensAfter": estimate_tokens(compacted),
+        "linesBefore": lines_before,
+        "linesAfter": compacted.count("\n") + 1,
+        "repeatedLines": len(repeated)
+    }
+    info["tokensSaved"] = info["tokensBefore"] - info["tokensAfter"]
+    return compacted, info
+
+
+def compact_for_prompt(text, token_budget=PROMPT_TOKEN_BUDGET):
+    """Compact report text for a prompt, logging and counting the tokens saved"""
+    if not PROMPT_COMPACTION:
+        return text
+    compacted, info = compact_report_text(text, token_budget)
+    with _stats_lock:
+        _stats["prompts"] += 1
+        _stats["tokensBefore"] += info["tokensBefore"]
+        _stats["tokensAfter"] += info["tokensAfter"]
+    print(
+        f"Prompt compaction: {info['tokensBefore']} -> {info['tokensAfter']} tokens "
+        f"({info['tokensSaved']} saved, {info['linesBefore']} -> {info['linesAfter']} lines)"
+    )
+    return compacted
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["tokensSaved"] = result["tokensBefore"] - result["tokensAfter"]
+    result["tokenBudget"] = PROMPT_TOKEN_BUDGET
+    result["enabled"] = PROMPT_COMPACTION
+    return result
@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+from prompt_compact import estimate_tokens
+
+# Gemini quota: requests and tokens per minute, plus the admission queue
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+RATE_LIMIT_QUEUE_MAX = int(os.getenv("RATE_LIMIT_QUEUE_MAX", "100"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "15"))
+# Tokens reserved for the model's answer until the real usage is known
+GEMINI_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("GEMINI_OUTPUT_TOKEN_ESTIMATE", "800"))
+# Gemini bills each image part as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+# Lower runs first when calls have to wait for quota
+PRIORITIES = {
+    "vitals": 0,
+    "analysis": 1,
+    "image": 1,
+    "narrative": 1,
+    "consult": 1,
+    "prescription": 2,
+    "lab-tests": 2,
+    "followup": 3
+}
+DEFAULT_PRIORITY = 2
+
+
+class RateLimited(Exception):
+    """Raised when a Gemini call is shed instead of queued (429 over quota, 503 queue full)"""
+
+    def __init__(self, status_code, retry_after, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Bucket refilled continuously at rate_per_minute up to capacity"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount):
+        """Seconds until amount tokens are available (0 if they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(amount - self.tokens, 0) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def give(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def estimate_request_tokens(contents):
+    """Prompt tokens (text parts estimated, images at the fixed rate) plus the output reserve"""
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = GEMINI_OUTPUT_TOKEN_ESTIMATE
+    for part in parts:
+        tokens += estimate_tokens(part) if isinstance(part, str) else IMAGE_TOKENS
+    return tokens
+
+
+class RateLimiter:
+    """RPM / TPM token buckets with a bounded priority wait queue.
+
+    Calls that fit the quota go straight through. Others wait in priority
+    order; once the queue is full, or the projected wait is over max_wait,
+    new calls are rejected with a Retry-After hint instead.
+    """
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_queued=RATE_LIMIT_QUEUE_MAX,
+                 max_wait=RATE_LIMIT_MAX_WAIT_SECONDS):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {429: 0, 503: 0}
+        self.wait_seconds = 0.0
+        self._waiters = []  # heap of [priority, seq, tokens, future]
+        self._counter = itertools.count()
+        self._dispatcher = None
+
+    def _wait_for(self, tokens):
+        return max(self.requests.time_until(1), self.tokens.time_until(tokens))
+
+    def _projected_wait(self, tokens, priority):
+        """Rough wait for a new call: the calls queued ahead of it, then its own tokens"""
+        self.requests._refill()
+        self.tokens._refill()
+        ahead = [waiter for waiter in self._waiters if waiter[0] <= priority and not waiter[3].done()]
+        return max(
+            (len(ahead) + 1 - self.requests.tokens) / self.requests.rate,
+            (sum(waiter[2] for waiter in ahead) + tokens - self.tokens.tokens) / self.tokens.rate,
+            0
+        )
+
+    def _admit(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted += 1
+
+    async def acquire(self, tokens, kind=None):
+        """Wait for quota for one call of about `tokens` tokens; raises RateLimited when shedding"""
+        if not self._waiters and self._wait_for(tokens) == 0:
+            self._admit(tokens)
+            return
+
+        priority = PRIORITIES.get(kind, DEFAULT_PRIORITY)
+        if len(self._waiters) >= self.max_queued:
+            self.rejected[503] += 1
+            raise RateLimited(503, self._projected_wait(tokens, priority), "Gemini request queue is full")
+        projected = self._projected_wait(tokens, priority)
+        if projected > self.max_wait:
+            self.rejected[429] += 1
+            raise RateLimited(429, projected, "Gemini quota exhausted")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._counter), tokens, future])
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            self.wait_seconds += time.monotonic() - started
+
+    def try_acquire(self, tokens):
+        """Take quota only if it is available right now (never queues); used for hedged calls"""
+        if self._waiters or self._wait_for(tokens) > 0:
+            return False
+        self._admit(tokens)
+        return True
+
+    def headroom(self):
+        """Share of the RPM / TPM quota free right now (the lower of the two); 0 while calls are waiting"""
+        if any(not waiter[3].done() for waiter in self._waiters):
+            return 0.0
+        self.requests._refill()
+        self.tokens._refill()
+        return max(min(self.requests.tokens / self.requests.capacity, self.tokens.tokens / self.tokens.capacity), 0.0)
+
+    async def _dispatch(self):
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                # Caller gave up (cancelled) while waiting
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._wait_for(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._waiters)
+            self._admit(tokens)
+            future.set_result(None)
+
+    def settle(self, reserved, used):
+        """Correct the token bucket once the real token usage of a call is known"""
+        if used is None:
+            return
+        if used < reserved:
+            self.tokens.give(reserved - used)
+        else:
+            self.tokens.take(used - reserved)
+
+    def stats(self):
+        self.requests._refill()
+        self.tokens._refill()
+        waiting = {}
+        for priority, _, _, future in self._waiters:
+            if not future.done():
+                waiting[priority] = waiting.get(priority, 0) + 1
+        return {
+            "rpm": round(self.requests.rate * 60),
+            "tpm": round(self.tokens.rate * 60),
+            "requestsAvailable": math.floor(self.requests.tokens),
+            "tokensAvailable": math.floor(self.tokens.tokens),
+            "queueDepth": sum(waiting.values()),
+            "waitingByPriority": waiting,
+            "maxQueued": self.max_queued,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected429": self.rejected[429],
+            "rejected503": self.rejected[503],
+            "avgWaitSeconds": round(self.wait_seconds / self.queued, 4) if self.queued else 0.0
+        }
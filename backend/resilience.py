@@ -0,0 +1,157 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+# Retry / hedging / circuit breaker policy for Gemini calls
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "45"))
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "0.5"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "8"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() in ("1", "true", "yes")
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+_retryable_errors = None
+
+
+def retryable_errors():
+    """Transient upstream errors worth another attempt.
+
+    google.api_core is imported on first use (after a failed call) rather
+    than when the app starts.
+    """
+    global _retryable_errors
+    if _retryable_errors is None:
+        from google.api_core import exceptions as google_exceptions
+        _retryable_errors = (
+            asyncio.TimeoutError,
+            ConnectionError,
+            google_exceptions.TooManyRequests,
+            google_exceptions.InternalServerError,
+            google_exceptions.BadGateway,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.GatewayTimeout,
+            google_exceptions.DeadlineExceeded
+        )
+    return _retryable_errors
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open"""
+
+
+def is_retryable(error):
+    return isinstance(error, retryable_errors())
+
+
+def backoff_delay(attempt, base=GEMINI_RETRY_BASE_SECONDS, cap=GEMINI_RETRY_MAX_SECONDS):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failed calls.
+
+    While open every call fails fast with CircuitOpen; after `reset_seconds`
+    one probe call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.short_circuited = 0
+        self._probing = False
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                self.short_circuited += 1
+                raise CircuitOpen("Gemini circuit breaker is open")
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.short_circuited += 1
+                raise CircuitOpen("Gemini circuit breaker is half-open")
+            self._probing = True
+
+    def release(self):
+        """Give up a half-open probe slot without an outcome (the call was cancelled)"""
+        self._probing = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.failures,
+            "opens": self.opens,
+            "shortCircuited": self.short_circuited
+        }
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for the hedging delay"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def hedged(start_attempt, hedge_delay):
+    """Run start_attempt(); if it is still running after hedge_delay seconds start a
+    second copy and return whichever succeeds first. Returns (result, hedged, hedge_won).
+
+    start_attempt may return None instead of a coroutine to skip the hedge
+    (e.g. when there is no quota for a duplicate call).
+    """
+    primary = asyncio.ensure_future(start_attempt())
+    if hedge_delay is None:
+        return await primary, False, False
+
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        if not done:
+            second = start_attempt()
+            if second is not None:
+                tasks.append(asyncio.ensure_future(second))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), len(tasks) > 1, task is not primary
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,61 @@
+import asyncio
+import copy
+from collections import Counter
+
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one in-flight task"""
+
+    def __init__(self):
+        self._calls = {}
+        self.leaders = Counter()
+        self.joins = Counter()
+
+    @staticmethod
+    def _namespace(key):
+        return key.split(":", 1)[0]
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key, fn):
+        """Run fn() once per key; concurrent callers await the same result.
+
+        Each caller gets its own deep copy, so a caller that annotates or
+        merges into its result cannot change what the others see.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._calls[key] = call
+            self.leaders[self._namespace(key)] += 1
+        else:
+            self.joins[self._namespace(key)] += 1
+
+        call.waiters += 1
+        try:
+            # Shield so one caller disconnecting does not cancel the shared call
+            return copy.deepcopy(await asyncio.shield(call.task))
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last interested caller is gone, stop the shared call too
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def stats(self):
+        return {
+            "inFlight": len(self._calls),
+            "leaders": dict(self.leaders),
+            "joins": dict(self.joins),
+            "totalJoins": sum(self.joins.values())
+        }
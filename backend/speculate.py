@@ -0,0 +1,103 @@
+import asyncio
+import os
+
+from rate_limit import RateLimited
+
+# Speculative precompute of the suggestions a clinician usually asks for after a vitals analysis
+SPECULATIVE_SUGGESTIONS = os.getenv("SPECULATIVE_SUGGESTIONS", "false").lower() in ("1", "true", "yes")
+# Speculative results are cached only this long; an unused guess should not linger
+SPECULATION_TTL_SECONDS = float(os.getenv("SPECULATION_TTL_SECONDS", "180"))
+# Most speculative generations running at once in a worker
+SPECULATION_MAX_IN_FLIGHT = int(os.getenv("SPECULATION_MAX_IN_FLIGHT", "12"))
+# Share of the Gemini RPM / TPM quota that must be free to start speculating
+SPECULATION_MIN_HEADROOM = float(os.getenv("SPECULATION_MIN_HEADROOM", "0.5"))
+
+
+class Speculator:
+    """Bounded, cancellable background tasks that warm the response cache.
+
+    Tasks are grouped (by patient): submitting a new batch for a group
+    cancels that group's unfinished tasks, whose inputs are now stale.
+    Nothing is started while the rate limiter is short of quota or the
+    in-flight limit is reached, so speculation never competes with requests
+    a clinician is actually waiting on.
+    """
+
+    def __init__(self, limiter, max_in_flight=SPECULATION_MAX_IN_FLIGHT, min_headroom=SPECULATION_MIN_HEADROOM):
+        self.limiter = limiter
+        self.max_in_flight = max_in_flight
+        self.min_headroom = min_headroom
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.skipped = {"pressure": 0, "full": 0}
+        self._groups = {}  # group -> set of tasks
+
+    @property
+    def in_flight(self):
+        return sum(len(tasks) for tasks in self._groups.values())
+
+    def submit(self, group, jobs):
+        """Start jobs (coroutine factories) for a group, replacing its earlier ones; returns how many started"""
+        self.cancel(group)
+        if self.limiter.headroom() < self.min_headroom:
+            self.skipped["pressure"] += len(jobs)
+            return 0
+        started = 0
+        for job in jobs:
+            if self.in_flight >= self.max_in_flight:
+                self.skipped["full"] += len(jobs) - started
+                break
+            task = asyncio.create_task(self._run(job))
+            tasks = self._groups.setdefault(group, set())
+            tasks.add(task)
+            task.add_done_callback(lambda done, group=group: self._forget(group, done))
+            started += 1
+        self.started += started
+        return started
+
+    def _forget(self, group, task):
+        tasks = self._groups.get(group)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._groups[group]
+
+    async def _run(self, job):
+        try:
+            await job()
+            self.completed += 1
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except RateLimited:
+            # Quota ran short after the check; the real request will retry
+            self.failed += 1
+        except Exception as e:
+            print(f"Speculation Error: {str(e)}")
+            self.failed += 1
+
+    def cancel(self, group):
+        """Cancel a group's unfinished tasks; returns how many were cancelled"""
+        tasks = self._groups.pop(group, set())
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def cancel_all(self):
+        for group in list(self._groups):
+            self.cancel(group)
+
+    def stats(self):
+        return {
+            "enabled": SPECULATIVE_SUGGESTIONS,
+            "inFlight": self.in_flight,
+            "maxInFlight": self.max_in_flight,
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "skippedPressure": self.skipped["pressure"],
+            "skippedFull": self.skipped["full"]
+        }
@@ -0,0 +1,252 @@
+import json
+import threading
+
+# Typed response schemas, passed to Gemini as response_schema
+# (the OpenAPI subset the API accepts: type, properties, items, enum, required)
+STATUS_SCHEMA = {"type": "string", "enum": ["Normal", "Warning", "Critical"]}
+
+METRIC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "value": {"type": "string"},
+        "status": STATUS_SCHEMA
+    },
+    "required": ["name", "value", "status"]
+}
+
+NARRATIVE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "recommendations": {"type": "string"}
+    },
+    "required": ["summary", "recommendations"]
+}
+
+REPORT_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "metrics": {"type": "array", "items": METRIC_SCHEMA},
+        **NARRATIVE_SCHEMA["properties"]
+    },
+    "required": ["metrics", "summary", "recommendations"]
+}
+
+VITALS_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "overallScore": {"type": "integer"},
+        "metrics": {"type": "array", "items": METRIC_SCHEMA},
+        "riskFactors": {"type": "array", "items": {"type": "string"}},
+        **NARRATIVE_SCHEMA["properties"]
+    },
+    "required": ["overallScore", "metrics", "riskFactors", "summary", "recommendations"]
+}
+
+PRESCRIPTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "medications": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "dosage": {"type": "string"},
+                    "frequency": {"type": "string"},
+                    "duration": {"type": "string"},
+                    "priority": {"type": "string", "enum": ["High", "Medium", "Low"]},
+                    "notes": {"type": "string"}
+                },
+                "required": ["name", "dosage", "frequency", "duration", "priority"]
+            }
+        },
+        "notes": {"type": "string"}
+    },
+    "required": ["medications", "notes"]
+}
+
+LAB_TESTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tests": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "reason": {"type": "string"},
+                    "urgency": {"type": "string", "enum": ["Urgent", "Soon", "Routine"]}
+                },
+                "required": ["name", "reason", "urgency"]
+            }
+        },
+        "instructions": {"type": "string"}
+    },
+    "required": ["tests", "instructions"]
+}
+
+FOLLOWUP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "schedule": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "timeframe": {"type": "string"},
+                    "action": {"type": "string"},
+                    "details": {"type": "string"}
+                },
+                "required": ["timeframe", "action", "details"]
+            }
+        },
+        "monitoring": {"type": "string"},
+        "goals": {"type": "string"}
+    },
+    "required": ["schedule", "monitoring", "goals"]
+}
+
+CONSULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vitalsAnalysis": VITALS_ANALYSIS_SCHEMA,
+        "prescription": PRESCRIPTION_SCHEMA,
+        "labTests": LAB_TESTS_SCHEMA,
+        "followUp": FOLLOWUP_SCHEMA
+    },
+    "required": ["vitalsAnalysis", "prescription", "labTests", "followUp"]
+}
+
+_decoder = json.JSONDecoder()
+_INVALID = object()
+
+
+def json_config(schema):
+    """generation_config asking for JSON that matches schema"""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def schema_subset(schema, fields):
+    """The object schema restricted to the given top-level fields"""
+    return {
+        "type": "object",
+        "properties": {name: schema["properties"][name] for name in fields},
+        "required": list(fields)
+    }
+
+
+def parse_json_object(text):
+    """Decode the first JSON object in text in one pass (tolerates a ```json fence)"""
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("No JSON object in response")
+    value, _ = _decoder.raw_decode(text, start)
+    if not isinstance(value, dict):
+        raise ValueError("Response is not a JSON object")
+    return value
+
+
+def coerce(value, schema):
+    """Return value converted to schema's type, or _INVALID if it cannot be repaired"""
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            return _INVALID
+        result = {}
+        for name, prop in schema.get("properties", {}).items():
+            if name not in value:
+                continue
+            converted = coerce(value[name], prop)
+            if converted is not _INVALID:
+                result[name] = converted
+        if any(name not in result for name in schema.get("required", [])):
+            return _INVALID
+        return result
+    if kind == "array":
+        if not isinstance(value, list):
+            value = [value]
+        items = [coerce(item, schema.get("items", {})) for item in value]
+        items = [item for item in items if item is not _INVALID]
+        # Drop bad elements, but an array that lost every element has failed
+        return items if items or not value else _INVALID
+    if kind == "string":
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            value = " ".join(value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            return _INVALID
+        if "enum" in schema:
+            for option in schema["enum"]:
+                if option.lower() == value.strip().lower():
+                    return option
+            return _INVALID
+        return value
+    if kind in ("integer", "number"):
+        if isinstance(value, str):
+            try:
+                value = float(value.strip().rstrip("%"))
+            except ValueError:
+                return _INVALID
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return _INVALID
+        return int(round(value)) if kind == "integer" else value
+    if kind == "boolean":
+        return value if isinstance(value, bool) else _INVALID
+    return value
+
+
+def validate_response(text, schema):
+    """Parse a model response against an object schema.
+
+    Returns (fields, failed, repaired): the valid (possibly coerced) top-level
+    fields, the names of fields that are missing or could not be repaired,
+    and how many fields needed coercion.
+    """
+    try:
+        data = parse_json_object(text)
+    except ValueError:
+        return {}, list(schema["required"]), 0
+
+    fields, failed, repaired = {}, [], 0
+    for name, prop in schema["properties"].items():
+        if name not in data:
+            if name in schema.get("required", []):
+                failed.append(name)
+            continue
+        converted = coerce(data[name], prop)
+        if converted is _INVALID:
+            failed.append(name)
+            continue
+        if converted != data[name]:
+            repaired += 1
+        fields[name] = converted
+    return fields, failed, repaired
+
+
+class StructuredOutputStats:
+    """Per-response-type counters for structured output parsing"""
+
+    COUNTERS = ("calls", "parseFailures", "failedFields", "repairedFields",
+                "retries", "retryFailures", "partialFallbacks", "wastedCalls")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+
+    def add(self, kind, **counts):
+        with self._lock:
+            totals = self._kinds.setdefault(kind, dict.fromkeys(self.COUNTERS, 0))
+            for name, count in counts.items():
+                totals[name] += count
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: dict(totals) for kind, totals in self._kinds.items()}
+        overall = {name: sum(totals[name] for totals in kinds.values()) for name in self.COUNTERS}
+        for totals in [overall, *kinds.values()]:
+            totals["parseFailureRate"] = round(totals["parseFailures"] / totals["calls"], 4) if totals["calls"] else 0.0
+        overall["byType"] = kinds
+        return overall
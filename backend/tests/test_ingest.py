@@ -0,0 +1,53 @@
+import pytest
+
+import ingest
+from ingest import RecordParser
+
+
+def parse(data, chunk_size=None):
+    parser = RecordParser('csv')
+    chunk_size = chunk_size or len(data)
+    records = []
+    for i in range(0, len(data), chunk_size):
+        records.extend(parser.feed(data[i:i + chunk_size]))
+    records.extend(parser.close())
+    return records
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, None])
+def test_quoted_field_with_newline_stays_one_record(chunk_size):
+    data = b'id,name,notes\r\n1,"Doe, J","line one\r\nline ""two"""\r\n2,Ann,plain\r\n'
+    assert parse(data, chunk_size) == [
+        {'id': '1', 'name': 'Doe, J', 'notes': 'line one\r\nline "two"'},
+        {'id': '2', 'name': 'Ann', 'notes': 'plain'}
+    ]
+
+
+def test_stray_quote_in_unquoted_field_does_not_hold_the_row_open():
+    data = b'name,height,systolic\nBob 5\'10",170,150\nAnn,160,120\nCid,180,118\n'
+    assert parse(data) == [
+        {'name': 'Bob 5\'10"', 'height': '170', 'systolic': '150'},
+        {'name': 'Ann', 'height': '160', 'systolic': '120'},
+        {'name': 'Cid', 'height': '180', 'systolic': '118'}
+    ]
+
+
+def test_unterminated_quote_is_reported_and_parsing_resyncs(monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_CSV_RECORD_BYTES', 64)
+    rows = b''.join(b'%d,Row %d,120\n' % (i, i) for i in range(20))
+    parser = RecordParser('csv')
+    records = parser.feed(b'id,name,systolic\n1,"never closed,150\n' + rows)
+    # The open record never grows past the cap, so memory stays flat
+    assert parser._record_bytes <= 64 + len(b'19,Row 19,120')
+    records.extend(parser.close())
+    assert records[0] == {'_error': "Unterminated quoted field"}
+    assert [record['id'] for record in records[1:]] == [str(i) for i in range(20)]
+
+
+def test_unterminated_quote_at_end_of_input():
+    records = parse(b'id,notes\n1,ok\n2,"open\n3,after\n')
+    assert records == [
+        {'id': '1', 'notes': 'ok'},
+        {'_error': "Unterminated quoted field"},
+        {'id': '3', 'notes': 'after'}
+    ]
@@ -0,0 +1,41 @@
+from lab_parser import parse_lab_report
+
+
+def statuses(report):
+    return {metric["name"]: (metric["value"], metric["status"]) for metric in report["metrics"]}
+
+
+def test_si_units_are_converted_before_classifying():
+    report = parse_lab_report(
+        "Fasting Glucose 5.2 mmol/L\n"
+        "TLC 7500 /cumm\n"
+        "Serum Creatinine 80 umol/L\n"
+        "HbA1c 36 mmol/mol\n"
+        "Hemoglobin 140 g/L\n"
+        "Total Cholesterol 4.9 mmol/L\n"
+    )
+    assert statuses(report) == {
+        "Blood Sugar": ("5.2 mmol/L", "Normal"),
+        "WBC Count": ("7500 /cumm", "Normal"),
+        "Creatinine": ("80 umol/L", "Normal"),
+        "HbA1c": ("36 mmol/mol", "Normal"),
+        "Hemoglobin": ("140 g/L", "Normal"),
+        "Total Cholesterol": ("4.9 mmol/L", "Normal")
+    }
+    assert report["confident"]
+
+
+def test_conventional_units_still_classify():
+    report = parse_lab_report("Glucose 180 mg/dL\nHbA1c 7.1 %\nLDL 120 mg/dL\n")
+    assert statuses(report) == {
+        "Blood Sugar": ("180 mg/dL", "Critical"),
+        "HbA1c": ("7.1%", "Critical"),
+        "LDL Cholesterol": ("120 mg/dL", "Normal")
+    }
+
+
+def test_missing_or_mismatched_unit_is_not_a_confident_match():
+    report = parse_lab_report("Glucose 5.4\nCreatinine 80 mmol/mol\nHemoglobin 14\nLDL 120 mg/dL\n")
+    assert statuses(report) == {"LDL Cholesterol": ("120 mg/dL", "Normal")}
+    assert report["matchedLines"] == 1
+    assert not report["confident"]
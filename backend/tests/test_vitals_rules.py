@@ -0,0 +1,24 @@
+from vitals_rules import classify_respiratory_rate, classify_temperature, unscored_vitals
+
+COMPLETE = {
+    "systolic": "118", "diastolic": "76", "heartRate": "72",
+    "temperature": "98.4", "respiratoryRate": "14", "oxygenSaturation": "98"
+}
+
+
+def test_temperature_and_respiratory_rate_bands():
+    assert classify_temperature(98.4) == "Normal"
+    assert classify_temperature(37.0) == "Normal"
+    assert classify_temperature(100.8) == "Warning"
+    assert classify_temperature(104.5) == "Critical"
+    assert classify_respiratory_rate(14) == "Normal"
+    assert classify_respiratory_rate(24) == "Warning"
+    assert classify_respiratory_rate(32) == "Critical"
+
+
+def test_unscored_vitals():
+    assert unscored_vitals(COMPLETE) == []
+    assert unscored_vitals({**COMPLETE, "height": "175", "weight": "70"}) == []
+    assert set(unscored_vitals({})) == set(COMPLETE)
+    assert unscored_vitals({**COMPLETE, "temperature": "", "heartRate": "72.5"}) == ["heartRate", "temperature"]
+    assert unscored_vitals({**COMPLETE, "weight": "70"}) == ["height", "weight"]
@@ -0,0 +1,51 @@
+from vitals_store import VitalsStore, patient_key, reading_visit
+
+DAY = 86400.0
+
+
+def test_one_point_per_visit():
+    store = VitalsStore(db_path="")
+    # A form re-submitted minutes or hours later is the same (daily) visit
+    for offset in (0, 400, 3 * 3600):
+        store.record("p1", [("systolic", 150, "Warning")], ts=1_000_000 + offset)
+    store.record("p1", [("systolic", 140, "Warning")], ts=1_000_000 + 4 * 3600)
+    trends = store.trends("p1")["systolic"]
+    assert trends["count"] == 1
+    assert trends["last"] == 140
+    assert trends["slopePerDay"] is None
+    assert trends["warningStreak"] == 0
+    assert store.stats()["deduplicated"] == 2
+
+
+def test_slope_and_streak_need_the_minimum_span():
+    store = VitalsStore(db_path="", min_days=1)
+    # Two explicit visits an hour apart: no per-day slope, no streak
+    store.record("p1", [("systolic", 130, "Warning")], visit="a", ts=0)
+    store.record("p1", [("systolic", 250, "Warning")], visit="b", ts=3600)
+    trends = store.trends("p1")["systolic"]
+    assert trends["count"] == 2
+    assert trends["slopePerDay"] is None
+    assert trends["warningStreak"] == 0
+
+    store.record("p1", [("systolic", 140, "Warning")], visit="c", ts=2 * DAY)
+    trends = store.trends("p1")["systolic"]
+    assert trends["slopePerDay"] is not None
+    assert trends["warningStreak"] == 3
+
+
+def test_exclude_visit_leaves_the_analyzed_visit_out():
+    store = VitalsStore(db_path="", window=3)
+    for day, value in enumerate((120, 130, 140, 150)):
+        store.record("p1", [("systolic", value, "Normal")], ts=day * DAY)
+    current = store.trends("p1")["systolic"]
+    assert (current["count"], current["window"], current["last"]) == (4, 3, 150)
+    previous = store.trends("p1", exclude_visit="day:1970-01-04")["systolic"]
+    assert (previous["count"], previous["window"], previous["last"]) == (3, 2, 140)
+    assert previous["movingAverage"] == 135
+
+
+def test_history_needs_a_patient_id():
+    assert patient_key({"name": "Jane", "gender": "F"}) is None
+    assert patient_key({"id": " 42 "}) == "42"
+    assert reading_visit({"visitId": "v7", "takenAt": "1970-01-02T00:00:00Z"}) == ("v7", DAY)
+    assert reading_visit({"takenAt": DAY})[0] == "day:1970-01-02"
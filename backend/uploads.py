@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tempfile
+
+from starlette.formparsers import MultiPartParser
+
+# Upload limits: hard cap per request, and where named copies of large uploads go (empty = system temp dir)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "") or None
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload goes over UPLOAD_MAX_BYTES"""
+
+
+class SpooledUpload:
+    """An upload left where Starlette spooled it: in memory while small, in an
+    anonymous temp file once it grows.
+
+    The SHA-256 and size come from one read pass over that file. Decoders get
+    the data as bytes (small uploads) or a read-only mmap; a named copy is only
+    written when a consumer needs a file path (PDF pages go to worker processes
+    by path).
+    """
+
+    def __init__(self, file=None, path=None):
+        self.size = 0
+        self.path = path
+        self._file = file  # Starlette's spooled file, once it is on disk
+        self._data = None  # the bytes of a small upload
+        self._owns_path = False
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    async def source(self):
+        """The upload as a file path when on disk, else as bytes"""
+        if self._data is not None:
+            return self._data
+        if self.path is None:
+            fd, path = tempfile.mkstemp(prefix="upload-", dir=UPLOAD_SPOOL_DIR)
+            os.close(fd)
+            self.path = await asyncio.to_thread(self._copy_to, path)
+            self._owns_path = True
+        return self.path
+
+    def open(self):
+        """Read-only file object over the upload (mmap when on disk); close it when done"""
+        if self._data is not None or self.size == 0:
+            return io.BytesIO(self._data or b"")
+        if self.path:
+            with open(self.path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _copy_to(self, dest_path):
+        with open(dest_path, 'wb') as out:
+            if self._data is not None:
+                out.write(self._data)
+            else:
+                self._file.seek(0)
+                shutil.copyfileobj(self._file, out, UPLOAD_CHUNK_BYTES)
+        return dest_path
+
+    async def persist(self, dest_path):
+        """Store the upload at dest_path and hand ownership of that file to the caller"""
+        if self._owns_path:
+            shutil.move(self.path, dest_path)
+            self.path = None
+            self._owns_path = False
+            return dest_path
+        return await asyncio.to_thread(self._copy_to, dest_path)
+
+    def close(self):
+        if self._owns_path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self._owns_path = False
+        self._file = None
+        self._data = None
+
+
+def _hash_file(upload, file, max_bytes):
+    file.seek(0)
+    for chunk in iter(lambda: file.read(UPLOAD_CHUNK_BYTES), b""):
+        upload.size += len(chunk)
+        if upload.size > max_bytes:
+            raise UploadTooLarge()
+        upload._hash.update(chunk)
+
+
+def _fileno(file):
+    """The file's descriptor, or None for in-memory file objects"""
+    try:
+        return file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+async def spool_upload(file, max_bytes=UPLOAD_MAX_BYTES):
+    """Wrap a FastAPI UploadFile as a SpooledUpload, reusing the file Starlette already spooled"""
+    spooled = file.file
+    upload = SpooledUpload()
+    if file.size is not None and file.size <= MultiPartParser.max_file_size:
+        # Still in Starlette's memory buffer (asking it for fileno() would roll it to disk)
+        spooled.seek(0)
+        data = spooled.read()
+        if len(data) > max_bytes:
+            raise UploadTooLarge()
+        upload.size = len(data)
+        upload._hash.update(data)
+        upload._data = data
+        return upload
+
+    # On disk: hash it off the event loop and read it in place from then on
+    await asyncio.to_thread(_hash_file, upload, spooled, max_bytes)
+    if _fileno(spooled) is None:
+        # A file object with no descriptor to mmap; it is in memory already
+        spooled.seek(0)
+        upload._data = spooled.read()
+    else:
+        upload._file = spooled
+    return upload
+
+
+def load_spooled_file(path):
+    """Wrap a file already on disk (e.g. a queued job's upload) as a SpooledUpload"""
+    upload = SpooledUpload(path=path)
+    with open(path, 'rb') as f:
+        _hash_file(upload, f, float("inf"))
+    return upload
+
+
+class UploadLimitMiddleware:
+    """Reject multipart uploads over max_bytes while the body is still streaming in"""
+
+    def __init__(self, app, max_bytes=UPLOAD_MAX_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    if response_started:
+                        raise UploadTooLarge()
+                    # Answer 413 here: raised from receive, FastAPI's body parsing
+                    # would turn the error into a 400. The app then sees a
+                    # disconnect and whatever it sends is dropped.
+                    rejected = True
+                    await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            if not response_started:
+                await self._reject(send)
+
+    @staticmethod
+    def _is_multipart(scope):
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                return value.startswith(b"multipart/form-data")
+        return False
+
+    async def _reject(self, send):
+        body = f'{{"error": "Upload exceeds the {self.max_bytes} byte limit"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
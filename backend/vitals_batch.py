@@ -0,0 +1,222 @@
+"""Vectorized version of the rule-based scoring in generate_mock_vitals_analysis.
+
+Fields that are missing or fail to parse are masked: like the per-patient
+rules, the metric stays "Normal" and adds no risk factor. Thresholds and
+deductions come from vitals_rules; a batch has no visit history, so the
+per-patient trend penalties do not apply. Temperature and respiratory rate,
+which the rules flag but do not score, are not batch columns.
+"""
+import numpy as np
+
+from vitals_rules import (
+    BP_CRITICAL_ABOVE, BP_WARNING_ABOVE, HEART_RATE_RANGE, SPO2_CRITICAL_BELOW, SPO2_WARNING_BELOW, BMI_RANGE,
+    STATUS_DEDUCTIONS, HISTORY_DEDUCTIONS, MIN_SCORE, RISK_FACTORS
+)
+
+NORMAL, WARNING, CRITICAL = 0, 1, 2
+STATUS_NAMES = np.array(["Normal", "Warning", "Critical"])
+
+# Defaults used by generate_mock_vitals_analysis when a field is absent
+FIELD_DEFAULTS = {
+    'systolic': 120,
+    'diastolic': 80,
+    'heartRate': 72,
+    'oxygenSaturation': 98
+}
+HISTORY_FIELDS = tuple(HISTORY_DEDUCTIONS)
+VITALS_FIELDS = tuple(FIELD_DEFAULTS) + ('height', 'weight') + HISTORY_FIELDS
+
+# Risk flags, in the order the per-patient rules add their risk factors
+RISK_FLAGS = tuple(
+    (flag, RISK_FACTORS[flag])
+    for flag in ("bpCritical", "bpWarning", "hrHigh", "spo2Low") + HISTORY_FIELDS
+)
+RISK_FLAG_BITS = {name: 1 << i for i, (name, _) in enumerate(RISK_FLAGS)}
+
+
+def _parse_each(values, convert):
+    parsed = np.zeros(len(values), dtype=np.float64)
+    valid = np.zeros(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            parsed[i] = convert(value)
+            valid[i] = True
+        except Exception:
+            pass
+    return parsed, valid
+
+
+def parse_int_column(values, n):
+    """Parse a column with int() semantics; returns (values, valid mask)"""
+    arr = np.asarray(values)
+    if arr.shape != (n,):
+        raise ValueError(f"expected {n} values, got shape {arr.shape}")
+    if arr.dtype.kind in 'biu':
+        return arr.astype(np.float64), np.ones(n, dtype=bool)
+    if arr.dtype.kind == 'f':
+        valid = np.isfinite(arr)
+        return np.trunc(np.where(valid, arr, 0.0)), valid
+    if arr.dtype.kind in 'US':
+        try:
+            return arr.astype(np.int64).astype(np.float64), np.ones(n, dtype=bool)
+        except (ValueError, OverflowError):
+            pass
+    return _parse_each(list(values), int)
+
+
+def parse_float_column(values, n):
+    """Parse a column with float() semantics; returns (values, valid mask)"""
+    arr = np.asarray(values)
+    if arr.shape != (n,):
+        raise ValueError(f"expected {n} values, got shape {arr.shape}")
+    if arr.dtype.kind in 'biuf':
+        arr = arr.astype(np.float64)
+        return arr, np.isfinite(arr)
+    if arr.dtype.kind in 'US':
+        try:
+            arr = arr.astype(np.float64)
+            return arr, np.isfinite(arr)
+        except ValueError:
+            pass
+    parsed, valid = _parse_each(list(values), float)
+    return parsed, valid & np.isfinite(parsed)
+
+
+def truthy_column(values, n):
+    """Python truthiness of each element, as a boolean array"""
+    if values is None:
+        return np.zeros(n, dtype=bool)
+    arr = np.asarray(values)
+    if arr.shape != (n,):
+        raise ValueError(f"expected {n} values, got shape {arr.shape}")
+    if arr.dtype.kind in 'biuf':
+        return arr != 0
+    if arr.dtype.kind in 'US':
+        return np.char.str_len(arr) > 0
+    return np.fromiter((bool(v) for v in values), dtype=bool, count=n)
+
+
+def records_to_columns(records):
+    """Turn a list of vitals dicts into columns, applying the per-patient defaults"""
+    columns = {}
+    for field in VITALS_FIELDS:
+        default = FIELD_DEFAULTS.get(field)
+        columns[field] = [record.get(field, default) for record in records]
+    return columns
+
+
+def score_vitals_batch(columns):
+    """Score many patients at once from columnar vitals.
+
+    Returns NumPy arrays: per-metric status codes (0 Normal, 1 Warning,
+    2 Critical), a masked BMI array, a risk flag bitmask, overallScore and
+    the masks of fields that could not be parsed.
+    """
+    lengths = {len(v) for v in columns.values() if v is not None}
+    if len(lengths) > 1:
+        raise ValueError("all columns must have the same length")
+    n = lengths.pop() if lengths else 0
+
+    def int_field(field):
+        values = columns.get(field)
+        if values is None:
+            return np.full(n, float(FIELD_DEFAULTS[field])), np.ones(n, dtype=bool)
+        return parse_int_column(values, n)
+
+    risk = np.zeros(n, dtype=np.uint16)
+    score = np.full(n, 100, dtype=np.int64)
+
+    # BMI - only computed when both height and weight are truthy
+    height_raw, weight_raw = columns.get('height'), columns.get('weight')
+    has_bmi_inputs = truthy_column(height_raw, n) & truthy_column(weight_raw, n)
+    if height_raw is not None and weight_raw is not None:
+        height, height_ok = parse_float_column(height_raw, n)
+        weight, weight_ok = parse_float_column(weight_raw, n)
+    else:
+        height = weight = np.zeros(n)
+        height_ok = weight_ok = np.zeros(n, dtype=bool)
+    bmi_ok = has_bmi_inputs & height_ok & weight_ok & (height != 0)
+    height_m = np.where(bmi_ok, height, 100.0) / 100
+    bmi_values = np.where(bmi_ok, weight / height_m ** 2, 0.0)
+    bmi_ok &= np.isfinite(bmi_values)
+    bmi = np.ma.masked_array(bmi_values, mask=~bmi_ok)
+    bmi_status = np.where(bmi_ok & ((bmi_values < BMI_RANGE[0]) | (bmi_values > BMI_RANGE[1])), WARNING, NORMAL)
+
+    # Blood pressure - both values must parse for either to count
+    systolic, systolic_ok = int_field('systolic')
+    diastolic, diastolic_ok = int_field('diastolic')
+    bp_ok = systolic_ok & diastolic_ok
+    bp_critical = bp_ok & ((systolic > BP_CRITICAL_ABOVE[0]) | (diastolic > BP_CRITICAL_ABOVE[1]))
+    bp_warning = bp_ok & ~bp_critical & ((systolic > BP_WARNING_ABOVE[0]) | (diastolic > BP_WARNING_ABOVE[1]))
+    bp_status = np.select([bp_critical, bp_warning], [CRITICAL, WARNING], NORMAL)
+    risk |= np.where(bp_critical, RISK_FLAG_BITS['bpCritical'], 0).astype(np.uint16)
+    risk |= np.where(bp_warning, RISK_FLAG_BITS['bpWarning'], 0).astype(np.uint16)
+
+    # Heart rate
+    heart_rate, hr_ok = int_field('heartRate')
+    hr_high = hr_ok & (heart_rate > HEART_RATE_RANGE[1])
+    hr_status = np.where(hr_high | (hr_ok & (heart_rate < HEART_RATE_RANGE[0])), WARNING, NORMAL)
+    risk |= np.where(hr_high, RISK_FLAG_BITS['hrHigh'], 0).astype(np.uint16)
+
+    # SpO2
+    spo2, spo2_ok = int_field('oxygenSaturation')
+    spo2_low = spo2_ok & (spo2 < SPO2_WARNING_BELOW)
+    spo2_status = np.select([spo2_ok & (spo2 < SPO2_CRITICAL_BELOW), spo2_low], [CRITICAL, WARNING], NORMAL)
+    risk |= np.where(spo2_low, RISK_FLAG_BITS['spo2Low'], 0).astype(np.uint16)
+
+    # Medical history
+    history = {field: truthy_column(columns.get(field), n) for field in HISTORY_FIELDS}
+    for field in HISTORY_FIELDS:
+        risk |= np.where(history[field], RISK_FLAG_BITS[field], 0).astype(np.uint16)
+
+    # Overall score, same deductions as the per-patient rules
+    for metric, status in (("Blood Pressure", bp_status), ("Heart Rate", hr_status),
+                           ("Oxygen Level", spo2_status), ("BMI", bmi_status)):
+        deductions = np.array([0] + [STATUS_DEDUCTIONS[metric].get(name, 0) for name in ("Warning", "Critical")])
+        score -= deductions[status]
+    for field, points in HISTORY_DEDUCTIONS.items():
+        score -= np.where(history[field], points, 0)
+    score = np.maximum(score, MIN_SCORE)
+
+    return {
+        "count": n,
+        "overallScore": score,
+        "bmi": bmi,
+        "bpStatus": bp_status.astype(np.int8),
+        "hrStatus": hr_status.astype(np.int8),
+        "spo2Status": spo2_status.astype(np.int8),
+        "bmiStatus": bmi_status.astype(np.int8),
+        "riskFlags": risk,
+        "masked": {
+            "bloodPressure": ~bp_ok,
+            "heartRate": ~hr_ok,
+            "oxygenSaturation": ~spo2_ok,
+            "bmi": ~bmi_ok
+        }
+    }
+
+
+def risk_flag_names(flags):
+    """Decode one risk flag bitmask into flag names"""
+    return [name for name, _ in RISK_FLAGS if flags & RISK_FLAG_BITS[name]]
+
+
+def batch_result_to_json(result):
+    """Convert score_vitals_batch output into JSON-friendly columns"""
+    bmi = np.round(result["bmi"].filled(np.nan), 1)
+    names_by_flags = {int(flags): risk_flag_names(flags) for flags in np.unique(result["riskFlags"])}
+    bmi_list = [None if masked else float(value) for value, masked in zip(bmi.tolist(), result["bmi"].mask.tolist())]
+    return {
+        "count": result["count"],
+        "overallScore": result["overallScore"].tolist(),
+        "bmi": bmi_list,
+        "status": {
+            "bloodPressure": STATUS_NAMES[result["bpStatus"]].tolist(),
+            "heartRate": STATUS_NAMES[result["hrStatus"]].tolist(),
+            "oxygenLevel": STATUS_NAMES[result["spo2Status"]].tolist(),
+            "bmi": STATUS_NAMES[result["bmiStatus"]].tolist()
+        },
+        "riskFlags": [names_by_flags[flags] for flags in result["riskFlags"].tolist()],
+        "masked": {name: mask.tolist() for name, mask in result["masked"].items()},
+        "riskFlagDescriptions": dict(RISK_FLAGS)
+    }
@@ -0,0 +1,197 @@
+"""Incremental version of the rule-based scoring in generate_mock_vitals_analysis,
+for bedside monitors that stream readings over a WebSocket.
+
+A MonitorSession keeps the latest value of each field, the status of each
+metric and the running score deduction. A reading only re-evaluates the
+metrics whose fields it changes, so an update costs O(1) whatever the stream
+length, and it yields events only for what changed: metric statuses, new
+alerts and the risk tier (the overallScore band).
+
+Thresholds, deductions and tiers come from vitals_rules, like the per-visit
+rules. The trend penalties of generate_mock_vitals_analysis (sustained
+abnormal or rising readings across visits) are not applied: a stream's
+score and tier reflect the current readings only. The narrative analysis
+generated for a settled tier does take the patient's previous visits into
+account, so its overallScore can be lower than the stream's. Stream
+readings are not visits and are never stored in the vitals history.
+"""
+import os
+
+from vitals_rules import (
+    STATUS_DEDUCTIONS, HISTORY_DEDUCTIONS, MIN_SCORE, HEART_RATE_RANGE, RISK_FACTORS, score_tier,
+    classify_blood_pressure, classify_heart_rate, classify_oxygen, classify_bmi
+)
+
+# Most concurrent monitor streams per worker; further connections are refused
+VITALS_MONITOR_MAX_STREAMS = int(os.getenv("VITALS_MONITOR_MAX_STREAMS", "5000"))
+# A stream with no reading for this long is closed (a monitor that went away)
+VITALS_MONITOR_IDLE_SECONDS = float(os.getenv("VITALS_MONITOR_IDLE_SECONDS", "300"))
+# A new risk tier must hold this long before its narrative is generated, so a
+# reading hovering at a threshold does not cause a model call per flip
+VITALS_MONITOR_SETTLE_SECONDS = float(os.getenv("VITALS_MONITOR_SETTLE_SECONDS", "5"))
+
+SEVERITY = {"Normal": 0, "Warning": 1, "Critical": 2}
+
+# Fields that feed each metric
+METRIC_FIELDS = {
+    "Blood Pressure": ("systolic", "diastolic"),
+    "Heart Rate": ("heartRate",),
+    "Oxygen Level": ("oxygenSaturation",),
+    "BMI": ("height", "weight")
+}
+FIELD_METRICS = {field: metric for metric, fields in METRIC_FIELDS.items() for field in fields}
+# Kept in the snapshot but not tracked: the rules flag them without a score
+# deduction, so they cannot move the tier (the narrative analysis assesses them)
+PASSIVE_FIELDS = ("temperature", "respiratoryRate")
+
+
+def blood_pressure_status(vitals):
+    try:
+        systolic = int(vitals.get('systolic', 120))
+        diastolic = int(vitals.get('diastolic', 80))
+    except (TypeError, ValueError):
+        return "Normal", None, None
+    value = f"{systolic}/{diastolic} mmHg"
+    status = classify_blood_pressure(systolic, diastolic)
+    if status == "Normal":
+        return status, value, None
+    return status, value, RISK_FACTORS["bpCritical" if status == "Critical" else "bpWarning"]
+
+
+def heart_rate_status(vitals):
+    try:
+        hr = int(vitals.get('heartRate', 72))
+    except (TypeError, ValueError):
+        return "Normal", None, None
+    value = f"{hr} bpm"
+    return classify_heart_rate(hr), value, RISK_FACTORS["hrHigh"] if hr > HEART_RATE_RANGE[1] else None
+
+
+def oxygen_status(vitals):
+    try:
+        spo2 = int(vitals.get('oxygenSaturation', 98))
+    except (TypeError, ValueError):
+        return "Normal", None, None
+    value = f"{spo2}%"
+    status = classify_oxygen(spo2)
+    return status, value, RISK_FACTORS["spo2Low"] if status != "Normal" else None
+
+
+def bmi_status(vitals):
+    try:
+        if not (vitals.get('height') and vitals.get('weight')):
+            return "Normal", None, None
+        bmi = float(vitals['weight']) / (float(vitals['height']) / 100) ** 2
+    except (TypeError, ValueError, ZeroDivisionError):
+        return "Normal", None, None
+    return classify_bmi(bmi), f"{bmi:.1f}", None
+
+
+METRIC_RULES = {
+    "Blood Pressure": blood_pressure_status,
+    "Heart Rate": heart_rate_status,
+    "Oxygen Level": oxygen_status,
+    "BMI": bmi_status
+}
+
+
+class MonitorSession:
+    """Scoring state of one monitor stream"""
+
+    __slots__ = ("patient", "vitals", "statuses", "alerts", "penalty", "tier", "readings")
+
+    def __init__(self, patient=None):
+        self.patient = patient or {}
+        self.vitals = {}
+        self.statuses = dict.fromkeys(METRIC_RULES, "Normal")
+        # Status at which each metric's current alert was raised
+        self.alerts = dict.fromkeys(METRIC_RULES)
+        # Sum of all deductions, before the minimum score is applied
+        self.penalty = 0
+        self.tier = score_tier(self.score)
+        self.readings = 0
+
+    @property
+    def score(self):
+        return max(100 - self.penalty, MIN_SCORE)
+
+    def update(self, reading):
+        """Apply a (partial) reading; returns the events it causes, [] if nothing changed"""
+        self.readings += 1
+        changed = set()
+        for field, value in reading.items():
+            if field in HISTORY_DEDUCTIONS:
+                if bool(value) != bool(self.vitals.get(field)):
+                    self.penalty += HISTORY_DEDUCTIONS[field] if value else -HISTORY_DEDUCTIONS[field]
+                self.vitals[field] = bool(value)
+            elif field in FIELD_METRICS:
+                if self.vitals.get(field) != value:
+                    self.vitals[field] = value
+                    changed.add(FIELD_METRICS[field])
+            elif field in PASSIVE_FIELDS:
+                self.vitals[field] = value
+
+        events = []
+        for metric in changed:
+            status, value, alert = METRIC_RULES[metric](self.vitals)
+            previous = self.statuses[metric]
+            if status != previous:
+                deductions = STATUS_DEDUCTIONS[metric]
+                self.penalty += deductions.get(status, 0) - deductions.get(previous, 0)
+                self.statuses[metric] = status
+                events.append({"type": "status", "metric": metric, "status": status, "previous": previous, "value": value})
+            # Alert when a risk factor appears or gets more severe, not on every reading
+            raised = self.alerts[metric]
+            if alert and (raised is None or SEVERITY[status] > SEVERITY[raised]):
+                events.append({"type": "alert", "metric": metric, "level": status, "message": alert, "value": value})
+            self.alerts[metric] = status if alert else None
+
+        tier = score_tier(self.score)
+        if tier != self.tier:
+            events.append({"type": "tier", "tier": tier, "previous": self.tier})
+            self.tier = tier
+        return events
+
+    def snapshot(self):
+        """Current vitals in the shape of an /api/analyze-vitals request"""
+        return dict(self.vitals)
+
+
+class MonitorHub:
+    """Open stream count and event counters for all monitor streams of a worker"""
+
+    def __init__(self, max_streams=VITALS_MONITOR_MAX_STREAMS):
+        self.max_streams = max_streams
+        self.active = 0
+        self.opened = 0
+        self.refused = 0
+        self.readings = 0
+        self.invalid = 0
+        self.events = {"status": 0, "alert": 0, "tier": 0, "narrative": 0}
+
+    def open(self):
+        """Claim a stream slot; False when the worker is at its limit"""
+        if self.active >= self.max_streams:
+            self.refused += 1
+            return False
+        self.active += 1
+        self.opened += 1
+        return True
+
+    def close(self):
+        self.active -= 1
+
+    def count(self, events):
+        for event in events:
+            self.events[event["type"]] += 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "maxStreams": self.max_streams,
+            "opened": self.opened,
+            "refused": self.refused,
+            "readings": self.readings,
+            "invalid": self.invalid,
+            "events": dict(self.events)
+        }
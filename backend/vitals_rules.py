@@ -0,0 +1,123 @@
+"""Thresholds, deductions and risk tiers of the rule-based vitals scoring.
+
+generate_mock_vitals_analysis, its incremental (vitals_monitor) and
+vectorized (vitals_batch) versions, the lab parser's blood pressure and the
+vitals history all classify with these, so a change here reaches them all.
+"""
+
+# Blood pressure (mmHg): Critical / Warning when systolic or diastolic is above
+BP_CRITICAL_ABOVE = (140, 90)
+BP_WARNING_ABOVE = (130, 85)
+# Heart rate (bpm) outside this range is a Warning
+HEART_RATE_RANGE = (60, 100)
+# SpO2 (%) below these is Critical / Warning
+SPO2_CRITICAL_BELOW = 90
+SPO2_WARNING_BELOW = 95
+# BMI outside this range is a Warning
+BMI_RANGE = (18.5, 25)
+# Body temperature (°F; values below 45 are taken as °C) and respiratory rate
+# (/min): Warning outside the first range, Critical outside the second. These
+# are flagged but deduct nothing from the score.
+TEMPERATURE_RANGE = (97.0, 99.5)
+TEMPERATURE_CRITICAL_RANGE = (95.0, 103.0)
+RESPIRATORY_RATE_RANGE = (12, 20)
+RESPIRATORY_RATE_CRITICAL_RANGE = (8, 30)
+
+# Vitals form fields and how the rules parse them. Height and weight only
+# count together (BMI); the rest are needed for a complete assessment.
+CORE_VITALS = {
+    "systolic": int,
+    "diastolic": int,
+    "heartRate": int,
+    "oxygenSaturation": int,
+    "temperature": float,
+    "respiratoryRate": float
+}
+BMI_FIELDS = ("height", "weight")
+
+# Score deductions per metric status and per medical history flag
+STATUS_DEDUCTIONS = {
+    "Blood Pressure": {"Warning": 10, "Critical": 20},
+    "Heart Rate": {"Warning": 5},
+    "Oxygen Level": {"Warning": 10, "Critical": 20},
+    "BMI": {"Warning": 5}
+}
+HISTORY_DEDUCTIONS = {"heartDisease": 10, "diabetes": 5, "hypertension": 5}
+MIN_SCORE = 50
+
+# overallScore bands of the risk tiers: Normal above the first, Warning above the second
+TIER_NORMAL_ABOVE = 80
+TIER_WARNING_ABOVE = 70
+
+# Risk factors the rules add, by flag
+RISK_FACTORS = {
+    "bpCritical": "Elevated blood pressure - requires immediate attention",
+    "bpWarning": "Slightly elevated blood pressure - monitor closely",
+    "hrHigh": "Elevated heart rate - may indicate stress or cardiovascular strain",
+    "spo2Low": "Low oxygen saturation - respiratory assessment recommended",
+    "temperature": "Abnormal body temperature - assess for fever or hypothermia",
+    "respiratoryRate": "Abnormal respiratory rate - respiratory assessment recommended",
+    "heartDisease": "Pre-existing heart disease - requires ongoing monitoring",
+    "diabetes": "Diabetes - blood sugar control is essential",
+    "hypertension": "History of hypertension - blood pressure monitoring critical"
+}
+
+
+def score_tier(score):
+    """Risk tier (Normal / Warning / Critical) of an overallScore"""
+    return "Normal" if score > TIER_NORMAL_ABOVE else "Warning" if score > TIER_WARNING_ABOVE else "Critical"
+
+
+def classify_blood_pressure(systolic, diastolic):
+    if systolic > BP_CRITICAL_ABOVE[0] or diastolic > BP_CRITICAL_ABOVE[1]:
+        return "Critical"
+    if systolic > BP_WARNING_ABOVE[0] or diastolic > BP_WARNING_ABOVE[1]:
+        return "Warning"
+    return "Normal"
+
+
+def classify_heart_rate(heart_rate):
+    return "Normal" if HEART_RATE_RANGE[0] <= heart_rate <= HEART_RATE_RANGE[1] else "Warning"
+
+
+def classify_oxygen(spo2):
+    if spo2 < SPO2_CRITICAL_BELOW:
+        return "Critical"
+    return "Warning" if spo2 < SPO2_WARNING_BELOW else "Normal"
+
+
+def classify_bmi(bmi):
+    return "Normal" if BMI_RANGE[0] <= bmi <= BMI_RANGE[1] else "Warning"
+
+
+def _classify_range(value, normal, critical):
+    if not critical[0] <= value <= critical[1]:
+        return "Critical"
+    return "Normal" if normal[0] <= value <= normal[1] else "Warning"
+
+
+def classify_temperature(temperature):
+    if temperature < 45:
+        temperature = temperature * 9 / 5 + 32
+    return _classify_range(temperature, TEMPERATURE_RANGE, TEMPERATURE_CRITICAL_RANGE)
+
+
+def classify_respiratory_rate(rate):
+    return _classify_range(rate, RESPIRATORY_RATE_RANGE, RESPIRATORY_RATE_CRITICAL_RANGE)
+
+
+def unscored_vitals(vitals):
+    """Fields the rules cannot assess: core vitals that are missing or do not parse, and half a BMI"""
+    vitals = vitals or {}
+    unscored = []
+    for field, parse in CORE_VITALS.items():
+        try:
+            parse(vitals[field])
+        except (KeyError, TypeError, ValueError):
+            unscored.append(field)
+    if any(vitals.get(field) for field in BMI_FIELDS):
+        try:
+            float(vitals["weight"]) / (float(vitals["height"]) / 100) ** 2
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            unscored += list(BMI_FIELDS)
+    return unscored
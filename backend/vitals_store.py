@@ -0,0 +1,378 @@
+"""Per-patient vitals / lab metric history with rolling trend aggregates.
+
+Every reading is appended to an observations table. Alongside it each
+(patient, metric) series keeps a fixed window of recent visits (a packed
+array of doubles) and running sums, updated incrementally on insert, so
+the moving average, least-squares slope and abnormal streaks of a series
+are read back in O(1) instead of re-scanning or re-sending the history.
+
+A series holds one point per visit: the client's visit id, or else the
+(UTC) day of the reading. The latest visit is kept apart from the window
+until the next visit starts, so a re-submitted or corrected form replaces
+it instead of adding a point, and a re-analysis of that visit can leave
+it out of its own "previous visits" trends.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from vitals_rules import score_tier
+
+# Vitals history settings
+VITALS_DB_PATH = os.getenv("VITALS_DB_PATH", "vitals.db")
+# Visits per series used for the moving average and slope
+VITALS_TREND_WINDOW = max(int(os.getenv("VITALS_TREND_WINDOW", "10")), 1)
+# Slopes and abnormal streaks are reported only once they span this many days
+VITALS_TREND_MIN_DAYS = float(os.getenv("VITALS_TREND_MIN_DAYS", "1"))
+
+STATUS_CODES = {"Normal": 0, "Warning": 1, "Critical": 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+SECONDS_PER_DAY = 86400.0
+
+# Vitals form fields (and the analysis metric whose status applies to them)
+VITAL_SERIES = {
+    "systolic": "Blood Pressure",
+    "diastolic": "Blood Pressure",
+    "heartRate": "Heart Rate",
+    "temperature": "Temperature",
+    "respiratoryRate": "Respiratory Rate",
+    "oxygenSaturation": "Oxygen Level",
+    "weight": "BMI",
+    "bmi": "BMI"
+}
+SERIES_LABELS = {
+    "systolic": "Systolic BP (mmHg)",
+    "diastolic": "Diastolic BP (mmHg)",
+    "heartRate": "Heart rate (bpm)",
+    "temperature": "Temperature",
+    "respiratoryRate": "Respiratory rate (/min)",
+    "oxygenSaturation": "SpO2 (%)",
+    "weight": "Weight (kg)",
+    "bmi": "BMI",
+    "overallScore": "Health score"
+}
+# Lab metrics that are really vitals go into the same series
+LAB_TO_VITAL = {"Heart Rate": "heartRate", "BMI": "bmi"}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_BP_RE = re.compile(r"(\d{2,3})\s*/\s*(\d{2,3})")
+
+
+def patient_key(patient):
+    """The patient `id` the client sends; None without one (names are not unique, so no history)"""
+    patient_id = str((patient or {}).get("id") or "").strip()
+    return patient_id or None
+
+
+def _timestamp(value):
+    """Epoch seconds from a number or an ISO 8601 string; None if unreadable"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def reading_visit(vitals):
+    """(visit, ts) of a vitals form, from the `visitId` and `takenAt` the client may send.
+
+    Without a visit id, readings of the same (UTC) day are one visit.
+    """
+    vitals = vitals or {}
+    ts = _timestamp(vitals["takenAt"]) if vitals.get("takenAt") not in (None, "") else None
+    if ts is None:
+        ts = time.time()
+    visit = str(vitals.get("visitId") or "").strip()
+    return visit or _day(ts), ts
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        match = _NUMBER_RE.search(str(value or "").replace(",", ""))
+        return float(match.group()) if match else None
+
+
+def vitals_readings(vitals, analysis):
+    """(metric, value, status) readings from a vitals form and its analysis result"""
+    statuses = {m.get("name"): m.get("status", "Normal") for m in analysis.get("metrics", [])}
+    values = {field: _number(vitals.get(field)) for field in VITAL_SERIES if field != "bmi"}
+    try:
+        values["bmi"] = round(float(vitals["weight"]) / (float(vitals["height"]) / 100) ** 2, 1)
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        values["bmi"] = None
+    readings = [
+        (field, value, statuses.get(VITAL_SERIES[field], "Normal"))
+        for field, value in values.items() if value is not None
+    ]
+    score = _number(analysis.get("overallScore"))
+    if score is not None:
+        readings.append(("overallScore", score, score_tier(score)))
+    return readings
+
+
+def lab_readings(metrics):
+    """(metric, value, status) readings from analyzed lab report metrics"""
+    readings = []
+    for metric in metrics:
+        name, status = metric.get("name", ""), metric.get("status", "Normal")
+        bp = _BP_RE.search(str(metric.get("value", "")))
+        if name == "Blood Pressure" and bp:
+            readings.append(("systolic", float(bp.group(1)), status))
+            readings.append(("diastolic", float(bp.group(2)), status))
+            continue
+        value = _number(metric.get("value"))
+        if name and value is not None:
+            readings.append((LAB_TO_VITAL.get(name, name), value, status))
+    return readings
+
+
+def _day(ts):
+    return time.strftime("day:%Y-%m-%d", time.gmtime(ts))
+
+
+def _extend_streak(streak, since, abnormal, ts):
+    """(streak, since) after one more visit; since is the ts of the streak's first visit"""
+    if not abnormal:
+        return 0, None
+    return streak + 1, since if streak else ts
+
+
+class VitalsStore:
+    """SQLite-backed observation log plus incrementally maintained per-visit series aggregates"""
+
+    def __init__(self, db_path=VITALS_DB_PATH, window=VITALS_TREND_WINDOW, min_days=VITALS_TREND_MIN_DAYS):
+        self.window = window
+        self.min_days = min_days
+        self.recorded = 0
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS observations ("
+            "patient TEXT NOT NULL, metric TEXT NOT NULL, ts REAL NOT NULL, "
+            "value REAL NOT NULL, status INTEGER NOT NULL, visit TEXT)"
+        )
+        try:
+            # Databases created before readings were grouped by visit
+            self._db.execute("ALTER TABLE observations ADD COLUMN visit TEXT")
+        except sqlite3.OperationalError:
+            pass
+        self._db.execute("CREATE INDEX IF NOT EXISTS observations_series ON observations (patient, metric, ts)")
+        # The per-reading aggregates of earlier versions; rebuilt below as per-visit ones
+        self._db.execute("DROP TABLE IF EXISTS series")
+        # last_*: the latest visit, kept out of the window until the next one starts.
+        # window: packed doubles (x0, y0, x1, y1, ...) of the visits before it, x in days since first_ts;
+        # the sums and streaks cover the same visits.
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS visit_series ("
+            "patient TEXT NOT NULL, metric TEXT NOT NULL, count INTEGER NOT NULL, first_ts REAL NOT NULL, "
+            "last_visit TEXT NOT NULL, last_ts REAL NOT NULL, last_value REAL NOT NULL, last_status INTEGER NOT NULL, "
+            "window BLOB NOT NULL, sum_x REAL NOT NULL, sum_y REAL NOT NULL, sum_xx REAL NOT NULL, sum_xy REAL NOT NULL, "
+            "warning_streak INTEGER NOT NULL, critical_streak INTEGER NOT NULL, warning_since REAL, critical_since REAL, "
+            "PRIMARY KEY (patient, metric))"
+        )
+        if self._db.execute("SELECT NOT EXISTS (SELECT 1 FROM visit_series)").fetchone()[0]:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Aggregate an existing observation log (readings without a visit id count by day)"""
+        rows = self._db.execute(
+            "SELECT patient, metric, ts, value, status, visit FROM observations ORDER BY ts"
+        ).fetchall()
+        if not rows:
+            return
+        self._db.execute("BEGIN")
+        for patient, metric, ts, value, status, visit in rows:
+            self._add(patient, metric, value, status, ts, visit or _day(ts), log=False)
+        self._db.execute("COMMIT")
+
+    def record(self, patient, readings, visit=None, ts=None):
+        """Append (metric, value, status) readings of one visit for a patient; returns how many were stored.
+
+        Without a visit id the readings belong to the visit of their day. A
+        reading identical to the one already stored for the visit is skipped.
+        """
+        ts = ts if ts is not None else time.time()
+        visit = visit or _day(ts)
+        stored = 0
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for metric, value, status in readings:
+                    if self._add(patient, metric, float(value), STATUS_CODES.get(status, 0), ts, visit):
+                        stored += 1
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.recorded += stored
+            self.deduplicated += len(readings) - stored
+        return stored
+
+    def _add(self, patient, metric, value, status, ts, visit, log=True):
+        row = self._db.execute(
+            "SELECT count, first_ts, last_visit, last_ts, last_value, last_status, window, "
+            "sum_x, sum_y, sum_xx, sum_xy, warning_streak, critical_streak, warning_since, critical_since "
+            "FROM visit_series WHERE patient = ? AND metric = ?", (patient, metric)
+        ).fetchone()
+        if row is None:
+            count, first_ts, window = 1, ts, array("d")
+            sum_x = sum_y = sum_xx = sum_xy = 0.0
+            warning_streak = critical_streak = 0
+            warning_since = critical_since = None
+        else:
+            (count, first_ts, last_visit, last_ts, last_value, last_status, blob, sum_x, sum_y, sum_xx, sum_xy,
+             warning_streak, critical_streak, warning_since, critical_since) = row
+            window = array("d")
+            window.frombytes(blob)
+            if last_visit == visit:
+                # Same visit: the new reading replaces the stored one
+                if last_value == value and last_status == status:
+                    return False
+            else:
+                # A new visit: the previous one joins the window
+                x = (last_ts - first_ts) / SECONDS_PER_DAY
+                window.extend((x, last_value))
+                sum_x += x
+                sum_y += last_value
+                sum_xx += x * x
+                sum_xy += x * last_value
+                if len(window) > 2 * (self.window - 1):
+                    # Slide the window (which leaves room for the latest visit): drop the oldest point
+                    old_x, old_y = window[0], window[1]
+                    del window[:2]
+                    sum_x -= old_x
+                    sum_y -= old_y
+                    sum_xx -= old_x * old_x
+                    sum_xy -= old_x * old_y
+                warning_streak, warning_since = _extend_streak(
+                    warning_streak, warning_since, last_status >= STATUS_CODES["Warning"], last_ts
+                )
+                critical_streak, critical_since = _extend_streak(
+                    critical_streak, critical_since, last_status >= STATUS_CODES["Critical"], last_ts
+                )
+                count += 1
+
+        if log:
+            self._db.execute(
+                "INSERT INTO observations (patient, metric, ts, value, status, visit) VALUES (?, ?, ?, ?, ?, ?)",
+                (patient, metric, ts, value, status, visit)
+            )
+        self._db.execute(
+            "INSERT OR REPLACE INTO visit_series (patient, metric, count, first_ts, last_visit, last_ts, last_value, "
+            "last_status, window, sum_x, sum_y, sum_xx, sum_xy, warning_streak, critical_streak, warning_since, "
+            "critical_since) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (patient, metric, count, first_ts, visit, ts, value, status, window.tobytes(),
+             sum_x, sum_y, sum_xx, sum_xy, warning_streak, critical_streak, warning_since, critical_since)
+        )
+        return True
+
+    def trends(self, patient, exclude_visit=None):
+        """metric -> rolling aggregates over the visits of every series of a patient.
+
+        exclude_visit leaves that visit out, so analyzing it again only sees
+        the visits before it.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT metric, count, first_ts, last_visit, last_ts, last_value, last_status, window, "
+                "sum_x, sum_y, sum_xx, sum_xy, warning_streak, critical_streak, warning_since, critical_since "
+                "FROM visit_series WHERE patient = ?", (patient,)
+            ).fetchall()
+        min_seconds = self.min_days * SECONDS_PER_DAY
+        trends = {}
+        for (metric, count, first_ts, last_visit, last_ts, last_value, last_status, blob, sum_x, sum_y, sum_xx, sum_xy,
+             warning_streak, critical_streak, warning_since, critical_since) in rows:
+            window = array("d")
+            window.frombytes(blob)
+            n = len(window) // 2
+            # Visits can be backdated (takenAt), so the window is not in time order
+            xs = window[0::2]
+            if last_visit != exclude_visit:
+                x = (last_ts - first_ts) / SECONDS_PER_DAY
+                n += 1
+                sum_x += x
+                sum_y += last_value
+                sum_xx += x * x
+                sum_xy += x * last_value
+                span = max(max(xs, default=x), x) - min(min(xs, default=x), x)
+                warning_streak, warning_since = _extend_streak(
+                    warning_streak, warning_since, last_status >= STATUS_CODES["Warning"], last_ts
+                )
+                critical_streak, critical_since = _extend_streak(
+                    critical_streak, critical_since, last_status >= STATUS_CODES["Critical"], last_ts
+                )
+            elif n:
+                count -= 1
+                span = max(xs) - min(xs)
+                last_ts, last_value = first_ts + window[-2] * SECONDS_PER_DAY, window[-1]
+                last_status = STATUS_CODES["Critical"] if critical_streak else STATUS_CODES["Warning"] if warning_streak else 0
+            else:
+                continue
+            spread = n * sum_xx - sum_x * sum_x
+            # Least-squares slope over the window, per day; not over visits too close together to mean anything
+            slope = (n * sum_xy - sum_x * sum_y) / spread if n >= 2 and span >= self.min_days and spread > 1e-9 else None
+            trends[metric] = {
+                "count": count,
+                "window": n,
+                "last": last_value,
+                "lastStatus": STATUS_NAMES[last_status],
+                "lastAt": last_ts,
+                "movingAverage": round(sum_y / n, 2),
+                "slopePerDay": round(slope, 3) if slope is not None else None,
+                # A streak counts once its visits span the minimum too
+                "warningStreak": warning_streak if warning_since is not None and abs(last_ts - warning_since) >= min_seconds else 0,
+                "criticalStreak": critical_streak if critical_since is not None and abs(last_ts - critical_since) >= min_seconds else 0
+            }
+        return trends
+
+    def history(self, patient, metric, limit=100):
+        """Most recent raw readings of one series, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ts, value, status, visit FROM observations WHERE patient = ? AND metric = ? "
+                "ORDER BY ts DESC LIMIT ?", (patient, metric, limit)
+            ).fetchall()
+        return [
+            {"ts": ts, "value": value, "status": STATUS_NAMES[status], "visit": visit}
+            for ts, value, status, visit in reversed(rows)
+        ]
+
+    def stats(self):
+        with self._lock:
+            patients, series = self._db.execute("SELECT COUNT(DISTINCT patient), COUNT(*) FROM visit_series").fetchone()
+        return {
+            "patients": patients,
+            "series": series,
+            "recorded": self.recorded,
+            "deduplicated": self.deduplicated,
+            "window": self.window
+        }
+
+
+def trend_lines(trends, limit=8):
+    """Compact prompt lines for series with history, abnormal streaks first"""
+    rows = [(metric, t) for metric, t in trends.items() if t["count"] >= 2]
+    rows.sort(key=lambda item: (-item[1]["criticalStreak"], -item[1]["warningStreak"], item[0]))
+    lines = []
+    for metric, t in rows[:limit]:
+        line = f"- {SERIES_LABELS.get(metric, metric)}: avg {t['movingAverage']:g} over last {t['window']} visits"
+        if t["slopePerDay"] is not None:
+            # + 0.0 turns -0.0 into 0.0
+            line += f", {round(t['slopePerDay'], 2) + 0.0:+g}/day"
+        if t["criticalStreak"] >= 2:
+            line += f", Critical {t['criticalStreak']} visits in a row"
+        elif t["warningStreak"] >= 2:
+            line += f", abnormal {t['warningStreak']} visits in a row"
+        lines.append(line)
+    return lines
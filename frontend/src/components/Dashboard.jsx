@@ -16,6 +16,8 @@ ChartJS.register(CategoryScale, LinearScale, BarElement, LineElement, PointEleme
 const Dashboard = ({ onLogout }) => {
   const [file, setFile] = useState(null)
   const [patientData, setPatientData] = useState({
+    // Keys the patient's vitals history on the backend; replace with the record number to keep it across sessions
+    id: crypto.randomUUID(),
     name: '',
     age: '',
     gender: 'male',
@@ -102,7 +104,14 @@ const Dashboard = ({ onLogout }) => {
     try {
       const response = await axios.post('/api/analyze-vitals', {
         patient: patientData,
-        vitals: vitals
+        vitals: vitals,
+        // Lets the backend precompute the suggestions for this context
+        labReports: analysisHistory.map(a => ({
+          fileName: a.fileName,
+          metrics: a.data.metrics,
+          summary: a.data.summary,
+          recommendations: a.data.recommendations
+        }))
       })
       setVitalsAnalysis(response.data)
       setVitalsCollapsed(true) // Collapse vitals form after analysis
@@ -243,6 +252,7 @@ const Dashboard = ({ onLogout }) => {
     formData.append('name', patientData.name)
     formData.append('age', patientData.age)
     formData.append('gender', patientData.gender)
+    formData.append('patientId', patientData.id)
 
     try {
       const response = await axios.post('/api/analyze', formData, {
@@ -742,6 +752,18 @@ const Dashboard = ({ onLogout }) => {
           <div className="bg-white rounded-lg shadow p-6">
             <h2 className="text-lg font-semibold text-gray-800 mb-4">Patient Information</h2>
             <div className="space-y-4">
+              <div>
+                <label className="block text-sm font-medium text-gray-700 mb-2">
+                  Patient ID
+                </label>
+                <input
+                  type="text"
+                  value={patientData.id}
+                  onChange={(e) => setPatientData({ ...patientData, id: e.target.value })}
+                  className="w-full px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent outline-none"
+                  placeholder="Medical record number"
+                />
+              </div>
               <div>
                 <label className="block text-sm font-medium text-gray-700 mb-2">
                   Patient Name